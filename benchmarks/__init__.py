@@ -0,0 +1,10 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Performance benchmarks for bnc-bot
+
+Run with `hatch run bench:run --help` or `python -m benchmarks --help`
+"""
@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+from typing import Annotated
+
+import typer
+
+from benchmarks import bindhost, dispatch, load, refresh, replay
+
+app = typer.Typer(help="bnc-bot performance benchmarks")
+
+
+@app.callback()
+def main() -> None:
+    """Run a bnc-bot benchmark"""
+
+
+@app.command("refresh")
+def refresh_cmd(
+    users: Annotated[
+        int, typer.Option(help="Number of users on the fake ZNC")
+    ] = 10_000,
+    window: Annotated[
+        list[int] | None,
+        typer.Option(help="BindHost fetch window(s) to compare"),
+    ] = None,
+    latency: Annotated[
+        float, typer.Option(help="Simulated ZNC round-trip time in seconds")
+    ] = 0.002,
+) -> None:
+    """Time a full user list + BindHost refresh"""
+    results = refresh.bench_refresh(users, window or [1, 8, 32, 128], latency)
+    typer.echo(f"{'window':>8} {'users':>8} {'seconds':>10} {'in flight':>10}")
+    for result in results:
+        typer.echo(
+            f"{result.window:>8} {result.users:>8} "
+            f"{result.seconds:>10.3f} {result.max_in_flight:>10}"
+        )
+
+
+@app.command("alloc")
+def alloc_cmd(
+    network: Annotated[
+        str, typer.Option(help="Network to allocate from")
+    ] = "127.0.0.0/16",
+    occupancy: Annotated[
+        list[float] | None,
+        typer.Option(help="Pool occupancy level(s) to measure at"),
+    ] = None,
+    picks: Annotated[
+        int, typer.Option(help="Allocations to time at each level")
+    ] = 100_000,
+    legacy_picks: Annotated[
+        int, typer.Option(help="Allocations to time with the old dict scan")
+    ] = 20,
+) -> None:
+    """Time bindhost allocation at different pool occupancy levels"""
+    results = bindhost.bench_alloc(
+        network, occupancy or [0.5, 0.9, 0.99], picks, legacy_picks
+    )
+    typer.echo(
+        f"{'occupancy':>10} {'users':>8} {'pool us':>10} {'scan us':>10}"
+    )
+    for result in results:
+        scan = "-" if result.scan_usec is None else f"{result.scan_usec:.1f}"
+        typer.echo(
+            f"{result.occupancy:>10.2%} {result.users:>8} "
+            f"{result.pool_usec:>10.2f} {scan:>10}"
+        )
+
+
+@app.command("dispatch")
+def dispatch_cmd(
+    lines: Annotated[int, typer.Option(help="Lines to dispatch")] = 50_000,
+) -> None:
+    """Time raw line dispatch through Conn.handle_line"""
+    for name, usec in dispatch.bench_dispatch(lines).items():
+        typer.echo(f"{name:>8}: {usec:.2f} us/line")
+
+
+@app.command("replay")
+def replay_cmd(
+    scenario: Annotated[
+        list[replay.ScenarioName] | None,
+        typer.Option(help="Scenario(s) to run"),
+    ] = None,
+    size: Annotated[
+        int, typer.Option(help="Users, requests or queue entries per scenario")
+    ] = 1000,
+    rate: Annotated[
+        float, typer.Option(help="Lines injected per second, 0 for no limit")
+    ] = 0,
+    file: Annotated[
+        Path | None,
+        typer.Option(exists=True, help="Raw server lines to replay instead"),
+    ] = None,
+) -> None:
+    """Drive Conn.run over a socket with a fake IRCd/ZNC"""
+    if file is not None:
+        scenarios = [replay.file_scenario(file)]
+    else:
+        scenarios = [
+            replay.SCENARIOS[name](size)
+            for name in scenario or list(replay.ScenarioName)
+        ]
+
+    typer.echo(
+        f"{'scenario':>18} {'seconds':>8} {'lines/s':>9} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'RSS MiB':>8}"
+    )
+    for result in replay.bench_replay(scenarios, rate):
+        typer.echo(
+            f"{result.scenario:>18} {result.seconds:>8.3f} "
+            f"{result.lines_per_sec:>9.0f} {result.p50 * 1000:>8.1f} "
+            f"{result.p99 * 1000:>8.1f} {result.peak_rss_mib:>8.1f}"
+        )
+
+
+@app.command("load")
+def load_cmd(
+    users: Annotated[
+        int, typer.Option(help="Users in the data file")
+    ] = 100_000,
+    repeat: Annotated[int, typer.Option(help="Loads per loader")] = 3,
+) -> None:
+    """Time loading bnc.json and measure the peak RSS it adds"""
+    typer.echo(
+        f"{'loader':>10} {'users':>8} {'file MiB':>9} {'seconds':>8} "
+        f"{'RSS MiB':>8}"
+    )
+    for result in load.bench_load(users, repeat):
+        typer.echo(
+            f"{result.loader:>10} {result.users:>8} {result.file_mib:>9.1f} "
+            f"{result.seconds:>8.3f} {result.peak_rss_mib:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,64 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark bindhost allocation as the pool fills up
+"""
+
+import ipaddress
+import random
+import time
+from typing import NamedTuple
+
+from bncbot.bindhost import BindHostPool
+
+
+class AllocResult(NamedTuple):
+    occupancy: float
+    users: int
+    pool_usec: float
+    scan_usec: float | None
+
+
+def _legacy_pick(net: ipaddress.IPv4Network, users: dict[str, str]) -> None:
+    # The original approach: random probing against dict.values()
+    for _ in range(50):
+        host = str(net[random.randrange(net.num_addresses)])
+        if host not in users.values():
+            return
+
+
+def bench_alloc(
+    network: str, occupancies: list[float], picks: int, legacy_picks: int
+) -> list[AllocResult]:
+    net = ipaddress.ip_network(network)
+    results = []
+    for occupancy in occupancies:
+        pool = BindHostPool(net)
+        users: dict[str, str] = {}
+        while pool.used < int(pool.size * occupancy):
+            host = pool.pick()
+            pool.claim(host)
+            users[f"user{len(users)}"] = host
+
+        start = time.perf_counter()
+        for _ in range(picks):
+            host = pool.pick()
+            pool.claim(host)
+            pool.release(host)
+
+        pool_usec = (time.perf_counter() - start) / picks * 1e6
+
+        scan_usec = None
+        if legacy_picks and isinstance(net, ipaddress.IPv4Network):
+            start = time.perf_counter()
+            for _ in range(legacy_picks):
+                _legacy_pick(net, users)
+
+            scan_usec = (time.perf_counter() - start) / legacy_picks * 1e6
+
+        results.append(AllocResult(occupancy, len(users), pool_usec, scan_usec))
+
+    return results
@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark the per-line cost of dispatching raw IRC lines to handlers
+"""
+
+import asyncio
+import inspect
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING
+from unittest import mock
+
+from irclib.parser import Message
+
+from benchmarks.fake_znc import FakeZNC, make_conn
+
+if TYPE_CHECKING:
+    from bncbot.bot import Hook
+    from bncbot.event import Event
+
+LINES = [
+    ":nick!user@host.example PRIVMSG #chan :just some chatter",
+    ":nick!user@host.example NOTICE BNCServ :hello",
+    ":irc.example 372 BNCServ :- message of the day",
+    "PING :irc.example",
+    ":nick!user@host.example PRIVMSG BNCServ :.unknowncmd",
+    ":other!user@host.example JOIN #chan",
+]
+
+
+async def _legacy_launch_hook(event: "Event", hook: "Hook") -> bool:
+    # Dispatch as it was done before handler parameters were precomputed and
+    # plain functions were run on the event loop
+    params = [
+        getattr(event, name)
+        for name in inspect.signature(hook.func).parameters.keys()
+    ]
+    if asyncio.iscoroutinefunction(hook.func):
+        await hook.func(*params)
+    else:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(hook.func, *params))
+
+    return True
+
+
+async def _time_dispatch(lines: int, legacy: bool) -> float:
+    messages = [Message.parse(line) for line in LINES]
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = make_conn(Path(tmp))
+        znc = FakeZNC({}, latency=0)
+        znc.attach(conn)
+        try:
+            with mock.patch.object(
+                conn,
+                "launch_hook",
+                _legacy_launch_hook if legacy else conn.launch_hook,
+            ):
+                start = time.perf_counter()
+                for i in range(lines):
+                    await conn.handle_line(
+                        znc,  # type: ignore[arg-type]
+                        messages[i % len(messages)],
+                    )
+
+                elapsed = time.perf_counter() - start
+        finally:
+            znc.close()
+
+    return elapsed / lines * 1e6
+
+
+def bench_dispatch(lines: int) -> dict[str, float]:
+    return {
+        "legacy": asyncio.run(_time_dispatch(lines, legacy=True)),
+        "current": asyncio.run(_time_dispatch(lines, legacy=False)),
+    }
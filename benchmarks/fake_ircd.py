@@ -0,0 +1,231 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+A local IRC server which plays the parts of ZNC and the network's services
+
+`FakeIRCd` accepts a single client connection over TCP and answers enough of
+the IRC registration, WHOIS, NickServ INFO, *status and *controlpanel
+traffic for `Conn.run` to work end to end. Traffic from other IRC users is
+injected with `inject`, and every line the bot sends is passed to the
+registered watchers.
+"""
+
+import asyncio
+import itertools
+import time
+from collections.abc import Callable
+
+from irclib.parser import Message
+
+SERVER_NAME = "fake.ircd"
+ZNC_HOST = "znc.in"
+
+LineWatcher = Callable[[float, Message], None]
+
+
+class FakeIRCd:
+    def __init__(
+        self,
+        *,
+        users: dict[str, str | None] | None = None,
+        accounts: dict[str, str] | None = None,
+        registered: str = "Jan 01 00:00:00 2020 (5 years ago)",
+    ) -> None:
+        self.users = dict(users or {})
+        self.accounts = dict(accounts or {})
+        self.registered = registered
+        self.nick = "*"
+        self.lines_in = 0
+        self.lines_out = 0
+        self.saveconfigs = 0
+        self.memos = 0
+        self.watchers: list[LineWatcher] = []
+        self.registered_future = asyncio.get_running_loop().create_future()
+        self._server: asyncio.Server | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._pings: dict[str, asyncio.Future[None]] = {}
+        self._ping_ids = itertools.count()
+        self._disconnected = asyncio.Event()
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            msg = "Server isn't running"
+            raise ValueError(msg)
+
+        return int(self._server.sockets[0].getsockname()[1])
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_client, "127.0.0.1", 0
+        )
+
+    async def stop(self) -> None:
+        """Close the server, waiting for the client's connection to end"""
+        if self._server is not None:
+            self._server.close()
+
+        if self._writer is not None:
+            self._writer.close()
+            await self._disconnected.wait()
+
+    def inject(self, line: str) -> None:
+        """Send a line to the bot as if it came from the network"""
+        if self._writer is None:
+            msg = "No client connected"
+            raise ValueError(msg)
+
+        self.lines_out += 1
+        self._writer.write(line.encode() + b"\r\n")
+
+    async def sync(self) -> None:
+        """Wait until the bot has read everything injected so far"""
+        token = f"sync{next(self._ping_ids)}"
+        fut = asyncio.get_running_loop().create_future()
+        self._pings[token] = fut
+        self.inject(f"PING :{token}")
+        await fut
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writer = writer
+        try:
+            while raw := await reader.readline():
+                self.lines_in += 1
+                msg = Message.parse(raw.decode().rstrip("\r\n"))
+                now = time.perf_counter()
+                for watcher in self.watchers:
+                    watcher(now, msg)
+
+                self._on_line(msg)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            self._disconnected.set()
+
+    def _on_line(self, msg: Message) -> None:
+        params = list(msg.parameters)
+        if msg.command == "CAP" and params[:1] == ["LS"]:
+            self.inject(f":{SERVER_NAME} CAP * LS :")
+        elif msg.command == "NICK":
+            self.nick = params[0]
+        elif msg.command == "USER":
+            self.inject(f":{SERVER_NAME} 001 {self.nick} :Welcome")
+            if not self.registered_future.done():
+                self.registered_future.set_result(None)
+        elif msg.command == "PING":
+            self.inject(f":{SERVER_NAME} PONG {SERVER_NAME} :{params[-1]}")
+        elif msg.command == "PONG":
+            fut = self._pings.pop(params[-1], None)
+            if fut is not None:
+                fut.set_result(None)
+        elif msg.command == "WHOIS":
+            self._on_whois(params[0])
+        elif msg.command == "ZNC":
+            self._on_status(" ".join(params))
+        elif msg.command == "PRIVMSG":
+            self._on_privmsg(params[0], params[-1])
+
+    def _on_privmsg(self, target: str, text: str) -> None:
+        target = target.lower()
+        if target == "*status":
+            self._on_status(text)
+        elif target == "*controlpanel":
+            self._on_controlpanel(text)
+        elif target == "nickserv":
+            self._on_nickserv(text)
+        elif target == "memoserv":
+            self.memos += 1
+
+    def _on_whois(self, nick: str) -> None:
+        account = self.accounts.get(nick)
+        if account is not None:
+            self.inject(
+                f":{SERVER_NAME} 330 {self.nick} {nick} {account} "
+                ":is logged in as"
+            )
+
+        self.inject(f":{SERVER_NAME} 318 {self.nick} {nick} :End of /WHOIS")
+
+    def _on_nickserv(self, text: str) -> None:
+        cmd, _, account = text.partition(" ")
+        if cmd.upper() != "INFO":
+            return
+
+        if account not in self.accounts.values():
+            self._notice("NickServ", f"\x02{account}\x02 is not registered.")
+            return
+
+        self._notice(
+            "NickServ", f"Information on \x02{account}\x02 (account {account}):"
+        )
+        self._notice("NickServ", f"Registered : {self.registered}")
+
+    def _on_status(self, text: str) -> None:
+        cmd = text.lower()
+        if cmd == "saveconfig":
+            self.saveconfigs += 1
+        elif cmd == "listusers":
+            width = max((len(user) for user in self.users), default=0)
+            width = max(width, len("Username"))
+            border = f"+-{'-' * width}-+----------+---------+"
+            self._znc("status", border)
+            self._znc(
+                "status", f"| {'Username':<{width}} | Networks | Clients |"
+            )
+            self._znc("status", border.replace("-", "="))
+            for user in self.users:
+                self._znc("status", f"| {user:<{width}} | 1        | 0       |")
+
+            self._znc("status", border)
+
+    def _on_controlpanel(self, text: str) -> None:
+        cmd, *args = text.split()
+        cmd = cmd.lower()
+        if cmd == "cloneuser" and len(args) == 2:
+            self.users[args[1]] = None
+        elif cmd == "deluser" and args:
+            self.users.pop(args[0], None)
+        elif cmd == "set" and len(args) >= 3:
+            var, user, value = args[0], args[1], " ".join(args[2:])
+            if user not in self.users:
+                self._znc(
+                    "controlpanel", f"Error: User [{user}] does not exist!"
+                )
+                return
+
+            if var.lower() == "password":
+                self._znc("controlpanel", "Password has been changed!")
+                return
+
+            if var.lower() == "bindhost":
+                self.users[user] = value
+
+            self._znc("controlpanel", f"{var} = {value}")
+        elif cmd == "get" and len(args) == 2:
+            var, user = args
+            if user not in self.users:
+                self._znc(
+                    "controlpanel", f"Error: User [{user}] does not exist!"
+                )
+            elif var.lower() == "bindhost":
+                self._znc(
+                    "controlpanel", f"BindHost = {self.users[user] or ''}"
+                )
+            elif var.lower() == "admin":
+                self._znc("controlpanel", "Admin = false")
+
+    def _znc(self, module: str, text: str) -> None:
+        self.inject(
+            f":*{module}!{module}@{ZNC_HOST} PRIVMSG {self.nick} :{text}"
+        )
+
+    def _notice(self, service: str, text: str) -> None:
+        self.inject(
+            f":{service}!{service}@services. NOTICE {self.nick} :{text}"
+        )
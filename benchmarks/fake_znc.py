@@ -0,0 +1,130 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+An in-process stand-in for a ZNC connection
+
+`FakeZNC` takes the place of `Conn._protocol`, answering the module commands
+the bot sends after a fixed round-trip latency, in the order they were sent.
+"""
+
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from irclib.parser import Message
+
+from bncbot import bot
+from bncbot.conn import Conn
+
+ZNC_HOST = "znc.in"
+
+
+class _Reply(NamedTuple):
+    due: float
+    line: str
+    controlpanel: bool
+
+
+class FakeZNC:
+    def __init__(
+        self, users: dict[str, str], *, nick: str = "BNCServ", latency: float
+    ) -> None:
+        self.users = users
+        self.nick = nick
+        self.latency = latency
+        self.conn: Conn | None = None
+        self.lines_received = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._replies: asyncio.Queue[_Reply] = asyncio.Queue()
+        self._task: asyncio.Task[None] | None = None
+
+    def attach(self, conn: Conn) -> None:
+        self.conn = conn
+        conn._protocol = self  # type: ignore[assignment]
+        self._task = asyncio.create_task(self._reply_loop())
+
+    def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    def send(self, text: str) -> None:
+        self.lines_received += 1
+        msg = Message.parse(text)
+        if msg.command == "ZNC":
+            self._on_status(" ".join(msg.parameters))
+        elif msg.command == "PRIVMSG":
+            target, text = msg.parameters[0], msg.parameters[-1]
+            if target == "*controlpanel":
+                self._on_controlpanel(text)
+            elif target == "*status":
+                self._on_status(text)
+
+    def _on_status(self, text: str) -> None:
+        if text.lower() != "listusers":
+            return
+
+        width = max((len(user) for user in self.users), default=8)
+        width = max(width, len("Username"))
+        border = f"+-{'-' * width}-+----------+---------+"
+        self._reply("status", border)
+        self._reply("status", f"| {'Username':<{width}} | Networks | Clients |")
+        self._reply("status", border.replace("-", "="))
+        for user in self.users:
+            self._reply("status", f"| {user:<{width}} | 1        | 0       |")
+
+        self._reply("status", border)
+
+    def _on_controlpanel(self, text: str) -> None:
+        cmd, _, args = text.partition(" ")
+        if cmd.lower() != "get":
+            return
+
+        var, _, user = args.partition(" ")
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if user not in self.users:
+            self._reply("controlpanel", f"Error: User [{user}] does not exist!")
+        else:
+            self._reply("controlpanel", f"{var} = {self.users[user]}")
+
+    def _reply(self, module: str, text: str) -> None:
+        line = f":*{module}!{module}@{ZNC_HOST} PRIVMSG {self.nick} :{text}"
+        self._replies.put_nowait(
+            _Reply(
+                time.monotonic() + self.latency, line, module == "controlpanel"
+            )
+        )
+
+    async def _reply_loop(self) -> None:
+        if self.conn is None:
+            msg = "FakeZNC must be attached to a Conn"
+            raise ValueError(msg)
+
+        while True:
+            reply = await self._replies.get()
+            delay = reply.due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if reply.controlpanel:
+                self.in_flight -= 1
+
+            await self.conn.handle_line(
+                self,  # type: ignore[arg-type]
+                Message.parse(reply.line),
+            )
+
+
+def make_conn(run_dir: Path) -> Conn:
+    """Create a Conn with default config, logging only warnings"""
+    conn = Conn(bot.HANDLERS, data_path=run_dir, config=run_dir / "config.json")
+    for name in ("bncbot", "asyncio"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    return conn
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark loading a large bnc.json, streamed or validated whole by pydantic
+
+Each load runs in a fresh process so its peak RSS can be measured on its own.
+"""
+
+import multiprocessing
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from benchmarks.rusage import peak_rss_mib
+from bncbot.config import BNCData
+
+
+class LoadResult(NamedTuple):
+    loader: str
+    users: int
+    file_mib: float
+    seconds: float
+    peak_rss_mib: float
+
+
+def _load_pydantic(path: Path) -> BNCData:
+    # The previous BNCData.load_config
+    return BNCData.model_validate_json(path.read_text(encoding="utf8"))
+
+
+LOADERS: dict[str, Callable[[Path], BNCData]] = {
+    "pydantic": _load_pydantic,
+    "stream": BNCData.load_config,
+}
+
+
+def _measure(loader: str, path: Path) -> tuple[float, float]:
+    """Return the load time and how far it raised the peak RSS, in MiB"""
+    before = peak_rss_mib()
+    start = time.perf_counter()
+    LOADERS[loader](path)
+    seconds = time.perf_counter() - start
+    return seconds, peak_rss_mib() - before
+
+
+def write_data(path: Path, users: int) -> None:
+    BNCData(
+        users={
+            f"user{i}": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+            for i in range(users)
+        },
+        queue={f"acct{i}": "Jan 01 00:00:00 2020" for i in range(users // 100)},
+    ).save_config(path)
+
+
+def bench_load(users: int, repeat: int) -> list[LoadResult]:
+    """Time each loader, taking the best time and worst RSS of `repeat`"""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bnc.json"
+        # Linux carries the peak RSS across exec, so the data is built in a
+        # child to keep it out of this process's peak
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            pool.submit(write_data, path, users).result()
+
+        file_mib = path.stat().st_size / 2**20
+        for loader in LOADERS:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    runs.append(pool.submit(_measure, loader, path).result())
+
+            results.append(
+                LoadResult(
+                    loader,
+                    users,
+                    file_mib,
+                    min(seconds for seconds, _ in runs),
+                    max(rss for _, rss in runs),
+                )
+            )
+
+    return results
@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark a full `Conn.get_user_hosts` refresh against a fake ZNC
+"""
+
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from benchmarks.fake_znc import FakeZNC, make_conn
+
+
+class RefreshResult(NamedTuple):
+    window: int
+    users: int
+    seconds: float
+    max_in_flight: int
+
+
+def make_users(count: int) -> dict[str, str]:
+    return {
+        f"user{i}": f"127.0.{i // 256 % 256}.{i % 256}" for i in range(count)
+    }
+
+
+async def run_refresh(
+    users: dict[str, str], *, window: int, latency: float
+) -> RefreshResult:
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = make_conn(Path(tmp))
+        conn.config.bindhost_fetch_window = window
+        znc = FakeZNC(users, latency=latency)
+        znc.attach(conn)
+        try:
+            start = time.perf_counter()
+            await conn.get_user_hosts()
+            elapsed = time.perf_counter() - start
+        finally:
+            znc.close()
+
+        if conn.bnc_users != users:
+            msg = "Refresh produced an incorrect user list"
+            raise AssertionError(msg)
+
+    return RefreshResult(window, len(users), elapsed, znc.max_in_flight)
+
+
+def bench_refresh(
+    user_count: int, windows: list[int], latency: float
+) -> list[RefreshResult]:
+    users = make_users(user_count)
+    return [
+        asyncio.run(run_refresh(users, window=window, latency=latency))
+        for window in windows
+    ]
@@ -0,0 +1,255 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Replay traffic at a running bot over a real socket and measure its responses
+
+A scenario is a list of lines to inject, each optionally tagged with a key,
+and a function recognising the bot line which completes the command for a
+key. Command latency is the time from injecting a tagged line to seeing the
+line which completes it.
+"""
+
+import asyncio
+import enum
+import json
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import NamedTuple
+
+from irclib.parser import Message
+
+from benchmarks.fake_ircd import FakeIRCd
+from benchmarks.fake_znc import make_conn
+from benchmarks.rusage import peak_rss_mib
+from bncbot.config import BNCData
+
+ADMIN_MASK = "admin!admin@admin.example"
+LOG_CHANNEL = "#log"
+
+
+class Scenario(NamedTuple):
+    name: str
+    ircd: Callable[[], FakeIRCd]
+    data: BNCData
+    traffic: list[tuple[str | None, str]]
+    completes: Callable[[Message], str | None]
+
+
+class ReplayResult(NamedTuple):
+    scenario: str
+    commands: int
+    seconds: float
+    lines_in: int
+    lines_out: int
+    p50: float
+    p99: float
+    peak_rss_mib: float
+
+    @property
+    def lines_per_sec(self) -> float:
+        return (self.lines_in + self.lines_out) / self.seconds
+
+
+def _log_line(text: str) -> Callable[[Message], str | None]:
+    def _completes(msg: Message) -> str | None:
+        if (
+            msg.command == "PRIVMSG"
+            and msg.parameters[0] == LOG_CHANNEL
+            and text in msg.parameters[-1]
+        ):
+            return "admin"
+
+        return None
+
+    return _completes
+
+
+def listusers_scenario(count: int) -> Scenario:
+    """One admin refresh of a ZNC with `count` users"""
+    users: dict[str, str | None] = {
+        f"user{i}": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+        for i in range(count)
+    }
+    return Scenario(
+        f"listusers {count}",
+        lambda: FakeIRCd(users=users),
+        BNCData(users={"placeholder": None}),
+        [("admin", f":{ADMIN_MASK} PRIVMSG {LOG_CHANNEL} :.bncrefresh")],
+        _log_line("BNC user list updated"),
+    )
+
+
+def requestbnc_scenario(count: int) -> Scenario:
+    """`count` different users sending requestbnc at once"""
+    nicks = [f"nick{i}" for i in range(count)]
+
+    def _completes(msg: Message) -> str | None:
+        if msg.command == "PRIVMSG" and msg.parameters[-1] in (
+            "BNC request submitted.",
+            "You must be identified with services to request a BNC account",
+        ):
+            return str(msg.parameters[0])
+
+        return None
+
+    return Scenario(
+        f"requestbnc {count}",
+        lambda: FakeIRCd(
+            users={"existing": "10.0.0.1"},
+            accounts={nick: f"acct{i}" for i, nick in enumerate(nicks)},
+        ),
+        BNCData(users={"existing": "10.0.0.1"}),
+        [
+            (nick, f":{nick}!user@host.example PRIVMSG #help :.requestbnc")
+            for nick in nicks
+        ],
+        _completes,
+    )
+
+
+def acceptbnc_scenario(count: int) -> Scenario:
+    """One acceptbnc --all on a queue of `count` requests"""
+    return Scenario(
+        f"acceptbnc {count}",
+        lambda: FakeIRCd(users={"existing": "10.0.0.1"}),
+        BNCData(
+            users={"existing": "10.0.0.1"},
+            queue={f"acct{i}": "Jan 01 2020" for i in range(count)},
+        ),
+        [("admin", f":{ADMIN_MASK} PRIVMSG {LOG_CHANNEL} :.acceptbnc --all")],
+        _log_line("accepted"),
+    )
+
+
+def file_scenario(path: Path) -> Scenario:
+    """Replay raw server lines from `path`, one per line, untimed"""
+    lines = [
+        line
+        for line in path.read_text(encoding="utf-8").splitlines()
+        if line.strip()
+    ]
+    return Scenario(
+        f"replay {path.name}",
+        FakeIRCd,
+        BNCData(users={"existing": "10.0.0.1"}),
+        [(None, line) for line in lines],
+        lambda msg: None,
+    )
+
+
+class ScenarioName(str, enum.Enum):
+    LISTUSERS = "listusers"
+    REQUESTBNC = "requestbnc"
+    ACCEPTBNC = "acceptbnc"
+
+
+SCENARIOS: dict[ScenarioName, Callable[[int], Scenario]] = {
+    ScenarioName.LISTUSERS: listusers_scenario,
+    ScenarioName.REQUESTBNC: requestbnc_scenario,
+    ScenarioName.ACCEPTBNC: acceptbnc_scenario,
+}
+
+
+def _write_config(run_dir: Path, port: int) -> None:
+    config = {
+        "server": "127.0.0.1",
+        "port": port,
+        "ssl": False,
+        "log_channel": LOG_CHANNEL,
+        "admins": ["*!*@admin.example"],
+        "bind_host_net": "10.0.0.0/8",
+        "send_rate": 0,
+        "control_send_rate": 0,
+        "query_send_rate": 0,
+        "whois_timeout": 10,
+        "nickserv_timeout": 10,
+    }
+    (run_dir / "config.json").write_text(json.dumps(config), encoding="utf-8")
+
+
+async def run_scenario(
+    scenario: Scenario, *, rate: float, timeout: float = 300
+) -> ReplayResult:
+    """Run `scenario`, injecting up to `rate` lines per second (0: no limit)"""
+    ircd = scenario.ircd()
+    await ircd.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        run_dir = Path(tmp)
+        _write_config(run_dir, ircd.port)
+        scenario.data.save_config(run_dir / "bnc.json")
+        conn = make_conn(run_dir)
+        bot = asyncio.create_task(conn.run())
+        try:
+            return await asyncio.wait_for(
+                _replay(scenario, ircd, rate), timeout
+            )
+        finally:
+            await conn.shutdown()
+            await bot
+            await ircd.stop()
+
+
+async def _replay(
+    scenario: Scenario, ircd: FakeIRCd, rate: float
+) -> ReplayResult:
+    await ircd.registered_future
+    await ircd.sync()
+
+    sent_at: dict[str, float] = {}
+    latencies: list[float] = []
+    expected = {key for key, _ in scenario.traffic if key is not None}
+    finished = asyncio.get_running_loop().create_future()
+
+    def _watch(now: float, msg: Message) -> None:
+        key = scenario.completes(msg)
+        if key is None or key not in sent_at:
+            return
+
+        latencies.append(now - sent_at.pop(key))
+        expected.discard(key)
+        if not expected and not finished.done():
+            finished.set_result(None)
+
+    ircd.watchers.append(_watch)
+    lines_in, lines_out = ircd.lines_in, ircd.lines_out
+    start = time.perf_counter()
+    for i, (key, line) in enumerate(scenario.traffic):
+        if rate > 0:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        if key is not None:
+            sent_at[key] = time.perf_counter()
+
+        ircd.inject(line)
+
+    if expected:
+        await finished
+    else:
+        await ircd.sync()
+
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return ReplayResult(
+        scenario.name,
+        len(scenario.traffic),
+        elapsed,
+        ircd.lines_in - lines_in,
+        ircd.lines_out - lines_out,
+        statistics.median(latencies) if latencies else 0,
+        latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        peak_rss_mib(),
+    )
+
+
+def bench_replay(scenarios: list[Scenario], rate: float) -> list[ReplayResult]:
+    return [
+        asyncio.run(run_scenario(scenario, rate=rate)) for scenario in scenarios
+    ]
@@ -0,0 +1,29 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Peak memory use of the current process
+"""
+
+import sys
+
+
+def peak_rss_mib() -> float:
+    """
+    The peak resident set size so far in MiB, or NaN where it's unavailable
+
+    `resource` only exists on POSIX, and ru_maxrss is in KiB on Linux but in
+    bytes on macOS.
+    """
+    if sys.platform == "win32":
+        return float("nan")
+
+    import resource
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / 2**20
+
+    return rss / 2**10
@@ -8,10 +8,13 @@ Utility functions for working with asyncio
 """
 
 import asyncio
+import logging
+import time
 from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from functools import partial
-from typing import Any, NoReturn, TypeGuard, TypeVar, cast
+from typing import Any, NamedTuple, NoReturn, TypeGuard, TypeVar, cast
 
 _T = TypeVar("_T")
 
@@ -28,12 +31,166 @@ async def call_func(
     *args: Any,
     **kwargs: Any,
 ) -> _T:
-    loop = asyncio.get_running_loop()
+    """Call `func`, awaiting it if it is a coroutine function
+
+    Plain functions are called directly on the event loop, anything which
+    may block should be run through a `BlockingExecutor` instead.
+    """
     if is_coro(func):
         return await func(*args, **kwargs)
 
     func = cast("Callable[..., _T]", func)
-    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+    return func(*args, **kwargs)
+
+
+class ExecutorStats(NamedTuple):
+    workers: int
+    pending: int
+    completed: int
+    failed: int
+    peak_pending: int
+    full_waits: int
+
+    @property
+    def busy(self) -> int:
+        """Workers running a job"""
+        return min(self.pending, self.workers)
+
+    @property
+    def queued(self) -> int:
+        """Jobs accepted but waiting for a worker"""
+        return self.pending - self.busy
+
+
+class BlockingExecutor:
+    """
+    A thread pool for blocking handlers, with a limit on outstanding jobs
+
+    Once `max_pending` jobs are queued or running, further calls wait for a
+    slot to free up instead of growing the pool's queue without bound.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        *,
+        name: str = "blocking",
+        logger: logging.Logger | None = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.logger = logger
+        self._executor = ThreadPoolExecutor(
+            self.workers, thread_name_prefix=name
+        )
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.peak_pending = 0
+        self.full_waits = 0
+
+    async def run(self, func: Callable[..., _T], /, *args: Any) -> _T:
+        if self._slots.locked():
+            self.full_waits += 1
+            if self.logger:
+                self.logger.warning(
+                    "Blocking executor is full (%d jobs pending), waiting",
+                    self.max_pending,
+                )
+
+        async with self._slots:
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, partial(func, *args)
+                )
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.pending -= 1
+
+            self.completed += 1
+            return result
+
+    def stats(self) -> ExecutorStats:
+        return ExecutorStats(
+            self.workers,
+            self.pending,
+            self.completed,
+            self.failed,
+            self.peak_pending,
+            self.full_waits,
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Coalescer:
+    """
+    Calls `func` at most once per `interval` seconds, however often triggered
+
+    The first trigger after a quiet period calls `func` straight away.
+    Triggers within `interval` of the last call are merged into one call
+    at the end of the interval. Without a running event loop, every trigger
+    calls `func` directly.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[], None],
+        interval: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.func = func
+        self.interval = interval
+        self.clock = clock
+        self.calls = 0
+        self.coalesced = 0
+        self._last = -float("inf")
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def pending(self) -> bool:
+        return self._timer is not None
+
+    def trigger(self) -> None:
+        if self._timer is not None:
+            self.coalesced += 1
+            return
+
+        delay = self._last + self.interval - self.clock()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._call()
+            return
+
+        if delay <= 0:
+            self._call()
+        else:
+            self._timer = loop.call_later(delay, self._call)
+
+    def flush(self) -> None:
+        """Make any pending call now"""
+        if self._timer is not None:
+            self._call()
+
+    def cancel(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _call(self) -> None:
+        self.cancel()
+        self._last = self.clock()
+        self.calls += 1
+        self.func()
 
 
 async def timer(
@@ -0,0 +1,476 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Bind host allocation
+"""
+
+import bisect
+import ipaddress
+import random
+import time
+from collections import Counter, deque
+from collections.abc import Callable, Iterable
+from datetime import timedelta
+from typing import NamedTuple
+
+from typing_extensions import override
+
+from bncbot.util import IPAddress, IPNetwork
+
+# How many of the most recent allocations the allocation rate is based on
+ALLOCATION_WINDOW = 50
+
+
+class AddressRanges:
+    """
+    The addresses of one or more networks less any excluded addresses
+
+    Networks which overlap or touch are merged. The remaining addresses are
+    numbered from 0 to `size - 1` in order, and converting between an index
+    and an address is integer arithmetic plus a binary search over the (few)
+    contiguous ranges.
+
+    >>> ranges = AddressRanges.parse(
+    ...     ["10.0.0.0/30", "10.0.1.0/31"], exclude=["10.0.0.0", "10.0.0.3"]
+    ... )
+    >>> ranges.size
+    4
+    >>> [ranges.address(i) for i in range(ranges.size)]
+    ['10.0.0.1', '10.0.0.2', '10.0.1.0', '10.0.1.1']
+    >>> ranges.index("10.0.1.0"), ranges.index("10.0.0.3")
+    (2, None)
+    >>> ranges.network_sizes, ranges.network_of(2)
+    ([2, 2], 1)
+    >>> str(ranges)
+    '10.0.0.0/30, 10.0.1.0/31 excluding 10.0.0.0/32, 10.0.0.3/32'
+    """
+
+    def __init__(
+        self, networks: Iterable[IPNetwork], exclude: Iterable[IPNetwork] = ()
+    ) -> None:
+        networks = list(networks)
+        self.excluded = tuple(exclude)
+        if not networks:
+            msg = "At least one network is required"
+            raise ValueError(msg)
+
+        versions = {net.version for net in (*networks, *self.excluded)}
+        if len(versions) > 1:
+            msg = "Can't mix IPv4 and IPv6 networks"
+            raise ValueError(msg)
+
+        self.version = versions.pop()
+        # All of one version, as checked above
+        self.networks: tuple[IPNetwork, ...] = tuple(
+            ipaddress.collapse_addresses(networks)  # type: ignore[type-var]
+        )
+        ranges = _merge(_bounds(self.networks))
+        for start, end in _merge(_bounds(self.excluded)):
+            ranges = _subtract(ranges, start, end)
+
+        self._starts = [start for start, _ in ranges]
+        self._ends = [end for _, end in ranges]
+        self._offsets = []
+        size = 0
+        for start, end in ranges:
+            self._offsets.append(size)
+            size += end - start
+
+        self.size = size
+        # Networks are disjoint and sorted, so each covers a contiguous run
+        # of indexes
+        self._net_offsets = [
+            self._rank(int(net.network_address)) for net in self.networks
+        ]
+        self.network_sizes = [
+            self._rank(int(net.broadcast_address) + 1) - offset
+            for net, offset in zip(
+                self.networks, self._net_offsets, strict=True
+            )
+        ]
+
+    @classmethod
+    def parse(
+        cls, networks: str | Iterable[str], exclude: Iterable[str] = ()
+    ) -> "AddressRanges":
+        """Parse network and address strings
+
+        Raises:
+            ValueError: If any of them isn't a valid network or address
+        """
+        if isinstance(networks, str):
+            networks = [networks]
+
+        return cls(
+            (ipaddress.ip_network(net) for net in networks),
+            (ipaddress.ip_network(net) for net in exclude),
+        )
+
+    def address(self, index: int) -> str:
+        """Return the address numbered `index`"""
+        if not 0 <= index < self.size:
+            msg = f"Address index {index} out of range"
+            raise IndexError(msg)
+
+        pos = bisect.bisect_right(self._offsets, index) - 1
+        value = self._starts[pos] + index - self._offsets[pos]
+        addr: IPAddress = (
+            ipaddress.IPv4Address(value)
+            if self.version == 4
+            else ipaddress.IPv6Address(value)
+        )
+        return str(addr)
+
+    def index(self, host: str) -> int | None:
+        """Return the number of `host`, or None if it isn't in the ranges"""
+        try:
+            addr = ipaddress.ip_address(host)
+        except ValueError:
+            return None
+
+        if addr.version != self.version:
+            return None
+
+        value = int(addr)
+        pos = bisect.bisect_right(self._starts, value) - 1
+        if pos < 0 or value >= self._ends[pos]:
+            return None
+
+        return self._offsets[pos] + value - self._starts[pos]
+
+    def network_of(self, index: int) -> int:
+        """Return the position in `networks` of the network holding `index`"""
+        return bisect.bisect_right(self._net_offsets, index) - 1
+
+    def _rank(self, value: int) -> int:
+        """Count the addresses in the ranges which are below `value`"""
+        pos = bisect.bisect_right(self._starts, value) - 1
+        if pos < 0:
+            return 0
+
+        return (
+            self._offsets[pos] + min(value, self._ends[pos]) - self._starts[pos]
+        )
+
+    @override
+    def __str__(self) -> str:
+        text = ", ".join(map(str, self.networks))
+        if self.excluded:
+            text += f" excluding {', '.join(map(str, self.excluded))}"
+
+        return text
+
+
+def _bounds(networks: Iterable[IPNetwork]) -> list[tuple[int, int]]:
+    return [
+        (int(net.network_address), int(net.broadcast_address) + 1)
+        for net in networks
+    ]
+
+
+def _merge(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Sort half-open ranges and join any which overlap or touch"""
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def _subtract(
+    ranges: list[tuple[int, int]], start: int, end: int
+) -> list[tuple[int, int]]:
+    result: list[tuple[int, int]] = []
+    for low, high in ranges:
+        if high <= start or low >= end:
+            result.append((low, high))
+            continue
+
+        if low < start:
+            result.append((low, start))
+
+        if high > end:
+            result.append((end, high))
+
+    return result
+
+
+class NetworkUsage(NamedTuple):
+    network: str
+    size: int
+    used: int
+
+    @property
+    def free(self) -> int:
+        return self.size - self.used
+
+
+class OccupancyReport(NamedTuple):
+    """A snapshot of a `BindHostPool`'s usage"""
+
+    networks: list[NetworkUsage]
+    size: int
+    used: int
+    duplicates: dict[str, list[str]]
+    out_of_range: dict[str, int]
+    allocation_rate: float | None
+    """
+    New allocations per second, if enough have been made to tell
+
+    Allocation times are only kept in memory, so this only covers the
+    allocations since the bot started.
+    """
+
+    @property
+    def free(self) -> int:
+        return self.size - self.used
+
+    @property
+    def exhausted_in(self) -> timedelta | None:
+        """How long the free addresses will last at the allocation rate"""
+        if not self.allocation_rate:
+            return None
+
+        return timedelta(seconds=self.free / self.allocation_rate)
+
+    def lines(self) -> list[str]:
+        lines = [f"Bindhosts: {self.used}/{self.size} used, {self.free} free"]
+        lines.extend(
+            f"{usage.network}: {usage.used}/{usage.size} used, "
+            f"{usage.free} free"
+            for usage in self.networks
+        )
+        exhausted_in = self.exhausted_in
+        if self.allocation_rate is None or exhausted_in is None:
+            lines.append(
+                "Exhaustion: unknown, too few allocations since the bot started"
+            )
+        else:
+            per_day = self.allocation_rate * 86400
+            lines.append(
+                f"Exhaustion: in about {exhausted_in.days} days at "
+                f"{per_day:.1f} allocations/day (since the bot started)"
+            )
+
+        if self.duplicates:
+            dupes = ", ".join(
+                f"{host} ({', '.join(users)})"
+                for host, users in sorted(self.duplicates.items())
+            )
+            lines.append(f"Duplicates: {dupes}")
+        else:
+            lines.append("Duplicates: none")
+
+        if self.out_of_range:
+            hosts = ", ".join(
+                f"{host} ({count})"
+                for host, count in sorted(self.out_of_range.items())
+            )
+            lines.append(f"Out of range: {hosts}")
+        else:
+            lines.append("Out of range: none")
+
+        return lines
+
+
+class BindHostPool:
+    """
+    Tracks which addresses in the bind ranges are in use and picks free ones
+
+    The free addresses are kept at the front of a virtual permutation of the
+    ranges' address indexes. Only positions which differ from the identity
+    permutation are stored, so picking, claiming and releasing an address are
+    all constant time and memory only grows with the number of claimed
+    addresses, even for IPv6 networks.
+
+    Per-network usage, shared hosts and recent allocation times are kept up
+    to date as hosts are claimed and released, so `report` doesn't have to
+    look at every host.
+    """
+
+    def __init__(
+        self,
+        net: AddressRanges | IPNetwork,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        if not isinstance(net, AddressRanges):
+            net = AddressRanges([net])
+
+        self.net = net
+        self.clock = clock
+        self._free = net.size
+        self._slots: dict[int, int] = {}
+        self._positions: dict[int, int] = {}
+        self._refs: Counter[int] = Counter()
+        self._net_used = [0] * len(net.networks)
+        self.foreign: Counter[str] = Counter()
+        self._owner: dict[str, str] = {}
+        self._shared: dict[str, set[str]] = {}
+        self.allocations: deque[float] = deque(maxlen=ALLOCATION_WINDOW)
+
+    @property
+    def size(self) -> int:
+        return self.net.size
+
+    @property
+    def free(self) -> int:
+        return self._free
+
+    @property
+    def used(self) -> int:
+        return self.size - self._free
+
+    def pick(self) -> str:
+        """Return a random unclaimed address
+
+        Raises:
+            ValueError: If every address in the network is claimed
+        """
+        if not self._free:
+            msg = f"No free addresses left in {self.net}"
+            raise ValueError(msg)
+
+        index = self._slot(random.randrange(self._free))
+        return self.net.address(index)
+
+    def claim(self, host: str | None, owner: str | None = None) -> None:
+        """Mark `host` as used by one more user"""
+        if not host:
+            return
+
+        if owner is not None:
+            first = self._owner.setdefault(host, owner)
+            if first != owner:
+                self._shared.setdefault(host, {first}).add(owner)
+
+        index = self._index(host)
+        if index is None:
+            self.foreign[host] += 1
+            return
+
+        self._refs[index] += 1
+        if self._refs[index] == 1:
+            self._move(index, self._free - 1)
+            self._free -= 1
+            self._net_used[self.net.network_of(index)] += 1
+
+    def release(self, host: str | None, owner: str | None = None) -> None:
+        """Mark `host` as used by one less user"""
+        if not host:
+            return
+
+        if owner is not None:
+            self._release_owner(host, owner)
+
+        index = self._index(host)
+        if index is None:
+            self.foreign[host] -= 1
+            if self.foreign[host] <= 0:
+                del self.foreign[host]
+
+            return
+
+        if not self._refs[index]:
+            return
+
+        self._refs[index] -= 1
+        if not self._refs[index]:
+            del self._refs[index]
+            self._move(index, self._free)
+            self._free += 1
+            self._net_used[self.net.network_of(index)] -= 1
+
+    def _release_owner(self, host: str, owner: str) -> None:
+        shared = self._shared.get(host)
+        if shared is None:
+            if self._owner.get(host) == owner:
+                del self._owner[host]
+
+            return
+
+        shared.discard(owner)
+        if self._owner[host] == owner:
+            self._owner[host] = next(iter(shared))
+
+        if len(shared) == 1:
+            del self._shared[host]
+
+    def record_allocation(self) -> None:
+        """Note that an address was handed out to a new user"""
+        self.allocations.append(self.clock())
+
+    def allocation_rate(self) -> float | None:
+        """
+        Allocations per second over the recent allocation window
+
+        The window runs from the first to the last recorded allocation, so
+        it holds one less interval than allocations. The times aren't
+        stored, so there are none from before the bot started.
+        """
+        if len(self.allocations) < 2:
+            return None
+
+        elapsed = self.allocations[-1] - self.allocations[0]
+        if elapsed <= 0:
+            return None
+
+        return (len(self.allocations) - 1) / elapsed
+
+    def duplicates(self) -> dict[str, list[str]]:
+        """The hosts claimed by more than one user, with their users"""
+        return {host: sorted(owners) for host, owners in self._shared.items()}
+
+    def report(self) -> OccupancyReport:
+        return OccupancyReport(
+            [
+                NetworkUsage(str(net), size, used)
+                for net, size, used in zip(
+                    self.net.networks,
+                    self.net.network_sizes,
+                    self._net_used,
+                    strict=True,
+                )
+            ],
+            self.size,
+            self.used,
+            self.duplicates(),
+            dict(self.foreign),
+            self.allocation_rate(),
+        )
+
+    def is_claimed(self, host: str) -> bool:
+        index = self._index(host)
+        if index is None:
+            return host in self.foreign
+
+        return index in self._refs
+
+    def _index(self, host: str) -> int | None:
+        return self.net.index(host)
+
+    def _slot(self, position: int) -> int:
+        return self._slots.get(position, position)
+
+    def _position(self, index: int) -> int:
+        return self._positions.get(index, index)
+
+    def _set(self, position: int, index: int) -> None:
+        if position == index:
+            self._slots.pop(position, None)
+            self._positions.pop(index, None)
+        else:
+            self._slots[position] = index
+            self._positions[index] = position
+
+    def _move(self, index: int, position: int) -> None:
+        """Swap `index` into `position` in the permutation"""
+        old_position = self._position(index)
+        other = self._slot(position)
+        self._set(old_position, other)
+        self._set(position, index)
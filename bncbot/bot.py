@@ -4,7 +4,8 @@
 # SPDX-License-Identifier: MIT
 
 import asyncio
-import re
+import inspect
+import operator
 from collections import defaultdict
 from collections.abc import Callable, Sequence
 from functools import partial
@@ -12,45 +13,110 @@ from itertools import chain
 from typing import TYPE_CHECKING, Any, NamedTuple, TypedDict, TypeVar
 
 from bncbot import util
+from bncbot.async_util import is_coro
 from bncbot.config import BNCQueue, BNCUsers
-from bncbot.event import CommandEvent, RawEvent
+from bncbot.event import CommandEvent, Event, RawEvent
 from bncbot.util import chunk_str, sanitize_username
 
 if TYPE_CHECKING:
     from bncbot.conn import Conn
 
 
+def _make_arg_getter(
+    params: tuple[str, ...],
+) -> Callable[[Event], tuple[Any, ...]]:
+    if not params:
+        return lambda event: ()
+
+    getter = operator.attrgetter(*params)
+    if len(params) == 1:
+        return lambda event: (getter(event),)
+
+    return getter
+
+
+class Hook(NamedTuple):
+    """
+    A handler function bound to the event attributes it takes as parameters
+
+    Plain functions run directly on the event loop unless `blocking` is set,
+    in which case they are sent to the connection's blocking executor.
+    """
+
+    func: Callable[..., Any]
+    params: tuple[str, ...]
+    get_args: Callable[[Event], tuple[Any, ...]]
+    is_coro: bool = False
+    blocking: bool = False
+
+    @classmethod
+    def from_func(
+        cls, func: Callable[..., Any], *, blocking: bool = False
+    ) -> "Hook":
+        params = tuple(inspect.signature(func).parameters)
+        return cls(
+            func, params, _make_arg_getter(params), is_coro(func), blocking
+        )
+
+
 class Command(NamedTuple):
     """
     A NamedTuple which represents a registered command
     """
 
     name: str
-    func: Callable[..., Any]
+    hook: Hook
     admin: bool = False
     param: bool = True
     doc: str | None = None
 
+    @property
+    def func(self) -> Callable[..., Any]:
+        return self.hook.func
+
 
 class Handlers(TypedDict):
-    raw: dict[str, list[Callable[..., Any]]]
+    raw: dict[str, list[Hook]]
     command: dict[str, Command]
 
 
-HANDLERS = Handlers(
-    {"command": {}, "raw": defaultdict[str, list[Callable[..., Any]]](list)}
-)
+HANDLERS = Handlers({"command": {}, "raw": defaultdict[str, list[Hook]](list)})
+
+
+class DispatchTable(NamedTuple):
+    """
+    The raw handlers to call for each IRC command, wildcard handlers included
+    """
+
+    by_command: dict[str, tuple[Hook, ...]]
+    wildcard: tuple[Hook, ...]
+
+    @classmethod
+    def build(cls, handlers: Handlers) -> "DispatchTable":
+        raw_handlers = handlers.get("raw", {})
+        wildcard = tuple(raw_handlers.get("", ()))
+        by_command = {
+            cmd: (*hooks, *wildcard)
+            for cmd, hooks in raw_handlers.items()
+            if cmd
+        }
+        return cls(by_command, wildcard)
+
+    def get(self, cmd: str) -> tuple[Hook, ...]:
+        return self.by_command.get(cmd, self.wildcard)
+
 
 _T = TypeVar("_T")
 _FuncT = TypeVar("_FuncT", bound=Callable[..., Any])
 
 
-def raw(*cmds: str) -> Callable[[_FuncT], _FuncT]:
+def raw(*cmds: str, blocking: bool = False) -> Callable[[_FuncT], _FuncT]:
     """Register a function as a handler for all raw commands in [cmds]"""
 
     def _decorate(func: _FuncT, cmd_list: Sequence[str]) -> _FuncT:
+        hook = Hook.from_func(func, blocking=blocking)
         for cmd in cmd_list or ("",):
-            HANDLERS["raw"][cmd].append(func)
+            HANDLERS["raw"][cmd].append(hook)
 
         return func
 
@@ -58,7 +124,11 @@ def raw(*cmds: str) -> Callable[[_FuncT], _FuncT]:
 
 
 def command(
-    name: str, *aliases: str, admin: bool = False, require_param: bool = True
+    name: str,
+    *aliases: str,
+    admin: bool = False,
+    require_param: bool = True,
+    blocking: bool = False,
 ) -> Callable[[_FuncT], _FuncT]:
     """Registers a function as a handler for a command"""
 
@@ -69,73 +139,38 @@ def command(
             else None
         )
 
-        cmd = Command(name, func, admin, require_param, doc)
+        hook = Hook.from_func(func, blocking=blocking)
+        cmd = Command(name, hook, admin, require_param, doc)
         HANDLERS["command"].update(dict.fromkeys(chain((name,), aliases), cmd))
         return func
 
     return _decorate
 
 
-@raw()
-async def on_raw(conn: "Conn", event: "RawEvent", irc_command: str) -> None:
-    conn.logger.info("[incoming] %s", event.irc_rawline)
-    for handler in conn.handlers.get("raw", {}).get(irc_command, []):
-        await conn.launch_hook(event, handler)
-
-
 @raw("JOIN")
 def on_join(conn: "Conn", chan: str | None, nick: str | None) -> None:
-    if (
-        nick
-        and chan
-        and conn.log_chan
-        and chan.lower() == conn.log_chan.lower()
-        and nick.lower() == conn.nick.lower()
-    ):
+    identity = conn.identity
+    if nick and chan and identity.is_log_chan(chan) and identity.is_self(nick):
         conn.chan_log("Bot online.")
 
 
 @raw("318")
-async def on_whois_end(conn: "Conn", irc_paramlist: list[str]) -> None:
-    to_remove = []
-    for name, fut in conn.futures.items():
-        if name.startswith("whois") and name.endswith(irc_paramlist[1]):
-            conn.logger.debug("Cancelling future: %s", name)
-            fut.set_result("")
-            to_remove.append(name)
-
-    for name in to_remove:
-        del conn.futures[name]
+def on_whois_end(conn: "Conn", irc_paramlist: list[str]) -> None:
+    conn.whois.on_end(irc_paramlist[1])
 
 
 @raw("330")
-async def on_whois_acct(conn: "Conn", irc_paramlist: list[str]) -> None:
+def on_whois_acct(conn: "Conn", irc_paramlist: list[str]) -> None:
     if irc_paramlist[-1] == "is logged in as":
-        fut = conn.futures.get(f"whois_acct_{irc_paramlist[1]}")
-        if fut:
-            fut.set_result(irc_paramlist[2])
-            del conn.futures[f"whois_acct_{irc_paramlist[1]}"]
+        conn.whois.on_account(irc_paramlist[1], irc_paramlist[2])
 
 
 @raw("NOTICE")
-async def on_notice(
-    irc_paramlist: list[str], conn: "Conn", nick: str | None
-) -> None:
+def on_notice(irc_paramlist: list[str], conn: "Conn", nick: str | None) -> None:
     """Handle NickServ info responses"""
-    message = irc_paramlist[-1]
-    if nick and nick.lower() == "nickserv" and ":" in message:
-        conn.logger.debug("Got nickserv message: %s", message)
-        # Registered: May 30 00:53:54 2017 UTC (5 days, 19 minutes ago)
-        message = message.strip()
-        part, content = message.split(":", 1)
-        content = content.strip()
-        if (
-            part in ("Registered", "Account registered")
-            and "ns_info" in conn.futures
-        ):
-            conn.logger.debug("Got registered time for nickserv info")
-            conn.futures["ns_info"].set_result(content)
-            del conn.futures["ns_info"]
+    if nick and nick.lower() == "nickserv":
+        conn.logger.debug("Got nickserv message: %s", irc_paramlist[-1])
+        conn.nickserv.on_notice(irc_paramlist[-1])
 
 
 @raw("PRIVMSG")
@@ -145,44 +180,12 @@ async def on_privmsg(
     conn: "Conn",
     nick: str | None,
     host: str | None,
-    bnc_users: BNCUsers,
     is_admin: bool,
 ) -> None:
     message = irc_paramlist[-1]
     if nick and nick.startswith(conn.prefix) and host == "znc.in":
-        znc_module = nick[len(conn.prefix) :]
-        if znc_module == "status" and (
-            user_lsit_fut := conn.futures.get("user_list")
-        ):
-            match = re.match(
-                r"^\|\s*(.+?)\s*\|\s*\d+\s*\|\s*\d+\s*\|$", message
-            )
-
-            if match:
-                user = match.group(1)
-                bnc_users[user] = None
-            elif re.match(r"^([=+]+|[-+]+)$", message):
-                conn.get_users_state += 1
-                if conn.get_users_state == 3:
-                    user_lsit_fut.set_result(None)
-                    del conn.futures["user_list"]
-        elif (
-            znc_module == "controlpanel"
-            and (bindhost_fut := conn.futures.get("bindhost"))
-            and message.startswith("BindHost = ")
-        ):
-            _, _, host = message.partition("=")
-            bindhost_fut.set_result(host.strip())
-            del conn.futures["bindhost"]
-        elif (
-            znc_module == "controlpanel"
-            and (bncadmin_fut := conn.futures.get("bncadmin"))
-            and message.startswith("Admin = ")
-        ):
-            _, _, val = message.partition("=")
-            bncadmin_fut.set_result(val.strip() == "true")
-            del conn.futures["bncadmin"]
-    elif message[0] in conn.cmd_prefix:
+        conn.queries.feed(nick[len(conn.prefix) :], message)
+    elif conn.identity.is_command(message):
         cmd, _, text = message[1:].partition(" ")
         text = text.strip()
         handler: Command | None = conn.handlers.get("command", {}).get(cmd)
@@ -197,54 +200,84 @@ async def on_privmsg(
             cmd_event.notice_doc()
             return
 
-        await conn.launch_hook(cmd_event, handler.func)
+        await conn.launch_hook(cmd_event, handler.hook)
 
 
 @raw("NICK")
 async def on_nick(
     conn: "Conn", irc_paramlist: list[str], nick: str | None
 ) -> None:
-    if nick and nick.lower() == conn.nick.lower():
+    if nick and conn.identity.is_self(nick):
         conn.nick = irc_paramlist[0]
 
 
+def _report_missing(
+    event: "CommandEvent", missing: list[str], reason: str
+) -> None:
+    for name in missing:
+        event.message(f"{name} {reason}")
+
+
 @command("acceptbnc", admin=True)
 async def cmd_acceptbnc(
-    text: str, conn: "Conn", bnc_queue: BNCQueue, event: "CommandEvent"
+    text: str,
+    conn: "Conn",
+    bnc_queue: BNCQueue,
+    event: "CommandEvent",
+    nick: str,
 ) -> None:
-    """<user> - Accepts [user]'s BNC request and sends their login info via a MemoServ memo"""
-    nick = text.split(None, 1)[0]
-    if nick not in bnc_queue:
-        event.message(f"{nick} is not in the BNC queue.")
-        return
+    """<user...|pattern|--all> - Accepts BNC requests and sends login info via MemoServ memos"""
+    targets, missing = util.select_names(text, bnc_queue)
+    _report_missing(event, missing, "is not in the BNC queue.")
+    added: list[str] = []
+    failed: list[str] = []
+    for target in targets:
+        conn.rem_queue(target)
+        if conn.add_user(target, save_config=False):
+            added.append(target)
+        else:
+            failed.append(target)
+
+    if added:
+        conn.save_znc_config()
 
-    conn.rem_queue(nick)
-    if conn.add_user(nick):
+    if len(targets) > 1:
         conn.chan_log(
-            f"{nick} has been set with BNC access and memoserved credentials."
+            f"{nick} accepted {len(added)} BNC requests"
+            + (f", {len(failed)} failed: {', '.join(failed)}" if failed else "")
         )
-    else:
+    elif added:
         conn.chan_log(
-            f"Error occurred when attempting to add {nick} to the BNC"
+            f"{added[0]} has been set with BNC access and memoserved credentials."
+        )
+    elif failed:
+        conn.chan_log(
+            f"Error occurred when attempting to add {failed[0]} to the BNC"
         )
 
 
 @command("denybnc", admin=True)
 async def cmd_denybnc(
-    text: str, event: "CommandEvent", bnc_queue: BNCQueue, conn: "Conn"
+    text: str,
+    event: "CommandEvent",
+    bnc_queue: BNCQueue,
+    conn: "Conn",
+    nick: str,
 ) -> None:
-    """<user> - Deny [user]'s BNC request"""
-    nick = text.split()[0]
-    if nick not in bnc_queue:
-        event.message(f"{nick} is not in the BNC queue.")
-        return
-
-    conn.rem_queue(nick)
-    event.message(
-        f"SEND {nick} Your BNC auth could not be added at this time", "MemoServ"
-    )
+    """<user...|pattern|--all> - Deny BNC requests"""
+    targets, missing = util.select_names(text, bnc_queue)
+    _report_missing(event, missing, "is not in the BNC queue.")
+    for target in targets:
+        conn.rem_queue(target)
+        event.message(
+            f"SEND {target} Your BNC auth could not be added at this time",
+            "MemoServ",
+        )
 
-    conn.chan_log(f"{nick} has been denied. Memoserv sent.")
+    if len(targets) > 1:
+        conn.chan_log(f"{nick} denied {len(targets)} BNC requests. Memos sent.")
+    elif targets:
+        conn.chan_log(f"{targets[0]} has been denied. Memoserv sent.")
 
 
 @command("bncrefresh", admin=True, require_param=False)
@@ -255,7 +288,12 @@ async def cmd_bncrefresh(
     event.message("Updating user list")
     conn.chan_log(f"{nick} is updating the BNC user list...")
     await conn.get_user_hosts()
-    conn.chan_log("BNC user list updated.")
+
+
+@command("reloadconfig", "rehash", admin=True, require_param=False)
+async def cmd_reloadconfig(conn: "Conn", nick: str) -> None:
+    """- Reload the bot's config file without restarting"""
+    await conn.reload_and_report(f"requested by {nick}")
 
 
 @command("bncqueue", "bncq", admin=True, require_param=False)
@@ -277,20 +315,24 @@ async def cmd_delbnc(
     event: "CommandEvent",
     nick: str,
 ) -> None:
-    """<user> - Delete [user]'s BNC account"""
-    acct = text.split()[0]
-    if acct not in bnc_users:
-        event.message(f"{acct} is not a current BNC user")
+    """<user...|pattern|--all> - Delete BNC accounts"""
+    targets, missing = util.select_names(text, bnc_users)
+    _report_missing(event, missing, "is not a current BNC user")
+    if not targets:
         return
 
-    conn.module_msg("controlpanel", f"deluser {acct}")
-    conn.send("znc saveconfig")
-    del bnc_users[acct]
-    conn.chan_log(f"{nick} removed BNC: {acct}")
-    if chan != conn.log_chan:
-        event.message("BNC removed")
+    for acct in targets:
+        conn.module_msg("controlpanel", f"deluser {acct}")
+        conn.rem_user(acct)
 
-    conn.save_data()
+    conn.save_znc_config()
+    if len(targets) > 1:
+        conn.chan_log(f"{nick} removed {len(targets)} BNCs")
+    else:
+        conn.chan_log(f"{nick} removed BNC: {targets[0]}")
+
+    if chan != conn.log_chan:
+        event.message("BNC removed" if len(targets) == 1 else "BNCs removed")
 
 
 @command("bncresetpass", admin=True)
@@ -305,7 +347,7 @@ async def cmd_resetpass(
 
     passwd = util.gen_pass()
     conn.module_msg("controlpanel", f"Set Password {nick} {passwd}")
-    conn.send("znc saveconfig")
+    conn.save_znc_config()
     event.message(f"BNC password reset for {nick}")
     event.message(
         f"SEND {nick} [New Password!] Your BNC auth is Username: {nick} "
@@ -340,8 +382,8 @@ async def cmd_setadmin(
     """<user> - Makes [user] a BNC admin"""
     acct = text.split()[0]
     if acct in bnc_users:
-        conn.module_msg("controlpanel", f"Set Admin {acct} true")
-        conn.send("znc saveconfig")
+        conn.controlpanel_set("Admin", acct, "true")
+        conn.save_znc_config()
         event.message(f"{acct} has been set as a BNC admin")
     else:
         event.message(f"{acct} does not exist as a BNC account")
@@ -356,10 +398,16 @@ async def cmd_requestbnc(
     bnc_queue: BNCQueue,
 ) -> None:
     """- Submits a request for a BNC account"""
-    acct_fut: asyncio.Future[str] = asyncio.Future()
-    conn.futures[f"whois_acct_{nick}"] = acct_fut
-    conn.send("WHOIS", nick)
-    acct = await acct_fut
+    try:
+        acct = await conn.whois.get_account(nick)
+    except asyncio.TimeoutError:
+        conn.logger.warning("Timeout while looking up the account for %s", nick)
+        event.message(
+            "Unable to verify your services account right now, please try again later",
+            nick,
+        )
+        return
+
     if not acct:
         event.message(
             "You must be identified with services to request a BNC account",
@@ -387,21 +435,26 @@ async def cmd_requestbnc(
         return
 
     conn.logger.debug("Starting to get NickServ info for %s", nick)
-    async with conn.locks["ns_info"]:
-        conn.logger.debug("NickServ info lock acquired")
-        ns_info_fut: asyncio.Future[str] = asyncio.Future()
-        conn.futures["ns_info"] = ns_info_fut
-        event.message(f"INFO {acct}", "NickServ")
-        try:
-            registered_time = await asyncio.wait_for(
-                ns_info_fut, conn.config.nickserv_timeout
-            )
-        except (asyncio.CancelledError, asyncio.TimeoutError):
-            conn.chan_log(f"Timeout while retrieving NickServ info for {nick}")
-            conn.logger.warning(
-                "Timeout while retrieving NickServ info for %s", nick
-            )
-            return
+    try:
+        registered_time = await conn.nickserv.get_registered(acct)
+    except asyncio.TimeoutError:
+        conn.chan_log(f"Timeout while retrieving NickServ info for {nick}")
+        conn.logger.warning(
+            "Timeout while retrieving NickServ info for %s", nick
+        )
+        event.message(
+            "Unable to look up your services account right now, please try again later",
+            nick,
+        )
+        return
+
+    if registered_time is None:
+        conn.logger.warning("NickServ reports %s as not registered", acct)
+        event.message(
+            f"NickServ reports {acct} as not registered. If this is in error, please contact staff in #help",
+            nick,
+        )
+        return
 
     conn.add_queue(acct, registered_time)
     event.message("BNC request submitted.", nick)
@@ -419,6 +472,14 @@ async def cmd_genbindhost(conn: "Conn", event: "CommandEvent") -> None:
     event.message(out)
 
 
+@command("bindhosts", admin=True, require_param=False)
+async def cmd_bindhosts(conn: "Conn", event: "CommandEvent") -> None:
+    """- Show bindhost usage, duplicates and a forecast of when they run out"""
+    for line in conn.bind_hosts.report().lines():
+        for chunk in chunk_str(line):
+            event.message(chunk)
+
+
 @command("help", require_param=False)
 async def cmd_help(event: "CommandEvent", text: str, is_admin: bool) -> None:
     """[command] - Display help for [command] or list all commands if none is specified"""
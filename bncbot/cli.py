@@ -5,16 +5,63 @@
 
 import asyncio
 import logging
+import sys
+import urllib.error
+import urllib.request
 from pathlib import Path
 from typing import Annotated
 
 import typer
 
-from bncbot import bot
+from bncbot import bot, maintenance
+from bncbot.config import BotConfig
 from bncbot.conn import Conn
+from bncbot.storage import Storage, StorageKind, create_storage, migrate_storage
 
 app = typer.Typer(help="Command help")
 
+DataDirOption = Annotated[
+    Path | None,
+    typer.Option(
+        dir_okay=True,
+        file_okay=False,
+        writable=True,
+        help="Directory where BNC state data should be stored. Defaults to the current working directory.",
+    ),
+]
+ConfigOption = Annotated[
+    Path | None,
+    typer.Option(
+        dir_okay=False,
+        file_okay=True,
+        exists=True,
+        readable=True,
+        help="Config file to read. Defaults to $DATA_DIR/config,json",
+    ),
+]
+
+StorageOption = Annotated[
+    StorageKind | None,
+    typer.Option(
+        help="Storage backend to use. Defaults to the one set in the config."
+    ),
+]
+
+
+def _resolve_paths(
+    data_dir: Path | None, config: Path | None
+) -> tuple[Path, Path]:
+    if data_dir is None:
+        data_dir = Path.cwd()
+
+    if config is None:
+        config = data_dir / "config.json"
+
+    if not data_dir.exists():
+        data_dir.mkdir(parents=True)
+
+    return data_dir, config
+
 
 async def async_main(data_path: Path, config: Path) -> None:
     conn = Conn(bot.HANDLERS, data_path=data_path, config=config)
@@ -23,37 +70,237 @@ async def async_main(data_path: Path, config: Path) -> None:
 
 
 @app.command()
-def run(
-    data_dir: Annotated[
+def run(data_dir: DataDirOption = None, config: ConfigOption = None) -> None:
+    """Connect to the BNC and run the bot"""
+    data_dir, config = _resolve_paths(data_dir, config)
+
+    try:
+        asyncio.run(async_main(data_dir, config))
+    finally:
+        logging.shutdown()
+
+
+@app.callback(invoke_without_command=True)
+def main(
+    ctx: typer.Context,
+    data_dir: DataDirOption = None,
+    config: ConfigOption = None,
+) -> None:
+    """
+    Run the bot if no command is given, as `bnc-bot` did before it had
+    subcommands
+    """
+    if ctx.invoked_subcommand is None:
+        run(data_dir, config)
+    elif data_dir is not None or config is not None:
+        msg = f"--data-dir and --config go after {ctx.invoked_subcommand!r}"
+        raise typer.BadParameter(msg)
+
+
+@app.command("migrate-data")
+def migrate_data(
+    source: Annotated[
+        StorageKind, typer.Option("--from", help="Storage backend to read")
+    ],
+    dest: Annotated[
+        StorageKind, typer.Option("--to", help="Storage backend to write")
+    ],
+    data_dir: DataDirOption = None,
+    config: ConfigOption = None,
+) -> None:
+    """Copy the BNC state from one storage backend to another"""
+    data_dir, config = _resolve_paths(data_dir, config)
+    bot_config = BotConfig.load_config(config)
+    data = migrate_storage(
+        create_storage(source, bot_config, data_dir),
+        create_storage(dest, bot_config, data_dir),
+    )
+    typer.echo(
+        f"Migrated {len(data.users)} users and {len(data.queue)} queue "
+        f"entries from {source} to {dest} storage"
+    )
+
+
+def _fetch_from_bot(
+    data_dir: Path | None, config: Path | None, path: str
+) -> str:
+    data_dir, config = _resolve_paths(data_dir, config)
+    bot_config = BotConfig.load_config(config)
+    if bot_config.metrics_port is None:
+        typer.echo("metrics_port is not set in the config", err=True)
+        raise typer.Exit(1)
+
+    url = f"http://{bot_config.metrics_host}:{bot_config.metrics_port}{path}"
+    try:
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            text: str = resp.read().decode()
+    except OSError as e:
+        # URLError wraps the underlying error, such as a refused connection
+        reason = e.reason if isinstance(e, urllib.error.URLError) else e
+        typer.echo(f"could not reach the bot at {url}: {reason}", err=True)
+        raise typer.Exit(1) from None
+
+    return text
+
+
+@app.command()
+def metrics(
+    data_dir: DataDirOption = None, config: ConfigOption = None
+) -> None:
+    """Print the running bot's metrics from its metrics port"""
+    typer.echo(_fetch_from_bot(data_dir, config, "/metrics"), nl=False)
+
+
+@app.command()
+def bindhosts(
+    data_dir: DataDirOption = None, config: ConfigOption = None
+) -> None:
+    """Print the running bot's bindhost usage report from its metrics port"""
+    typer.echo(_fetch_from_bot(data_dir, config, "/bindhosts"), nl=False)
+
+
+def _open_storage(
+    data_dir: Path | None, config: Path | None, kind: StorageKind | None
+) -> tuple[Storage, BotConfig]:
+    data_dir, config = _resolve_paths(data_dir, config)
+    bot_config = BotConfig.load_config(config)
+    storage = create_storage(kind or bot_config.storage, bot_config, data_dir)
+    return storage, bot_config
+
+
+@app.command()
+def export(
+    output: Annotated[
         Path | None,
         typer.Option(
-            dir_okay=True,
-            file_okay=False,
-            writable=True,
-            help="Directory where BNC state data should be stored. Defaults to the current working directory.",
+            "--output",
+            "-o",
+            dir_okay=False,
+            help="File to write to. Defaults to stdout.",
         ),
     ] = None,
-    config: Annotated[
-        Path | None,
-        typer.Option(
+    data_dir: DataDirOption = None,
+    config: ConfigOption = None,
+    storage: StorageOption = None,
+) -> None:
+    """Export the BNC users and queue as one JSON entry per line"""
+    store, _ = _open_storage(data_dir, config, storage)
+    if output is None:
+        count = maintenance.export_state(store, sys.stdout)
+    else:
+        with output.open("w", encoding="utf-8") as f:
+            count = maintenance.export_state(store, f)
+
+    typer.echo(f"Exported {count} entries", err=True)
+
+
+@app.command("import")
+def import_(
+    source: Annotated[
+        Path,
+        typer.Argument(
             dir_okay=False,
-            file_okay=True,
             exists=True,
             readable=True,
-            help="Config file to read. Defaults to $DATA_DIR/config,json",
+            help="File of entries written by export",
         ),
-    ] = None,
+    ],
+    replace: Annotated[
+        bool, typer.Option(help="Discard the stored users and queue first")
+    ] = False,
+    data_dir: DataDirOption = None,
+    config: ConfigOption = None,
+    storage: StorageOption = None,
 ) -> None:
-    if data_dir is None:
-        data_dir = Path.cwd()
+    """Import BNC users and queue entries written by export"""
+    store, _ = _open_storage(data_dir, config, storage)
+    try:
+        with source.open(encoding="utf-8") as f:
+            count = maintenance.import_state(store, f, replace=replace)
+    except ValueError as e:
+        typer.echo(f"{source}: {e}", err=True)
+        raise typer.Exit(1) from None
 
-    if config is None:
-        config = data_dir / "config.json"
+    typer.echo(f"Imported {count} entries")
 
-    if not data_dir.exists():
-        data_dir.mkdir(parents=True)
 
+@app.command()
+def validate(
+    data_dir: DataDirOption = None,
+    config: ConfigOption = None,
+    storage: StorageOption = None,
+) -> None:
+    """Check the stored BNC state for problems"""
+    store, bot_config = _open_storage(data_dir, config, storage)
+    report = maintenance.validate_state(store, bot_config)
+    for problem in report.problems:
+        typer.echo(problem)
+
+    typer.echo(
+        f"Checked {report.users} users and {report.queue} queue entries: "
+        f"{len(report.problems)} problems"
+    )
+    if report.problems:
+        raise typer.Exit(1)
+
+
+@app.command()
+def compact(
+    data_dir: DataDirOption = None,
+    config: ConfigOption = None,
+    storage: StorageOption = None,
+) -> None:
+    """Rewrite the stored BNC state, folding in the journal and duplicates"""
+    store, _ = _open_storage(data_dir, config, storage)
+    queue, users = maintenance.compact_state(store)
+    typer.echo(f"Wrote {users} users and {queue} queue entries")
+
+
+@app.command()
+def dupes(
+    data_dir: DataDirOption = None,
+    config: ConfigOption = None,
+    storage: StorageOption = None,
+) -> None:
+    """List bindhosts shared by several users or outside bind_host_net"""
+    store, bot_config = _open_storage(data_dir, config, storage)
+    pool = maintenance.find_duplicates(store, bot_config)
+    for host, users in sorted(pool.duplicates().items()):
+        typer.echo(f"{host}: {', '.join(users)}")
+
+    for host, count in sorted(pool.foreign.items()):
+        typer.echo(f"{host}: outside {pool.net} ({count} users)")
+
+
+@app.command()
+def reallocate(
+    out_of_range: Annotated[
+        bool,
+        typer.Option(help="Also move users whose host is outside the networks"),
+    ] = False,
+    dry_run: Annotated[
+        bool, typer.Option(help="Only print the changes")
+    ] = False,
+    data_dir: DataDirOption = None,
+    config: ConfigOption = None,
+    storage: StorageOption = None,
+) -> None:
+    """
+    Give a new bindhost to all but one user of each shared host
+
+    Prints the *controlpanel commands which apply the changes to ZNC.
+    """
+    store, bot_config = _open_storage(data_dir, config, storage)
     try:
-        asyncio.run(async_main(data_dir, config))
-    finally:
-        logging.shutdown()
+        changes = maintenance.reallocate(
+            store, bot_config, out_of_range=out_of_range, dry_run=dry_run
+        )
+    except ValueError as e:
+        typer.echo(f"Nothing was changed: {e}", err=True)
+        raise typer.Exit(1) from None
+
+    for user, _, host in changes:
+        typer.echo(f"/msg *controlpanel Set BindHost {user} {host}")
+
+    done = "to reallocate" if dry_run else "reallocated"
+    typer.echo(f"{len(changes)} users {done}", err=True)
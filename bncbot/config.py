@@ -3,10 +3,16 @@
 #
 # SPDX-License-Identifier: MIT
 
+from functools import cached_property
 from pathlib import Path
+from typing import Literal
 
-from pydantic import BaseModel, Field
-from typing_extensions import Self
+from pydantic import BaseModel, Field, model_validator
+from typing_extensions import Self, override
+
+from bncbot import jsonstream
+from bncbot.bindhost import AddressRanges
+from bncbot.util import atomic_write_text
 
 
 class FileBasedDataModel(BaseModel):
@@ -19,8 +25,10 @@ class FileBasedDataModel(BaseModel):
         return cls()
 
     def save_config(self, path: Path) -> None:
-        text = self.model_dump_json(indent=4, by_alias=True)
-        path.write_text(text, encoding="utf-8")
+        atomic_write_text(path, self.dump_config())
+
+    def dump_config(self) -> str:
+        return self.model_dump_json(indent=4, by_alias=True)
 
 
 class BotConfig(FileBasedDataModel):
@@ -36,11 +44,47 @@ class BotConfig(FileBasedDataModel):
     admins: list[str] = ["*!*@snoonet/staff/*", "*!*@snoonet/manager/*"]
     log_channel: str = "##log_channel"
     command_prefix: str = "."
-    bind_host_net: str = "127.0.0.0/16"
+    bind_host_net: str | list[str] = "127.0.0.0/16"
+    bind_host_exclude: list[str] = []
 
     debug: bool = False
+    config_watch_interval: float = 0
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int | None = None
     log_to_file: bool = False
     nickserv_timeout: int | float = 30
+    nickserv_concurrency: int = 4
+    nickserv_cache_ttl: float = 300
+    znc_query_timeout: float = 60
+    whois_timeout: float = 30
+    whois_cache_ttl: float = 60
+    whois_negative_cache_ttl: float = 5
+    bindhost_fetch_window: int = 32
+    save_delay: float = 1.0
+    saveconfig_interval: float = 30
+    send_rate: float = 2.0
+    send_burst: int = 9
+    control_send_rate: float = 0
+    control_send_burst: int = 50
+    query_send_rate: float = 1.0
+    query_send_burst: int = 5
+    storage: Literal["json", "journal"] = "json"
+    journal_compact_threshold: int = 10_000
+    blocking_workers: int = 4
+    blocking_queue_limit: int = 64
+
+    @cached_property
+    def bind_networks(self) -> AddressRanges:
+        """The bindhost ranges, parsed once per loaded config"""
+        return AddressRanges.parse(self.bind_host_net, self.bind_host_exclude)
+
+    @model_validator(mode="after")
+    def _check_bind_networks(self) -> Self:
+        if not self.bind_networks.size:
+            msg = "bind_host_net has no addresses left after exclusions"
+            raise ValueError(msg)
+
+        return self
 
 
 BNCUsers = dict[str, str | None]
@@ -50,3 +94,27 @@ BNCQueue = dict[str, str]
 class BNCData(FileBasedDataModel):
     queue: BNCQueue = {}
     users: BNCUsers = {}
+
+    @classmethod
+    @override
+    def load_config(cls, path: Path) -> Self:
+        """
+        Build the data from `path` as it's parsed, a chunk at a time
+
+        Every table is already checked to map names to strings or nulls, so
+        pydantic's validation of the whole document is skipped. Like that
+        validation, other top-level keys are ignored.
+
+        Raises:
+            ValueError: If the file isn't valid BNC data
+        """
+        if not path.exists():
+            return cls()
+
+        tables = jsonstream.read_tables(path, tables=cls.model_fields)
+        queue = tables.get("queue", {})
+        if None in queue.values():
+            msg = f"{path}: queue entries must be strings"
+            raise ValueError(msg)
+
+        return cls.model_construct(queue=queue, users=tables.get("users", {}))
@@ -4,25 +4,33 @@
 # SPDX-License-Identifier: MIT
 
 import asyncio
-import inspect
-import ipaddress
+import itertools
 import logging
 import logging.config
+import re
 import signal
-from collections import defaultdict
-from collections.abc import Callable
+import time
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
 from datetime import timedelta
-from fnmatch import fnmatch
+from functools import partial
 from pathlib import Path
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, NamedTuple
 
 from asyncirc.protocol import IrcProtocol
 from asyncirc.server import Server
 
 from bncbot import irc, util
-from bncbot.async_util import call_func, timer
-from bncbot.bot import Handlers
+from bncbot.async_util import BlockingExecutor, Coalescer, timer
+from bncbot.bindhost import AddressRanges, BindHostPool
+from bncbot.bot import DispatchTable, Handlers, Hook
 from bncbot.config import BNCData, BNCQueue, BNCUsers, BotConfig
+from bncbot.correlate import MORE, Correlator, More, Reply, Route
+from bncbot.metrics import BotMetrics, MetricsServer
+from bncbot.nickserv import NICKSERV_ROUTES, NickServInfo
+from bncbot.sendqueue import SendPriority, SendQueue
+from bncbot.storage import Mutation, create_storage
+from bncbot.table import TABLE_LINE_RE, TableParser, TableRow
+from bncbot.whois import WhoisLookup
 
 if TYPE_CHECKING:
     from irclib.parser import Message
@@ -30,6 +38,96 @@ if TYPE_CHECKING:
     from bncbot.event import Event
 
 
+ZNC_ROUTES = {
+    "status": (Route("table", "table", TABLE_LINE_RE),),
+    "controlpanel": (
+        Route(
+            "no_user",
+            "get",
+            re.compile(r"^Error: User \[(?P<user>.+)\] does not exist"),
+            key_group="user",
+        ),
+        Route("value", "get", re.compile(r"^(?P<var>\w+) = (?P<value>.*)$")),
+    ),
+}
+
+
+def _is_controlpanel_reply(var: str, reply: Reply) -> bool:
+    return reply.route == "no_user" or reply.group("var").lower() == var
+
+
+def _parse_controlpanel_get(reply: Reply) -> str | None:
+    if reply.route == "no_user":
+        return None
+
+    return reply.group("value").strip()
+
+
+def _is_no_user(reply: Reply) -> bool:
+    return reply.route == "no_user"
+
+
+def _log_set_failure(
+    logger: logging.Logger, command: str, fut: "asyncio.Future[str | None]"
+) -> None:
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.warning("No reply from *controlpanel to %r", command)
+
+
+# Names for the users looked up by `Conn.controlpanel_sync`, which ZNC
+# usernames can never match
+_SYNC_IDS = (f"-sync{i}" for i in itertools.count(1))
+
+# How many times `Conn.fetch_bind_hosts` retries a window after a timeout
+BINDHOST_FETCH_ATTEMPTS = 3
+
+
+class UserSyncStats(NamedTuple):
+    """Changes applied to the user list by a sync"""
+
+    added: int
+    removed: int
+    unchanged: int
+
+
+# Settings which only take effect on a new connection to ZNC
+CONNECTION_FIELDS = frozenset({"server", "port", "ssl", "password", "user"})
+
+# Settings which can't be changed without restarting the bot
+RESTART_FIELDS = frozenset(
+    {
+        "storage",
+        "journal_compact_threshold",
+        "blocking_workers",
+        "blocking_queue_limit",
+        "config_watch_interval",
+    }
+)
+
+
+class ConfigReload(NamedTuple):
+    """The outcome of reloading the config file"""
+
+    changed: frozenset[str]
+    reconnect: bool
+    needs_restart: frozenset[str]
+
+    def describe(self) -> str:
+        if not self.changed:
+            return "no changes"
+
+        parts = [f"changed {', '.join(sorted(self.changed))}"]
+        if self.reconnect:
+            parts.append("reconnected")
+
+        if self.needs_restart:
+            parts.append(
+                f"restart needed for {', '.join(sorted(self.needs_restart))}"
+            )
+
+        return "; ".join(parts)
+
+
 class Conn:
     def __init__(
         self, handlers: Handlers, *, data_path: Path, config: Path
@@ -38,18 +136,142 @@ class Conn:
         self.run_dir = data_path
         self._protocol: IrcProtocol | None = None
         self.handlers = handlers
-        self.futures: dict[str, asyncio.Future[Any]] = {}
-        self.locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.dispatch = DispatchTable.build(handlers)
+        self.queries = Correlator(ZNC_ROUTES)
+        self._user_list: asyncio.Task[list[str]] | None = None
+        # The users removed during each running `get_user_hosts`
+        self._sync_removals: list[set[str]] = []
+        self._controlpanel_gets: dict[
+            tuple[str, str], asyncio.Task[str | None]
+        ] = {}
         self.loop = asyncio.get_running_loop()
-        self.bnc_data = BNCData.load_config(self.data_file)
         self.stopped_future = asyncio.Future[None]()
-        self.get_users_state: int = 0
+        self.identity = util.IrcIdentity()
+        self._config_mtime = self._read_config_mtime()
         self.config = BotConfig.load_config(self.config_file)
+        self.storage = create_storage(
+            self.config.storage, self.config, self.run_dir
+        )
+        self.storage.load()
+        self.index_bind_hosts()
         if not self.log_dir.exists():
             self.log_dir.mkdir()
 
         self.setup_logger()
         self.logger = logging.getLogger("bncbot")
+        self.send_queue = SendQueue.from_config(self.config, self._write_line)
+        self.znc_saveconfig = Coalescer(
+            self._send_saveconfig, self.config.saveconfig_interval
+        )
+        self.whois = WhoisLookup(
+            self.send_query,
+            timeout=self.config.whois_timeout,
+            cache_ttl=self.config.whois_cache_ttl,
+            negative_ttl=self.config.whois_negative_cache_ttl,
+            casefold=util.irc_lower,
+        )
+        self.queries.add_routes("nickserv", NICKSERV_ROUTES)
+        self.nickserv = NickServInfo(
+            self.queries,
+            self._nickserv_msg,
+            timeout=self.config.nickserv_timeout,
+            concurrency=self.config.nickserv_concurrency,
+            cache_ttl=self.config.nickserv_cache_ttl,
+        )
+        self.blocking_executor = BlockingExecutor(
+            self.config.blocking_workers,
+            self.config.blocking_queue_limit,
+            name="bncbot-blocking",
+            logger=self.logger,
+        )
+        self.metrics = BotMetrics()
+        self.metrics_server: MetricsServer | None = None
+        self.register_metrics()
+
+    def register_metrics(self) -> None:
+        """Expose values owned by the connection's components as metrics"""
+        add = self.metrics.add_callback
+        add(
+            "bncbot_lines_sent_total",
+            "Lines written to the server, by priority",
+            lambda: {
+                name: stats.sent
+                for name, stats in self.send_queue.stats().items()
+            },
+            kind="counter",
+            label="priority",
+        )
+        add(
+            "bncbot_send_queue_depth",
+            "Lines waiting in the send queue",
+            lambda: self.send_queue.depth,
+        )
+        add(
+            "bncbot_pending_queries",
+            "Queries waiting for a reply, by kind",
+            lambda: {
+                "znc": self.queries.pending,
+                "whois": len(self.whois.pending),
+                "nickserv": len(self.nickserv.pending),
+            },
+            label="kind",
+        )
+        add("bncbot_bnc_users", "BNC users", lambda: len(self.bnc_users))
+        add(
+            "bncbot_bnc_queue",
+            "Pending BNC requests",
+            lambda: len(self.bnc_queue),
+        )
+        add(
+            "bncbot_znc_saveconfig_total",
+            "znc saveconfig commands sent",
+            lambda: self.znc_saveconfig.calls,
+            kind="counter",
+        )
+        add(
+            "bncbot_znc_saveconfig_coalesced_total",
+            "znc saveconfig requests merged into another save",
+            lambda: self.znc_saveconfig.coalesced,
+            kind="counter",
+        )
+        add(
+            "bncbot_storage_writes_total",
+            "BNC state writes",
+            lambda: self.storage.writes,
+            kind="counter",
+        )
+        add(
+            "bncbot_blocking_jobs",
+            "Blocking handler jobs running on a worker or queued for one",
+            lambda: {
+                "running": self.blocking_executor.stats().busy,
+                "queued": self.blocking_executor.stats().queued,
+            },
+            label="state",
+        )
+        add(
+            "bncbot_blocking_jobs_peak",
+            "Most blocking handler jobs pending at once",
+            lambda: self.blocking_executor.peak_pending,
+        )
+        add(
+            "bncbot_blocking_jobs_completed_total",
+            "Blocking handler jobs which returned",
+            lambda: self.blocking_executor.completed,
+            kind="counter",
+        )
+        add(
+            "bncbot_blocking_jobs_failed_total",
+            "Blocking handler jobs which raised",
+            lambda: self.blocking_executor.failed,
+            kind="counter",
+        )
+        add(
+            "bncbot_blocking_full_waits_total",
+            "Blocking handler jobs which waited for the executor to have room",
+            lambda: self.blocking_executor.full_waits,
+            kind="counter",
+        )
 
     def setup_logger(self) -> None:
         do_debug: bool = self.config.debug
@@ -125,20 +347,130 @@ class Conn:
             )
 
     def save_data(self) -> None:
-        self.bnc_data.save_config(self.data_file)
+        self.storage.schedule_save()
 
     async def run(self) -> None:
         def _handle_interrupt() -> None:
             asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
 
+        def _handle_hangup() -> None:
+            asyncio.run_coroutine_threadsafe(
+                self.reload_and_report("SIGHUP"), self.loop
+            )
+
         self.loop.add_signal_handler(signal.SIGINT, _handle_interrupt)
+        self.loop.add_signal_handler(signal.SIGHUP, _handle_hangup)
         try:
+            await self.start_metrics_server()
             await self.connect()
             self.load_data(True)
             self.start_timers()
             await self.stopped_future
         finally:
             self.loop.remove_signal_handler(signal.SIGINT)
+            self.loop.remove_signal_handler(signal.SIGHUP)
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+
+            await self.storage.flush()
+
+    async def start_metrics_server(self) -> None:
+        """(Re)start the metrics endpoint if the config enables one"""
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+
+        if self.config.metrics_port is not None:
+            server = MetricsServer(
+                self.metrics.render, {"/bindhosts": self.bindhost_report}
+            )
+            await server.start(
+                self.config.metrics_host, self.config.metrics_port
+            )
+            self.metrics_server = server
+
+    def _read_config_mtime(self) -> int | None:
+        try:
+            return self.config_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    async def check_config_file(self) -> None:
+        """Reload the config if its file has changed since it was loaded"""
+        if self._read_config_mtime() != self._config_mtime:
+            await self.reload_and_report("file change")
+
+    async def reload_config(self) -> ConfigReload:
+        """Load the config file again and apply it without restarting
+
+        The new config is validated in full before it replaces the current
+        one. Only changes to the connection settings cause a reconnect.
+
+        Raises:
+            ValueError: If the new config is invalid
+            OSError: If the config file couldn't be read
+        """
+        self._config_mtime = self._read_config_mtime()
+        new = BotConfig.load_config(self.config_file)
+        old = self.config
+        changed = frozenset(
+            name
+            for name in BotConfig.model_fields
+            if getattr(old, name) != getattr(new, name)
+        )
+        result = ConfigReload(
+            changed, bool(changed & CONNECTION_FIELDS), changed & RESTART_FIELDS
+        )
+        if not changed:
+            return result
+
+        self.config = new
+        self.apply_config(changed)
+        if changed & {"metrics_host", "metrics_port"}:
+            try:
+                await self.start_metrics_server()
+            except OSError:
+                self.logger.exception("Failed to start the metrics server")
+                self.chan_log("ERROR: Unable to start the metrics server")
+
+        if result.reconnect:
+            await self.reconnect()
+
+        return result
+
+    def apply_config(self, changed: frozenset[str]) -> None:
+        """Update the state derived from the config after it changed"""
+        config = self.config
+        if changed & {"bind_host_net", "bind_host_exclude"}:
+            self.index_bind_hosts()
+
+        if changed & {"debug", "log_to_file"}:
+            self.setup_logger()
+
+        if "nickserv_concurrency" in changed:
+            self.nickserv.set_concurrency(config.nickserv_concurrency)
+
+        self.send_queue.configure(config)
+        self.storage.delay = config.save_delay
+        self.znc_saveconfig.interval = config.saveconfig_interval
+        self.whois.timeout = config.whois_timeout
+        self.whois.cache_ttl = config.whois_cache_ttl
+        self.whois.negative_ttl = config.whois_negative_cache_ttl
+        self.nickserv.timeout = config.nickserv_timeout
+        self.nickserv.cache_ttl = config.nickserv_cache_ttl
+
+    async def reload_and_report(self, source: str) -> ConfigReload | None:
+        """Reload the config, logging the outcome to the log channel"""
+        try:
+            result = await self.reload_config()
+        except (OSError, ValueError) as e:
+            self.logger.exception("Failed to reload config")
+            reason = str(e).splitlines()[0] if str(e) else type(e).__name__
+            self.chan_log(f"ERROR: Config reload ({source}) failed: {reason}")
+            return None
+
+        self.chan_log(f"Config reloaded ({source}): {result.describe()}")
+        return result
 
     def create_timer(
         self,
@@ -158,46 +490,303 @@ class Conn:
             self.get_user_hosts,
             initial_interval=timedelta(hours=8),
         )
+        if self.config.config_watch_interval > 0:
+            self.create_timer(
+                self.config.config_watch_interval, self.check_config_file
+            )
 
     def send(self, *parts: str) -> None:
+        self._queue_line(" ".join(parts))
+
+    def send_query(self, *parts: str) -> "asyncio.Future[None]":
+        """
+        Send a line the bot expects a reply to
+
+        Returns a future which is done once the line is written, which the
+        reply's timeout should start from.
+        """
+        written = asyncio.get_running_loop().create_future()
+        self._queue_line(" ".join(parts), written)
+        return written
+
+    def _queue_line(
+        self, line: str, written: "asyncio.Future[None] | None" = None
+    ) -> None:
+        if not self._protocol:
+            msg = "Tried to send on closed protocol"
+            raise ValueError(msg)
+
+        self.send_queue.put(line, self.send_priority(line), written=written)
+
+    def send_priority(self, line: str) -> SendPriority:
+        """
+        Lines for ZNC itself skip ahead of lines bound for the network, and
+        lookups the bot is waiting on skip ahead of other network lines
+        """
+        cmd, _, rest = line.partition(" ")
+        cmd = cmd.upper()
+        if cmd == "ZNC" or (
+            cmd in ("PRIVMSG", "NOTICE") and rest.startswith(self.prefix)
+        ):
+            return "control"
+
+        if cmd == "WHOIS" or (
+            cmd == "PRIVMSG" and rest.lower().startswith("nickserv ")
+        ):
+            return "query"
+
+        return "user"
+
+    def _write_line(self, line: str) -> None:
         if not self._protocol:
             msg = "Tried to send on closed protocol"
             raise ValueError(msg)
 
-        self._protocol.send(" ".join(parts))
+        self._protocol.send(line)
+
+    def save_znc_config(self) -> None:
+        """Have ZNC write out its config, coalescing closely spaced requests
+
+        ZNC rewrites its whole config file on every `saveconfig`, so these
+        are sent at most once per `saveconfig_interval` seconds.
+        """
+        self.znc_saveconfig.trigger()
+
+    def _send_saveconfig(self) -> None:
+        self.send("znc saveconfig")
 
     def module_msg(self, name: str, cmd: str) -> None:
         self.msg(self.prefix + name, cmd)
 
-    async def get_user_hosts(self) -> None:
-        """Should only be run periodically to keep the user list in sync"""
-        self.get_users_state = 0
-        self.bnc_users.clear()
-        user_list_fut: asyncio.Future[None] = asyncio.Future()
-        self.futures["user_list"] = user_list_fut
-        self.send("znc listusers")
-        await user_list_fut
-
-        for user in self.bnc_users:
-            bindhost_fut: asyncio.Future[str] = asyncio.Future()
-            self.futures["bindhost"] = bindhost_fut
-            self.module_msg("controlpanel", f"Get BindHost {user}")
-            self.bnc_users[user] = await bindhost_fut
+    async def get_user_hosts(self) -> UserSyncStats:
+        """Should only be run periodically to keep the user list in sync
+
+        The new user list is built separately and applied in one step, only
+        fetching BindHosts for users which are new or have no known host.
+        Users deleted while the list is fetched aren't added back.
+        """
+        start = time.perf_counter()
+        known = dict(self.bnc_users)
+        deleted: set[str] = set()
+        self._sync_removals.append(deleted)
+        try:
+            listing = await self.list_users()
+            added = [user for user in listing if user not in known]
+            unknown = [
+                user
+                for user in listing
+                if user in known and known[user] is None
+            ]
+            listed = set(listing)
+            removed = [user for user in known if user not in listed]
 
-        self.save_data()
-        self.load_data()
-        host_map = defaultdict(list)
-        for user, host in self.bnc_users.items():
-            host_map[host].append(user)
+            hosts = await self.fetch_bind_hosts(added + unknown)
+        finally:
+            self._sync_removals.remove(deleted)
 
-        hosts = {
-            host: users
-            for host, users in host_map.items()
-            if host and len(users) > 1
-        }
+        for user in removed:
+            self.rem_user(user)
+
+        for user, host in hosts.items():
+            if user not in deleted:
+                self.set_user_host(user, host)
+
+        stats = UserSyncStats(
+            len(added), len(removed), len(listed) - len(added)
+        )
+        self.metrics.refresh_duration.observe(time.perf_counter() - start)
+        self.chan_log(
+            f"BNC user list updated: {stats.added} added, "
+            f"{stats.removed} removed, {stats.unchanged} unchanged"
+        )
+
+        dupes = self.bind_hosts.duplicates()
+        if dupes:
+            self.chan_log(f"WARNING: Duplicate BindHosts found: {dupes}")
+
+        return stats
+
+    async def list_users(self) -> list[str]:
+        """Retrieve the current list of ZNC users from *status"""
+        if self._user_list is None or self._user_list.done():
+            self._user_list = asyncio.create_task(self._request_user_list())
 
-        if hosts:
-            self.chan_log(f"WARNING: Duplicate BindHosts found: {hosts}")
+        return await asyncio.shield(self._user_list)
+
+    async def _request_user_list(self) -> list[str]:
+        return [row["Username"] async for row in self.znc_table("ListUsers")]
+
+    async def znc_table(self, command: str) -> AsyncIterator[TableRow]:
+        """Send a *status command and yield the rows of its table reply
+
+        Works for any command answered with a single table, such as
+        `ListUsers`, `ListNetworks <user>` or `ListClients <user>`.
+        """
+        parser = TableParser()
+        rows: asyncio.Queue[TableRow | None] = asyncio.Queue()
+
+        def _parse(reply: Reply) -> tuple[str, ...] | More:
+            row = parser.feed(reply.match.string)
+            if row is not None:
+                rows.put_nowait(row)
+
+            if parser.done:
+                return parser.headers or ()
+
+            return MORE
+
+        request = asyncio.create_task(
+            self.queries.request(
+                "status",
+                "table",
+                partial(self.send_query, f"znc {command}"),
+                _parse,
+                timeout=self.config.znc_query_timeout,
+            )
+        )
+        request.add_done_callback(lambda _: rows.put_nowait(None))
+        try:
+            while (row := await rows.get()) is not None:
+                yield row
+
+            await request
+        finally:
+            request.cancel()
+
+    async def fetch_bind_hosts(
+        self, users: Iterable[str]
+    ) -> dict[str, str | None]:
+        """Fetch the BindHost for each user in `users`
+
+        Up to `bindhost_fetch_window` requests are kept in flight at once.
+        *controlpanel's replies don't name the user, so they are matched to
+        requests by order. If one times out, its reply may still arrive and
+        shift every later one, so the whole window is abandoned, the replies
+        still on their way are drained and the unfinished users are fetched
+        again. Users still unfinished after `BINDHOST_FETCH_ATTEMPTS`
+        windows get None.
+        """
+        results: dict[str, str | None] = {}
+
+        async def _worker(pending: Iterator[str]) -> None:
+            for user in pending:
+                results[user] = await self.controlpanel_get("BindHost", user)
+
+        remaining = list(users)
+        for _ in range(BINDHOST_FETCH_ATTEMPTS):
+            if not remaining:
+                break
+
+            pending = iter(remaining)
+            window = max(1, self.config.bindhost_fetch_window)
+            workers = [
+                asyncio.create_task(_worker(pending)) for _ in range(window)
+            ]
+            try:
+                await asyncio.gather(*workers)
+            except asyncio.TimeoutError:
+                for worker in workers:
+                    worker.cancel()
+
+                self.cancel_controlpanel_gets("BindHost")
+                await asyncio.gather(*workers, return_exceptions=True)
+            else:
+                break
+
+            remaining = [user for user in remaining if user not in results]
+            self.logger.warning(
+                "Timed out fetching BindHosts, retrying %d users",
+                len(remaining),
+            )
+            try:
+                await self.controlpanel_sync()
+            except asyncio.TimeoutError:
+                break
+
+        for user in remaining:
+            if user not in results:
+                self.logger.warning(
+                    "Timed out fetching the BindHost for %s", user
+                )
+                results[user] = None
+
+        return results
+
+    async def controlpanel_get(self, var: str, user: str) -> str | None:
+        """Fetch one of `user`'s settings from *controlpanel
+
+        Concurrent requests for the same setting share one query.
+
+        Returns:
+            The setting's value, or None if the user doesn't exist
+        """
+        key = (var.lower(), user)
+        task = self._controlpanel_gets.get(key)
+        if task is None:
+            task = asyncio.create_task(
+                self.queries.request(
+                    "controlpanel",
+                    "get",
+                    partial(
+                        self.module_msg, "controlpanel", f"Get {var} {user}"
+                    ),
+                    _parse_controlpanel_get,
+                    key=user,
+                    accept=partial(_is_controlpanel_reply, var.lower()),
+                    timeout=self.config.znc_query_timeout,
+                )
+            )
+            self._controlpanel_gets[key] = task
+            task.add_done_callback(partial(self._controlpanel_gets.pop, key))
+
+        return await asyncio.shield(task)
+
+    def cancel_controlpanel_gets(self, var: str) -> None:
+        """Give up on every pending Get of `var`"""
+        var = var.lower()
+        for (get_var, _), task in list(self._controlpanel_gets.items()):
+            if get_var == var:
+                task.cancel()
+
+    def controlpanel_set(self, var: str, user: str, value: str) -> None:
+        """Change one of `user`'s settings with *controlpanel
+
+        ZNC answers a Set with the same `Var = value` line as a Get, so the
+        Set is queued as a query of its own to claim that reply, in order
+        with any pending Gets.
+        """
+        command = f"Set {var} {user} {value}"
+        fut = self.queries.expect(
+            "controlpanel",
+            "get",
+            _parse_controlpanel_get,
+            key=user,
+            accept=partial(_is_controlpanel_reply, var.lower()),
+            timeout=self.config.znc_query_timeout,
+        )
+        fut.add_done_callback(partial(_log_set_failure, self.logger, command))
+        self.module_msg("controlpanel", command)
+
+    async def controlpanel_sync(self) -> None:
+        """Wait until *controlpanel has answered everything sent so far
+
+        Replies are sent in order, so this looks up a user which can't
+        exist and waits for the error. Replies to abandoned queries which
+        arrive meanwhile are dropped rather than taken by later queries.
+
+        Raises:
+            TimeoutError: If *controlpanel didn't answer in time
+        """
+        user = next(_SYNC_IDS)
+        await self.queries.request(
+            "controlpanel",
+            "get",
+            partial(self.module_msg, "controlpanel", f"Get BindHost {user}"),
+            _parse_controlpanel_get,
+            key=user,
+            accept=_is_no_user,
+            timeout=self.config.znc_query_timeout,
+        )
 
     async def connect(self) -> None:
         servers = [
@@ -217,40 +806,69 @@ class Conn:
             logger=self.logger,
         )
 
+        self.identity.set_nick(self._protocol.nick)
         self._protocol.register("*", self.handle_line)
         await self._protocol.connect()
 
+    async def reconnect(self) -> None:
+        """Replace the connection to ZNC using the current config"""
+        if self._protocol:
+            self._protocol.quit()
+            self._protocol.close()
+
+        await self.connect()
+
     def close(self) -> None:
         if self._protocol:
             self._protocol.quit()
             self._protocol.close()
 
+        self.znc_saveconfig.cancel()
+        self.send_queue.close()
+        self.blocking_executor.shutdown()
+
     async def shutdown(self) -> None:
         self.chan_log("Bot shutting down...")
+        self.znc_saveconfig.flush()
+        await self.storage.flush()
+        await self.send_queue.flush(timeout=10)
         self.close()
         await asyncio.sleep(0)
         self.stopped_future.set_result(None)
 
     async def handle_line(self, proto: "IrcProtocol", line: "Message") -> None:
+        self.logger.info("[incoming] %s", line)
+        self.metrics.lines_received.inc(line.command)
+        hooks = self.dispatch.get(line.command)
+        if not hooks:
+            return
+
         raw_event = irc.make_event(self, line)
-        for handler in self.handlers.get("raw", {}).get("", []):
-            await self.launch_hook(raw_event, handler)
+        for hook in hooks:
+            await self.launch_hook(raw_event, hook)
 
-    async def launch_hook(
-        self, event: "Event", func: Callable[..., None]
-    ) -> bool:
+    async def launch_hook(self, event: "Event", hook: Hook) -> bool:
+        start = time.perf_counter()
         try:
-            params = [
-                getattr(event, name)
-                for name in inspect.signature(func).parameters.keys()
-            ]
-            await call_func(func, *params)
+            if hook.blocking:
+                await self.blocking_executor.run(
+                    hook.func, *hook.get_args(event)
+                )
+            elif hook.is_coro:
+                await hook.func(*hook.get_args(event))
+            else:
+                hook.func(*hook.get_args(event))
         except Exception as e:
+            self.metrics.hook_errors.inc(hook.func.__name__)
             self.logger.exception("Error occurred in hook")
             self.chan_log(
-                f"Error occurred in hook {func.__name__} '{type(e).__name__}: {e}'"
+                f"Error occurred in hook {hook.func.__name__} '{type(e).__name__}: {e}'"
             )
             return False
+        finally:
+            self.metrics.hook_duration.observe(
+                time.perf_counter() - start, hook.func.__name__
+            )
 
         return True
 
@@ -263,33 +881,30 @@ class Conn:
         )
 
     def is_admin(self, mask: str) -> bool:
-        return any(fnmatch(mask.lower(), pat.lower()) for pat in self.admins)
+        return self.admin_matcher.matches(mask)
 
     async def is_bnc_admin(self, name: str) -> bool:
-        lock = self.locks["controlpanel_bncadmin"]
-        async with lock:
-            fut: asyncio.Future[bool] = self.futures.setdefault(
-                "bncadmin", asyncio.Future()
-            )
-            self.module_msg("controlpanel", f"Get Admin {name}")
-            res = await fut
-
-        return res
+        return await self.controlpanel_get("Admin", name) == "true"
 
     def add_queue(self, nick: str, registered_time: str) -> None:
         self.bnc_queue[nick] = registered_time
-        self.save_data()
+        self.storage.record(Mutation("queue", nick, registered_time))
 
     def rem_queue(self, nick: str) -> None:
         if nick in self.bnc_queue:
             del self.bnc_queue[nick]
-            self.save_data()
+            self.storage.record(Mutation("queue", nick, delete=True))
 
     def chan_log(self, msg: str) -> None:
         if self.log_chan:
             self.msg(self.log_chan, msg)
 
-    def add_user(self, nick: str) -> bool:
+    def add_user(self, nick: str, *, save_config: bool = True) -> bool:
+        """Create a ZNC user for `nick` and MemoServ them the credentials
+
+        Callers adding several users can pass `save_config=False` and send a
+        single `save_znc_config` once they are done.
+        """
         if not util.is_username_valid(nick):
             username = util.sanitize_username(nick)
             self.chan_log(
@@ -306,12 +921,14 @@ class Conn:
 
         self.module_msg("controlpanel", f"cloneuser BNCClient {username}")
         self.module_msg("controlpanel", f"Set Password {username} {passwd}")
-        self.module_msg("controlpanel", f"Set BindHost {username} {host}")
-        self.module_msg("controlpanel", f"Set Nick {username} {nick}")
-        self.module_msg("controlpanel", f"Set AltNick {username} {nick}_")
-        self.module_msg("controlpanel", f"Set Ident {username} {nick}")
-        self.module_msg("controlpanel", f"Set Realname {username} {nick}")
-        self.send("znc saveconfig")
+        self.controlpanel_set("BindHost", username, host)
+        self.controlpanel_set("Nick", username, nick)
+        self.controlpanel_set("AltNick", username, f"{nick}_")
+        self.controlpanel_set("Ident", username, nick)
+        self.controlpanel_set("Realname", username, nick)
+        if save_config:
+            self.save_znc_config()
+
         self.module_msg(
             "controlpanel", f"reconnect {username} {self.config.bnc_network}"
         )
@@ -321,31 +938,80 @@ class Conn:
             f"{passwd} {self.client_connect_info()} and /PASS "
             f"{username}:{passwd}",
         )
-        self.bnc_users[username] = host
-        self.save_data()
+        self.set_user_host(username, host)
+        self.bind_hosts.record_allocation()
         return True
 
-    def get_bind_host(self) -> str:
-        for _ in range(50):
-            host = str(util.get_random_address(self.bind_host_net))
-            if host not in self.bnc_users.values():
-                return host
+    def set_user_host(self, user: str, host: str | None) -> None:
+        self.bind_hosts.release(self.bnc_users.get(user), user)
+        self.bnc_users[user] = host
+        self.bind_hosts.claim(host, user)
+        self.storage.record(Mutation("users", user, host))
+
+    def rem_user(self, user: str) -> None:
+        for deleted in self._sync_removals:
+            deleted.add(user)
+
+        if user in self.bnc_users:
+            self.bind_hosts.release(self.bnc_users.pop(user), user)
+            self.storage.record(Mutation("users", user, delete=True))
 
-        self.chan_log("ERROR: get_bind_host() has hit a bindhost collision")
-        raise ValueError
+    def index_bind_hosts(self) -> None:
+        """Rebuild the bindhost pool from the current user list"""
+        pool = BindHostPool(self.bind_host_net)
+        old: BindHostPool | None = getattr(self, "bind_hosts", None)
+        if old is not None:
+            pool.allocations = old.allocations
+
+        for user, host in self.bnc_users.items():
+            pool.claim(host, user)
+
+        self.bind_hosts = pool
+
+    def bindhost_report(self) -> str:
+        return "\n".join(self.bind_hosts.report().lines()) + "\n"
+
+    def get_bind_host(self) -> str:
+        try:
+            return self.bind_hosts.pick()
+        except ValueError:
+            self.chan_log(
+                f"ERROR: get_bind_host() found no free bindhosts in "
+                f"{self.bind_hosts.net}"
+            )
+            raise
 
     def msg(self, target: str, *messages: str) -> None:
         for message in messages:
             self.send(f"PRIVMSG {target} :{message}")
 
+    def _nickserv_msg(self, message: str) -> "asyncio.Future[None]":
+        return self.send_query(f"PRIVMSG NickServ :{message}")
+
     def notice(self, target: str, *messages: str) -> None:
         for message in messages:
             self.send(f"NOTICE {target} :{message}")
 
+    @property
+    def config(self) -> BotConfig:
+        return self._config
+
+    @config.setter
+    def config(self, value: BotConfig) -> None:
+        self._config = value
+        self.admin_matcher = util.MaskMatcher(value.admins)
+        self.identity.update(
+            log_chan=value.log_channel, cmd_prefix=value.command_prefix
+        )
+
     @property
     def admins(self) -> list[str]:
         return self.config.admins
 
+    @property
+    def bnc_data(self) -> BNCData:
+        return self.storage.data
+
     @property
     def bnc_queue(self) -> BNCQueue:
         return self.bnc_data.queue
@@ -367,17 +1033,13 @@ class Conn:
         return self.config.log_channel
 
     @property
-    def bind_host_net(self) -> util.IPNetwork:
-        return ipaddress.ip_network(self.config.bind_host_net)
+    def bind_host_net(self) -> AddressRanges:
+        return self.config.bind_networks
 
     @property
     def log_dir(self) -> Path:
         return self.run_dir / "logs"
 
-    @property
-    def data_file(self) -> Path:
-        return self.run_dir / "bnc.json"
-
     @property
     def nick(self) -> str:
         if self._protocol is None:
@@ -393,3 +1055,4 @@ class Conn:
             raise ValueError(msg)
 
         self._protocol.nick = value
+        self.identity.set_nick(value)
@@ -0,0 +1,281 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Matching replies from ZNC modules and services to the queries that caused them
+"""
+
+import asyncio
+import enum
+import re
+from collections.abc import Awaitable, Callable, Iterable, Mapping
+from typing import Any, Final, Literal, NamedTuple, TypeAlias, TypeVar
+
+_T = TypeVar("_T")
+
+
+class _More(enum.Enum):
+    MORE = enum.auto()
+
+
+MORE: Final = _More.MORE
+"""Returned by a parser which needs more reply lines to finish"""
+
+More: TypeAlias = Literal[_More.MORE]
+
+
+def _expire(fut: "asyncio.Future[Any]", exc: type[Exception]) -> None:
+    if not fut.done():
+        fut.set_exception(exc())
+
+
+class Route(NamedTuple):
+    """
+    A kind of reply line a source can send
+
+    Replies are delivered to queries waiting on `reply_type`. When
+    `key_group` is set, the reply is delivered to the oldest query with the
+    matching key, otherwise to the oldest query of that type. A route which
+    `opens_block` isn't delivered; it sets the key for the unkeyed replies
+    which follow it from the same source.
+    """
+
+    name: str
+    reply_type: str
+    pattern: re.Pattern[str]
+    key_group: str | None = None
+    opens_block: bool = False
+
+
+class Reply(NamedTuple):
+    source: str
+    route: str
+    match: re.Match[str]
+
+    def group(self, name: str) -> str:
+        return self.match[name]
+
+
+class _Query:
+    __slots__ = ("accept", "future", "key", "parse")
+
+    def __init__(
+        self,
+        key: str | None,
+        parse: Callable[[Reply], Any],
+        accept: Callable[[Reply], bool] | None,
+        future: "asyncio.Future[Any]",
+    ) -> None:
+        self.key = key
+        self.parse = parse
+        self.accept = accept
+        self.future = future
+
+    def wants(self, reply: Reply) -> bool:
+        return not self.future.done() and (
+            self.accept is None or self.accept(reply)
+        )
+
+
+class _Lane:
+    """The queries waiting on one (source, reply type), oldest first"""
+
+    def __init__(self) -> None:
+        self.queries: list[_Query] = []
+        self.keyed: dict[str, list[_Query]] = {}
+
+    def add(self, query: _Query) -> None:
+        self.queries.append(query)
+        if query.key is not None:
+            self.keyed.setdefault(query.key, []).append(query)
+
+    def discard(self, query: _Query) -> None:
+        if query in self.queries:
+            self.queries.remove(query)
+
+        if query.key is None:
+            return
+
+        keyed = self.keyed.get(query.key)
+        if keyed is not None and query in keyed:
+            keyed.remove(query)
+            if not keyed:
+                del self.keyed[query.key]
+
+    def take(self, key: str | None, reply: Reply) -> _Query | None:
+        queries = self.queries if key is None else self.keyed.get(key, ())
+        for query in queries:
+            if query.wants(reply):
+                return query
+
+        return None
+
+
+class Correlator:
+    """
+    Routes reply lines to the pending queries waiting for them
+
+    Each source has an ordered list of routes. An incoming line is
+    classified by the first route whose pattern matches, then looked up in
+    an index of pending queries keyed by source and reply type.
+    """
+
+    def __init__(
+        self,
+        routes: Mapping[str, Iterable[Route]] | None = None,
+        *,
+        casefold: Callable[[str], str] = str.casefold,
+    ) -> None:
+        self.casefold = casefold
+        self.pending = 0
+        self._routes: dict[str, list[Route]] = {}
+        self._lanes: dict[tuple[str, str], _Lane] = {}
+        self._blocks: dict[str, str] = {}
+        for source, source_routes in (routes or {}).items():
+            self.add_routes(source, source_routes)
+
+    def add_routes(self, source: str, routes: Iterable[Route]) -> None:
+        self._routes.setdefault(source, []).extend(routes)
+
+    def _register(
+        self,
+        source: str,
+        reply_type: str,
+        parse: Callable[[Reply], Any],
+        key: str | None,
+        accept: Callable[[Reply], bool] | None,
+    ) -> tuple[_Lane, _Query]:
+        fut = asyncio.get_running_loop().create_future()
+        query = _Query(
+            None if key is None else self.casefold(key), parse, accept, fut
+        )
+        lane = self._lanes.setdefault((source, reply_type), _Lane())
+        lane.add(query)
+        self.pending += 1
+        return lane, query
+
+    def _unregister(self, lane: _Lane, query: _Query) -> None:
+        self.pending -= 1
+        lane.discard(query)
+        query.future.cancel()
+
+    async def request(
+        self,
+        source: str,
+        reply_type: str,
+        send: Callable[[], Awaitable[None] | None],
+        parse: Callable[[Reply], "_T | More"],
+        *,
+        key: str | None = None,
+        accept: Callable[[Reply], bool] | None = None,
+        timeout: float | None = None,
+    ) -> _T:
+        """Register a query, send it and wait for its parsed reply
+
+        `parse` is called with each reply routed to the query until it
+        returns something other than `MORE`. If `send` returns an awaitable,
+        such as a send queue's written future, the timeout starts once it's
+        done.
+
+        Raises:
+            TimeoutError: If no complete reply arrived within `timeout`
+        """
+        lane, query = self._register(source, reply_type, parse, key, accept)
+        try:
+            written = send()
+            if written is not None:
+                await written
+
+            result: _T = await asyncio.wait_for(query.future, timeout)
+        finally:
+            self._unregister(lane, query)
+
+        return result
+
+    def expect(
+        self,
+        source: str,
+        reply_type: str,
+        parse: Callable[[Reply], "_T | More"],
+        *,
+        key: str | None = None,
+        accept: Callable[[Reply], bool] | None = None,
+        timeout: float | None = None,
+    ) -> "asyncio.Future[_T]":
+        """
+        Register a query for a line the caller is about to send itself
+
+        Unlike `request`, the query is in place when this returns, so it
+        keeps its order relative to other lines sent in the same step. The
+        returned future fails with TimeoutError after `timeout`.
+        """
+        lane, query = self._register(source, reply_type, parse, key, accept)
+        fut = query.future
+        handle = None
+        if timeout is not None:
+            handle = fut.get_loop().call_later(
+                timeout, _expire, fut, asyncio.TimeoutError
+            )
+
+        def _done(_: "asyncio.Future[_T]") -> None:
+            if handle is not None:
+                handle.cancel()
+
+            self._unregister(lane, query)
+
+        fut.add_done_callback(_done)
+        return fut
+
+    def feed(self, source: str, line: str) -> bool:
+        """Route a line from `source`, returning whether a query took it"""
+        for route in self._routes.get(source, ()):
+            match = route.pattern.match(line)
+            if match is not None:
+                break
+        else:
+            return False
+
+        reply = Reply(source, route.name, match)
+        key = None
+        if route.key_group is not None:
+            key = self.casefold(reply.group(route.key_group))
+
+        lane = self._lanes.get((source, route.reply_type))
+        if route.opens_block:
+            if key is not None and lane is not None and key in lane.keyed:
+                self._blocks[source] = key
+            else:
+                self._blocks.pop(source, None)
+
+            return True
+
+        if lane is None:
+            return False
+
+        query = None
+        if key is None and (block := self._blocks.get(source)) is not None:
+            query = lane.take(block, reply)
+
+        if query is None:
+            query = lane.take(key, reply)
+
+        if query is None:
+            return False
+
+        try:
+            result = query.parse(reply)
+        except Exception as e:  # noqa: BLE001
+            query.future.set_exception(e)
+        else:
+            if result is MORE:
+                return True
+
+            query.future.set_result(result)
+
+        lane.discard(query)
+        if query.key is not None and self._blocks.get(source) == query.key:
+            del self._blocks[source]
+
+        return True
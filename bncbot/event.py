@@ -3,10 +3,11 @@
 #
 # SPDX-License-Identifier: MIT
 
+import enum
 from asyncio import AbstractEventLoop
-from typing import TYPE_CHECKING, Optional, overload
+from typing import TYPE_CHECKING, Final, Optional, overload
 
-from typing_extensions import Self
+from typing_extensions import Self, override
 
 from bncbot.config import BNCData, BNCQueue, BNCUsers
 
@@ -16,18 +17,50 @@ if TYPE_CHECKING:
     from bncbot.bot import Command
     from bncbot.conn import Conn
 
+CMD_PARAMS: dict[str, tuple[str, ...]] = {
+    "PRIVMSG": ("chan", "msg"),
+    "NOTICE": ("chan", "msg"),
+    "JOIN": ("chan",),
+    "PART": ("chan", "msg"),
+}
+
+
+class _Unset(enum.Enum):
+    UNSET = enum.auto()
+
+
+_UNSET: Final = _Unset.UNSET
+
 
 class Event:
+    """
+    The context a handler is called with
+
+    Fields not passed to the constructor are looked up on `base_event` when
+    they're read, so derived events share their base event's state rather
+    than copying it.
+    """
+
+    __slots__ = (
+        "_chan",
+        "_host",
+        "_mask",
+        "_nick",
+        "_user",
+        "base_event",
+        "conn",
+    )
+
     @overload
     def __init__(
         self,
         *,
         conn: "Conn",
         base_event: None = None,
-        nick: str | None,
-        user: str | None,
-        host: str | None,
-        mask: str | None,
+        nick: str | None = None,
+        user: str | None = None,
+        host: str | None = None,
+        mask: str | None = None,
         chan: str | None = None,
     ) -> None: ...
 
@@ -55,24 +88,47 @@ class Event:
         mask: str | None = None,
         chan: str | None = None,
     ) -> None:
-        if base_event:
-            self.conn: Conn = conn or base_event.conn
-            self.nick: str | None = nick or base_event.nick
-            self.user: str | None = user or base_event.user
-            self.host: str | None = host or base_event.host
-            self.mask: str | None = mask or base_event.mask
-            self.chan: str | None = chan or base_event.chan
-        else:
-            if conn is None:
-                msg = "'conn' must be set or inherited"
-                raise ValueError(msg)
+        if base_event is not None:
+            conn = conn or base_event.conn
+        elif conn is None:
+            msg = "'conn' must be set or inherited"
+            raise ValueError(msg)
+
+        self.conn: Conn = conn
+        self.base_event = base_event
+        self._nick = nick
+        self._user = user
+        self._host = host
+        self._mask = mask
+        self._chan = chan
+
+    def _inherit(self, name: str) -> str | None:
+        """Look up a field which wasn't set on this event"""
+        if self.base_event is None:
+            return None
+
+        value: str | None = getattr(self.base_event, name)
+        return value
+
+    @property
+    def nick(self) -> str | None:
+        return self._nick or self._inherit("nick")
+
+    @property
+    def user(self) -> str | None:
+        return self._user or self._inherit("user")
+
+    @property
+    def host(self) -> str | None:
+        return self._host or self._inherit("host")
 
-            self.conn = conn
-            self.nick = nick
-            self.user = user
-            self.host = host
-            self.mask = mask
-            self.chan = chan
+    @property
+    def mask(self) -> str | None:
+        return self._mask or self._inherit("mask")
+
+    @property
+    def chan(self) -> str | None:
+        return self._chan or self._inherit("chan")
 
     def message(self, message: str, target: str | None = None) -> None:
         if not target:
@@ -123,16 +179,25 @@ class Event:
 
 
 class RawEvent(Event):
+    """
+    An event for a single IRC line
+
+    The source and channel fields are read from `irc_rawline` on first use,
+    unless they were passed explicitly.
+    """
+
+    __slots__ = ("_line_chan", "irc_command", "irc_paramlist", "irc_rawline")
+
     @overload
     def __init__(
         self,
         *,
         conn: "Conn",
         base_event: None = None,
-        nick: str | None,
-        user: str | None,
-        host: str | None,
-        mask: str | None,
+        nick: str | None = None,
+        user: str | None = None,
+        host: str | None = None,
+        mask: str | None = None,
         chan: str | None = None,
         irc_rawline: "Message",
         irc_command: str,
@@ -191,9 +256,41 @@ class RawEvent(Event):
         self.irc_rawline = irc_rawline
         self.irc_command = irc_command
         self.irc_paramlist = irc_paramlist
+        self._line_chan: str | None | _Unset = _UNSET
+
+    @override
+    def _inherit(self, name: str) -> str | None:
+        line = self.irc_rawline
+        if line is None:
+            return super()._inherit(name)
+
+        if name == "chan":
+            if self._line_chan is _UNSET:
+                self._line_chan = self._resolve_chan(line)
+
+            return self._line_chan
+
+        if not line.prefix:
+            return None
+
+        value: str = getattr(line.prefix, name)
+        return value
+
+    def _resolve_chan(self, line: "Message") -> str | None:
+        params = CMD_PARAMS.get(line.command)
+        if params is None or "chan" not in params:
+            return None
+
+        chan: str = line.parameters[params.index("chan")]
+        if self.conn.identity.is_self(chan):
+            return self.nick
+
+        return chan
 
 
 class CommandEvent(Event):
+    __slots__ = ("cmd_handler", "command", "text")
+
     def __init__(
         self,
         *,
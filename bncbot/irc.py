@@ -12,42 +12,12 @@ if TYPE_CHECKING:
 
     from bncbot.conn import Conn
 
-CMD_PARAMS: dict[str, tuple[str, ...]] = {
-    "PRIVMSG": ("chan", "msg"),
-    "NOTICE": ("chan", "msg"),
-    "JOIN": ("chan",),
-    "PART": ("chan", "msg"),
-}
-
 
 def make_event(conn: "Conn", line: "Message") -> RawEvent:
-    cmd = line.command
-    params = line.parameters
-    if line.prefix:
-        nick = line.prefix.nick
-        user = line.prefix.user
-        host = line.prefix.host
-        mask = line.prefix.mask
-    else:
-        nick = None
-        user = None
-        host = None
-        mask = None
-
-    chan: str | None = None
-    if cmd in CMD_PARAMS and "chan" in CMD_PARAMS[cmd]:
-        chan = params[CMD_PARAMS[cmd].index("chan")]
-        if chan.lower() == conn.nick.lower():
-            chan = nick
-
+    """Wrap `line` in an event, leaving its fields to be read on demand"""
     return RawEvent(
         conn=conn,
-        nick=nick,
-        user=user,
-        host=host,
-        mask=mask,
-        chan=chan,
         irc_rawline=line,
-        irc_command=cmd,
-        irc_paramlist=params,
+        irc_command=line.command,
+        irc_paramlist=line.parameters,
     )
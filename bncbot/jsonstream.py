@@ -0,0 +1,386 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Incremental reading and writing of the BNC state document
+
+The state is stored as a JSON object of tables, each mapping names to a
+string or null, such as `{"users": {"nick": "127.0.0.1", "other": null}}`.
+
+`iter_document` and `read_tables` read such a file a chunk at a time and
+`write_document` writes one from iterables, so none of them hold the whole
+file's text in memory. The readers can be limited to some tables, in which
+case any other top-level value is skipped as long as it's valid JSON.
+`read_header` reads the scalar values, such as a version, which
+`write_document` can put before the tables.
+"""
+
+import itertools
+import json
+import json.decoder
+from collections.abc import Callable, Collection, Iterable, Iterator, Mapping
+from pathlib import Path
+from typing import TextIO
+
+from bncbot.util import atomic_write
+
+# The string scanner json.loads uses, which typeshed doesn't declare
+_scanstring: Callable[[str, int], tuple[str, int]]
+_scanstring = json.decoder.scanstring  # type: ignore[attr-defined]
+
+CHUNK_SIZE = 1 << 16
+_DECODER = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+Entry = tuple[str, str, str | None]
+
+
+def _all_strings(values: Iterable[object]) -> bool:
+    for value in values:
+        if value is not None and type(value) is not str:
+            return False
+
+    return True
+
+
+class _Reader:
+    def __init__(self, f: TextIO, name: str, chunk_size: int) -> None:
+        self.f = f
+        self.name = name
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+
+    def error(self, expected: str) -> ValueError:
+        return ValueError(
+            f"{self.name}: expected {expected} at offset {self.offset + self.pos}"
+        )
+
+    def fill(self) -> bool:
+        """Read another chunk, returning False at the end of the file"""
+        if self.eof:
+            return False
+
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.offset += self.pos
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character, or "" at the end"""
+        while True:
+            buf = self.buf
+            pos = self.pos
+            end = len(buf)
+            while pos < end and buf[pos] in WHITESPACE:
+                pos += 1
+
+            self.pos = pos
+            if pos < end:
+                return buf[pos]
+
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise self.error(repr(char))
+
+        self.pos += 1
+
+    def string(self) -> str:
+        if self.peek() != '"':
+            raise self.error("a string")
+
+        while True:
+            try:
+                value, end = _scanstring(self.buf, self.pos + 1)
+            except json.JSONDecodeError:
+                # Possibly cut off at the end of the chunk
+                if self.fill():
+                    continue
+
+                raise self.error("a complete string") from None
+
+            self.pos = end
+            return value
+
+    def nullable_string(self) -> str | None:
+        char = self.peek()
+        if char == '"':
+            return self.string()
+
+        if char != "n":
+            raise self.error("a string or null")
+
+        while len(self.buf) - self.pos < 4 and self.fill():
+            pass
+
+        if self.buf.startswith("null", self.pos):
+            self.pos += 4
+            return None
+
+        raise self.error("a string or null")
+
+    def _unquoted(self, char: str, start: int, end: int, *, last: bool) -> int:
+        """
+        Find the first or last `char` from `start` to `end` outside a string,
+        or -1. Only valid where there are no escapes.
+        """
+        buf = self.buf
+        find = buf.rfind if last else buf.find
+        pos = find(char, start, end)
+        quotes = buf.count('"', start, pos)
+        while pos != -1 and quotes % 2:
+            if last:
+                prev, pos = pos, buf.rfind(char, start, pos)
+                quotes -= buf.count('"', pos, prev)
+            else:
+                prev, pos = pos, buf.find(char, pos + 1, end)
+                quotes += buf.count('"', prev, pos)
+
+        return pos
+
+    def _plain_end(self) -> int:
+        """
+        Find where the members ahead in the buffer can be parsed in one go
+
+        This is the last "," before the end of the buffer, the object or the
+        first escape, or -1 if there isn't one.
+        """
+        buf = self.buf
+        start = self.pos
+        end = buf.find("\\", start)
+        if end == -1:
+            end = len(buf)
+
+        close = self._unquoted("}", start, end, last=False)
+        if close != -1:
+            end = close
+
+        return self._unquoted(",", start, end, last=True)
+
+    def _member(self) -> tuple[str, str | None]:
+        key = self.string()
+        self.expect(":")
+        return key, self.nullable_string()
+
+    def _next_member(self) -> bool:
+        """Consume the "," or "}" after a member, returning True for a ","."""
+        char = self.peek()
+        self.pos += 1
+        if char == ",":
+            return True
+
+        if char == "}":
+            return False
+
+        self.pos -= 1
+        raise self.error("',' or '}'")
+
+    def batches(self) -> Iterator[list[tuple[str, str | None]]]:
+        """Yield the members of an object of strings or nulls, in batches"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            end = self._plain_end()
+            if end != -1:
+                # Parsing a run of plain members with json.loads is much
+                # faster, and any problem is left to the general path
+                try:
+                    pairs = json.loads(
+                        "{" + self.buf[self.pos : end] + "}",
+                        object_pairs_hook=list,
+                    )
+                except ValueError:
+                    pass
+                else:
+                    if _all_strings(value for _, value in pairs):
+                        self.pos = end + 1
+                        yield pairs
+
+            yield [self._member()]
+            if not self._next_member():
+                return
+
+    def read_object(self) -> dict[str, str | None]:
+        """Read an object of strings or nulls into a dict"""
+        return dict(itertools.chain.from_iterable(self.batches()))
+
+    def skip_value(self) -> None:
+        """Skip over any JSON value, which is parsed whole and dropped"""
+        self.value()
+
+    def value(self) -> object:
+        """Read any JSON value, parsing it whole"""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Possibly cut off at the end of the chunk
+                if self.fill():
+                    continue
+
+                raise self.error("a JSON value") from None
+
+            # A number at the end of the chunk may carry on in the next one
+            if end == len(self.buf) and self.fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Yield the keys of an object, leaving each value to the caller"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self.string()
+            self.expect(":")
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+
+            if char != ",":
+                self.pos -= 1
+                raise self.error("',' or '}'")
+
+
+def iter_document(
+    path: Path,
+    *,
+    tables: Collection[str] | None = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Entry]:
+    """
+    Yield (table, name, value) for every entry in the document at `path`
+
+    Entries are yielded in file order, so if a name appears twice in a
+    table the later value is the one which counts. If `tables` is given,
+    the values of other tables are skipped.
+
+    Raises:
+        ValueError: If the file isn't a valid state document
+    """
+    with path.open(encoding="utf-8") as f:
+        reader = _Reader(f, str(path), chunk_size)
+        for table in reader.members():
+            if tables is not None and table not in tables:
+                reader.skip_value()
+                continue
+
+            for batch in reader.batches():
+                for name, value in batch:
+                    yield table, name, value
+
+        if reader.peek():
+            raise reader.error("the end of the file")
+
+
+def read_tables(
+    path: Path,
+    *,
+    tables: Collection[str] | None = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> dict[str, dict[str, str | None]]:
+    """
+    Read the document at `path` into a dict of tables
+
+    If `tables` is given, the values of other tables are skipped.
+
+    Raises:
+        ValueError: If the file isn't a valid state document
+    """
+    result: dict[str, dict[str, str | None]] = {}
+    with path.open(encoding="utf-8") as f:
+        reader = _Reader(f, str(path), chunk_size)
+        for table in reader.members():
+            if tables is not None and table not in tables:
+                reader.skip_value()
+            else:
+                result[table] = reader.read_object()
+
+        if reader.peek():
+            raise reader.error("the end of the file")
+
+    return result
+
+
+def read_header(
+    path: Path, *, chunk_size: int = CHUNK_SIZE
+) -> dict[str, object]:
+    """
+    Read the top-level values before the first table of the document at
+    `path`, without reading the tables
+
+    Raises:
+        ValueError: If the start of the file isn't a valid state document
+    """
+    header: dict[str, object] = {}
+    with path.open(encoding="utf-8") as f:
+        reader = _Reader(f, str(path), chunk_size)
+        for key in reader.members():
+            if reader.peek() == "{":
+                break
+
+            header[key] = reader.value()
+
+    return header
+
+
+def _dump(text: str) -> str:
+    return json.dumps(text, ensure_ascii=False)
+
+
+def write_document(
+    path: Path,
+    tables: Iterable[tuple[str, Iterable[tuple[str, str | None]]]],
+    *,
+    header: Mapping[str, object] | None = None,
+) -> None:
+    """
+    Atomically write a state document from (table, entries) pairs
+
+    The values in `header`, which `read_header` reads back, are written
+    before the tables. The output is otherwise laid out like
+    `BNCData.dump_config`.
+    """
+    with atomic_write(path) as f:
+        f.write("{")
+        sep = ""
+        for key, scalar in (header or {}).items():
+            f.write(f"{sep}\n    {_dump(key)}: {json.dumps(scalar)}")
+            sep = ","
+
+        for table, entries in tables:
+            f.write(f"{sep}\n    {_dump(table)}: {{")
+            sep = ","
+            empty = True
+            for name, value in entries:
+                f.write(
+                    f"{'' if empty else ','}\n        {_dump(name)}: "
+                    f"{'null' if value is None else _dump(value)}"
+                )
+                empty = False
+
+            f.write("}" if empty else "\n    }")
+
+        f.write("\n}")
@@ -0,0 +1,289 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Offline inspection and maintenance of the stored BNC state
+
+These work on a `Storage` while the bot is stopped. The stored file is read
+and written a chunk at a time, so its text is never held in memory.
+
+`export_state` and `validate_state` only hold one entry at a time, plus the
+set of names seen for `validate_state`. The others resolve repeated names
+in a temporary SQLite database, which spills to disk as it grows, and then
+stream the result. `find_duplicates` and `reallocate` still claim every
+user's host in a `BindHostPool`, whose memory grows with the number of
+hosts in use.
+"""
+
+import ipaddress
+import sqlite3
+from collections.abc import Iterable, Iterator
+from contextlib import closing
+from typing import NamedTuple, TextIO
+
+from bncbot import util
+from bncbot.bindhost import BindHostPool
+from bncbot.config import BotConfig
+from bncbot.storage import TABLES, Mutation, Storage, Table
+
+
+class ValidationReport(NamedTuple):
+    users: int
+    queue: int
+    problems: list[str]
+
+
+class Reassignment(NamedTuple):
+    user: str
+    old_host: str | None
+    new_host: str
+
+
+class _EntryIndex:
+    """
+    The net effect of a stream of entries, kept out of memory
+
+    Entries are applied like `Mutation.apply` applies them to a `BNCData`,
+    and each table is read back in the order its names were first set.
+    """
+
+    def __init__(self) -> None:
+        # An empty name is a private database on disk, which SQLite deletes
+        # when it is closed
+        self._db = sqlite3.connect("")
+        self._db.execute(
+            "CREATE TABLE entries (tbl TEXT, key TEXT, value TEXT, "
+            "UNIQUE (tbl, key))"
+        )
+
+    def close(self) -> None:
+        self._db.close()
+
+    def apply(self, mutation: Mutation) -> None:
+        table, key, value, delete = mutation
+        if delete:
+            self._db.execute(
+                "DELETE FROM entries WHERE tbl = ? AND key = ?", (table, key)
+            )
+        elif table == "users" or value is not None:
+            # Like updating a dict, this keeps the name's place
+            self._db.execute(
+                "INSERT INTO entries VALUES (?, ?, ?) ON CONFLICT (tbl, key) "
+                "DO UPDATE SET value = excluded.value",
+                (table, key, value),
+            )
+
+    def update(self, mutations: Iterable[Mutation]) -> None:
+        for mutation in mutations:
+            self.apply(mutation)
+
+    def items(self, table: Table) -> Iterator[tuple[str, str | None]]:
+        cursor = self._db.execute(
+            "SELECT key, value FROM entries WHERE tbl = ? ORDER BY rowid",
+            (table,),
+        )
+        yield from cursor
+
+    def count(self, table: Table) -> int:
+        (count,) = self._db.execute(
+            "SELECT count(*) FROM entries WHERE tbl = ?", (table,)
+        ).fetchone()
+        return int(count)
+
+
+def export_state(storage: Storage, out: TextIO) -> int:
+    """
+    Write every stored entry to `out` as journal lines
+
+    Returns the number of entries written.
+    """
+    count = 0
+    for mutation in storage.iter_entries():
+        out.write(mutation.to_json() + "\n")
+        count += 1
+
+    return count
+
+
+def import_state(
+    storage: Storage, lines: Iterable[str], *, replace: bool = False
+) -> int:
+    """
+    Apply journal lines, such as from `export_state`, to the stored state
+
+    With `replace`, the stored entries are discarded first. Nothing is
+    written unless every line is valid. Returns the number of lines applied.
+
+    Raises:
+        ValueError: If a line isn't a valid journal entry
+    """
+    with closing(_EntryIndex()) as index:
+        if not replace:
+            index.update(storage.iter_entries())
+
+        count = 0
+        for lineno, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+
+            try:
+                mutation = Mutation.from_json(line)
+            except (ValueError, KeyError) as e:
+                msg = f"Invalid entry on line {lineno}: {e}"
+                raise ValueError(msg) from e
+
+            index.apply(mutation)
+            count += 1
+
+        storage.rewrite(index.items("queue"), index.items("users"))
+
+    return count
+
+
+def validate_state(storage: Storage, config: BotConfig) -> ValidationReport:
+    """Check the stored entries for problems the bot would trip over"""
+    problems: list[str] = []
+    seen: dict[str, set[str]] = {table: set() for table in TABLES}
+    networks = config.bind_networks
+    try:
+        for table, key, value, _ in storage.iter_entries():
+            if key in seen[table]:
+                problems.append(f"{table}: {key!r} is listed more than once")
+
+            seen[table].add(key)
+            if table == "queue":
+                if value is None:
+                    problems.append(f"queue: {key!r} has no registration date")
+
+                continue
+
+            if not util.is_username_valid(key):
+                problems.append(f"users: {key!r} is not a valid username")
+
+            if value is None:
+                continue
+
+            try:
+                ipaddress.ip_address(value)
+            except ValueError:
+                problems.append(f"users: {key!r} has invalid host {value!r}")
+            else:
+                if networks.index(value) is None:
+                    problems.append(
+                        f"users: {key!r} has host {value} outside {networks}"
+                    )
+    except ValueError as e:
+        problems.append(str(e))
+
+    return ValidationReport(len(seen["users"]), len(seen["queue"]), problems)
+
+
+def compact_state(storage: Storage) -> tuple[int, int]:
+    """
+    Rewrite the stored state as a single document without duplicate names
+
+    Returns the number of queue entries and users written.
+    """
+    with closing(_EntryIndex()) as index:
+        index.update(storage.iter_entries())
+        storage.rewrite(index.items("queue"), index.items("users"))
+        return index.count("queue"), index.count("users")
+
+
+def _claim_all(
+    users: Iterable[tuple[str, str | None]], config: BotConfig
+) -> BindHostPool:
+    pool = BindHostPool(config.bind_networks)
+    for user, host in users:
+        pool.claim(host, user)
+
+    return pool
+
+
+def find_duplicates(storage: Storage, config: BotConfig) -> BindHostPool:
+    """
+    Claim the host of every stored user in a new pool
+
+    A repeated name only counts once. The pool's `duplicates` and `foreign` show the shared hosts and the
+    hosts outside the bind networks.
+    """
+    with closing(_EntryIndex()) as index:
+        index.update(storage.iter_entries())
+        return _claim_all(index.items("users"), config)
+
+
+def reallocate(
+    storage: Storage,
+    config: BotConfig,
+    *,
+    out_of_range: bool = False,
+    dry_run: bool = False,
+) -> list[Reassignment]:
+    """
+    Give new hosts to all but one of the users sharing each host
+
+    With `out_of_range`, users whose host is outside the bind networks are
+    moved too. Unless `dry_run` is set, the stored state is rewritten with
+    the new hosts. ZNC still has to be told about each change.
+
+    Raises:
+        ValueError: If there aren't enough free addresses for every user
+            which needs moving, in which case nothing is changed
+    """
+    with closing(_EntryIndex()) as index:
+        index.update(storage.iter_entries())
+        return _reallocate(storage, index, config, out_of_range, dry_run)
+
+
+def _reallocate(
+    storage: Storage,
+    index: _EntryIndex,
+    config: BotConfig,
+    out_of_range: bool,
+    dry_run: bool,
+) -> list[Reassignment]:
+    pool = _claim_all(index.items("users"), config)
+
+    moves = {
+        user: host
+        for host, owners in pool.duplicates().items()
+        for user in owners[1:]
+    }
+    if out_of_range:
+        moves.update(
+            (user, host)
+            for user, host in index.items("users")
+            if host is not None and host in pool.foreign
+        )
+
+    # Moving a user never frees an address in the networks: a shared host
+    # is still used by whoever keeps it, and a foreign one isn't in them
+    if len(moves) > pool.free:
+        msg = (
+            f"Only {pool.free} free addresses in {pool.net} for "
+            f"{len(moves)} users, so {len(moves) - pool.free} users "
+            "could not be moved"
+        )
+        raise ValueError(msg)
+
+    changes: list[Reassignment] = []
+    new_hosts: dict[str, str] = {}
+    for user, host in sorted(moves.items()):
+        pool.release(host, user)
+        new_host = pool.pick()
+        pool.claim(new_host, user)
+        new_hosts[user] = new_host
+        changes.append(Reassignment(user, host, new_host))
+
+    if changes and not dry_run:
+        storage.rewrite(
+            index.items("queue"),
+            (
+                (user, new_hosts.get(user, host))
+                for user, host in index.items("users")
+            ),
+        )
+
+    return changes
@@ -0,0 +1,286 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Metrics in the Prometheus text exposition format
+
+Recording a sample is a dict update or a list increment, so the metrics can
+stay enabled in production. Values owned by other objects are read through
+callbacks when the metrics are rendered.
+"""
+
+import asyncio
+import bisect
+import logging
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from typing import Literal
+
+from typing_extensions import override
+
+logger = logging.getLogger("bncbot")
+
+MetricType = Literal["counter", "gauge", "histogram"]
+
+HOOK_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+REFRESH_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric(ABC):
+    def __init__(self, name: str, doc: str, kind: MetricType) -> None:
+        self.name = name
+        self.doc = doc
+        self.kind = kind
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A counter split by the value of one label"""
+
+    def __init__(self, name: str, doc: str, label: str | None = None) -> None:
+        super().__init__(name, doc, "counter")
+        self.label = label
+        self.values: dict[str, int] = {}
+
+    def inc(self, label_value: str = "") -> None:
+        values = self.values
+        values[label_value] = values.get(label_value, 0) + 1
+
+    @override
+    def samples(self) -> Iterator[str]:
+        if self.label is None:
+            yield f"{self.name} {self.values.get('', 0)}"
+            return
+
+        for value, count in sorted(self.values.items()):
+            yield f'{self.name}{{{self.label}="{_escape(value)}"}} {count}'
+
+
+class _Buckets:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int) -> None:
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    """A histogram, optionally split by the value of one label"""
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        buckets: Sequence[float],
+        label: str | None = None,
+    ) -> None:
+        super().__init__(name, doc, "histogram")
+        self.bounds = tuple(buckets)
+        self.label = label
+        self.series: dict[str, _Buckets] = {}
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = _Buckets(len(self.bounds) + 1)
+
+        series.counts[bisect.bisect_left(self.bounds, value)] += 1
+        series.sum += value
+
+    @override
+    def samples(self) -> Iterator[str]:
+        for value, series in sorted(self.series.items()):
+            labels = f'{self.label}="{_escape(value)}",' if self.label else ""
+            total = 0
+            for bound, count in zip(
+                (*self.bounds, float("inf")), series.counts, strict=True
+            ):
+                total += count
+                le = _format_value(bound)
+                yield f'{self.name}_bucket{{{labels}le="{le}"}} {total}'
+
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+            yield f"{self.name}_sum{suffix} {_format_value(series.sum)}"
+            yield f"{self.name}_count{suffix} {total}"
+
+
+class CallbackMetric(Metric):
+    """A value read from elsewhere when the metrics are rendered
+
+    `func` returns either a single value or values keyed by `label`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        func: Callable[[], float | dict[str, float]],
+        *,
+        kind: MetricType = "gauge",
+        label: str | None = None,
+    ) -> None:
+        super().__init__(name, doc, kind)
+        self.func = func
+        self.label = label
+
+    @override
+    def samples(self) -> Iterator[str]:
+        result = self.func()
+        if not isinstance(result, dict):
+            yield f"{self.name} {_format_value(result)}"
+            return
+
+        for value, count in sorted(result.items()):
+            yield (
+                f'{self.name}{{{self.label}="{_escape(value)}"}} '
+                f"{_format_value(count)}"
+            )
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def add(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logger.exception("Failed to render metric %s", metric.name)
+
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics:
+    """The metrics recorded directly by the bot's hot paths"""
+
+    def __init__(self) -> None:
+        self.registry = Registry()
+        self.lines_received = Counter(
+            "bncbot_lines_received_total",
+            "IRC lines received, by command",
+            "command",
+        )
+        self.hook_duration = Histogram(
+            "bncbot_hook_duration_seconds",
+            "Time spent running each handler",
+            HOOK_BUCKETS,
+            "handler",
+        )
+        self.hook_errors = Counter(
+            "bncbot_hook_exceptions_total",
+            "Exceptions raised by each handler",
+            "handler",
+        )
+        self.refresh_duration = Histogram(
+            "bncbot_user_refresh_duration_seconds",
+            "Time taken by each BNC user list refresh",
+            REFRESH_BUCKETS,
+        )
+        for metric in (
+            self.lines_received,
+            self.hook_duration,
+            self.hook_errors,
+            self.refresh_duration,
+        ):
+            self.registry.add(metric)
+
+    def add_callback(
+        self,
+        name: str,
+        doc: str,
+        func: Callable[[], float | dict[str, float]],
+        *,
+        kind: MetricType = "gauge",
+        label: str | None = None,
+    ) -> None:
+        self.registry.add(
+            CallbackMetric(name, doc, func, kind=kind, label=label)
+        )
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+class MetricsServer:
+    """
+    Serves the rendered metrics over plain HTTP
+
+    Paths listed in `pages` serve that page's text instead; every other path
+    serves the metrics.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[], str],
+        pages: Mapping[str, Callable[[], str]] | None = None,
+    ) -> None:
+        self.render = render
+        self.pages = dict(pages or {})
+        self._server: asyncio.Server | None = None
+
+    @property
+    def port(self) -> int | None:
+        if self._server is None or not self._server.sockets:
+            return None
+
+        return int(self._server.sockets[0].getsockname()[1])
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            _, _, path = request.partition(b" ")
+            path, _, _ = path.partition(b" ")
+            render = self.pages.get(path.decode(errors="replace"), self.render)
+            body = render().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            OSError,
+        ):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Account registration lookups via NickServ INFO
+"""
+
+import asyncio
+import re
+from collections.abc import Awaitable, Callable
+from functools import partial
+
+from bncbot.correlate import Correlator, Reply, Route
+from bncbot.util import TTLCache
+
+FORMATTING_RE = re.compile(r"\x03\d{0,2}(?:,\d{1,2})?|[\x02\x0f\x16\x1d\x1f]")
+
+NICKSERV_ROUTES = (
+    Route(
+        "not_registered",
+        "info",
+        re.compile(r"^(?:Nick )?(?P<account>\S+) (?:is not|isn't) registered"),
+        key_group="account",
+    ),
+    # Atheme: "Information on Foo (account Foo):"
+    Route(
+        "header",
+        "info",
+        re.compile(r"^Information on (?P<account>\S+) \(account \S+\):$"),
+        key_group="account",
+        opens_block=True,
+    ),
+    # Anope: "Foo is Foo Bar"
+    Route(
+        "header",
+        "info",
+        re.compile(r"^(?P<account>\S+) is .+$"),
+        key_group="account",
+        opens_block=True,
+    ),
+    Route(
+        "registered",
+        "info",
+        re.compile(r"^(?:Account )?[Rr]egistered\s*:\s*(?P<time>.+)$"),
+    ),
+)
+
+
+def _parse_info(reply: Reply) -> str | None:
+    if reply.route == "registered":
+        return reply.group("time").strip()
+
+    return None
+
+
+class NickServInfo:
+    """
+    Looks up when an account was registered with NickServ INFO
+
+    NickServ doesn't tag its replies, so each INFO reply block is matched
+    to its account by the header line which starts it. Registration lines
+    that arrive outside a recognised block go to the oldest request still
+    in flight. Up to `concurrency` requests are sent at once, concurrent
+    lookups for the same account share one request, and registration times
+    are cached for `cache_ttl` seconds. A request holds its slot from when
+    its line is queued, but its timeout only starts once the line is
+    written.
+    """
+
+    def __init__(
+        self,
+        queries: Correlator,
+        send: Callable[[str], Awaitable[None]],
+        *,
+        timeout: float,
+        concurrency: int,
+        cache_ttl: float,
+    ) -> None:
+        self.queries = queries
+        self.send = send
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.pending: dict[str, asyncio.Future[str | None]] = {}
+        self.cache = TTLCache[str, str]()
+        self._limit = asyncio.Semaphore(max(1, concurrency))
+
+    def set_concurrency(self, concurrency: int) -> None:
+        """Limit new lookups to `concurrency` at once
+
+        Lookups already waiting on the old limit keep it.
+        """
+        self._limit = asyncio.Semaphore(max(1, concurrency))
+
+    async def get_registered(self, account: str) -> str | None:
+        """Return the registration time NickServ reports for `account`
+
+        Returns None if the account isn't registered.
+
+        Raises:
+            TimeoutError: If NickServ didn't answer within `timeout` seconds
+                of the request being written, or the caller which sent it
+                was cancelled
+        """
+        key = self.queries.casefold(account)
+        found, registered = self.cache.get(key)
+        if found:
+            return registered
+
+        fut = self.pending.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[key] = fut
+        try:
+            async with self._limit:
+                registered = await self.queries.request(
+                    "nickserv",
+                    "info",
+                    partial(self.send, f"INFO {account}"),
+                    _parse_info,
+                    key=account,
+                    timeout=self.timeout,
+                )
+
+            fut.set_result(registered)
+        finally:
+            del self.pending[key]
+            # Other callers are waiting on this lookup even if it timed out
+            # or its owner was cancelled
+            if not fut.done():
+                fut.set_exception(asyncio.TimeoutError())
+                # Retrieved here, as there may be no other callers
+                fut.exception()
+
+        if registered is not None:
+            self.cache.set(key, registered, self.cache_ttl)
+
+        return registered
+
+    def on_notice(self, message: str) -> None:
+        """Handle a NOTICE from NickServ"""
+        self.queries.feed("nickserv", FORMATTING_RE.sub("", message).strip())
@@ -0,0 +1,243 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Rate limited outbound line queue
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Literal, NamedTuple
+
+from bncbot.config import BotConfig
+
+logger = logging.getLogger("bncbot")
+
+SendPriority = Literal["control", "query", "user"]
+PRIORITIES: tuple[SendPriority, ...] = ("control", "query", "user")
+
+
+class TokenBucket:
+    """
+    Allows `burst` lines at once, refilling at `rate` lines per second
+
+    A rate of 0 or less disables the limit.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated = clock()
+
+    def configure(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = min(self.tokens, self.burst)
+
+    def take(self) -> float:
+        """Take a token if one is available
+
+        Returns:
+            0 if a token was taken, otherwise the seconds until one will be
+        """
+        if self.rate <= 0:
+            return 0
+
+        now = self.clock()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+class QueueStats(NamedTuple):
+    depth: int
+    sent: int
+    total_wait: float
+    max_wait: float
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.sent if self.sent else 0
+
+
+class _Lane:
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.bucket = bucket
+        self.lines: deque[tuple[float, str, asyncio.Future[None] | None]] = (
+            deque()
+        )
+        self.sent = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self) -> QueueStats:
+        return QueueStats(
+            len(self.lines), self.sent, self.total_wait, self.max_wait
+        )
+
+
+class SendQueue:
+    """
+    Queues outbound lines and writes them out under per-priority rate limits
+
+    Each priority has its own token bucket. When several have lines ready,
+    control lines go first, then queries, then user lines.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[str], None],
+        *,
+        control: TokenBucket,
+        query: TokenBucket,
+        user: TokenBucket,
+    ) -> None:
+        self.write = write
+        self._lanes = {
+            "control": _Lane(control),
+            "query": _Lane(query),
+            "user": _Lane(user),
+        }
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: asyncio.Task[None] | None = None
+
+    @classmethod
+    def from_config(
+        cls, config: BotConfig, write: Callable[[str], None]
+    ) -> "SendQueue":
+        return cls(
+            write,
+            control=TokenBucket(
+                config.control_send_rate, config.control_send_burst
+            ),
+            query=TokenBucket(config.query_send_rate, config.query_send_burst),
+            user=TokenBucket(config.send_rate, config.send_burst),
+        )
+
+    def configure(self, config: BotConfig) -> None:
+        """Apply new rate limits, including to lines already queued"""
+        self._lanes["control"].bucket.configure(
+            config.control_send_rate, config.control_send_burst
+        )
+        self._lanes["query"].bucket.configure(
+            config.query_send_rate, config.query_send_burst
+        )
+        self._lanes["user"].bucket.configure(
+            config.send_rate, config.send_burst
+        )
+
+    def put(
+        self,
+        line: str,
+        priority: SendPriority = "user",
+        *,
+        written: "asyncio.Future[None] | None" = None,
+    ) -> None:
+        """
+        Queue `line`, setting the result of `written` once it's written
+
+        Anything waiting on a reply to the line should start its timeout
+        from `written` rather than from queueing it.
+        """
+        self._lanes[priority].lines.append((time.monotonic(), line, written))
+        # A user line can't go any sooner than those already waiting, but a
+        # line in another lane may not have to wait for the user lane's
+        # bucket
+        if priority != "user" or self._idle.is_set():
+            self._wakeup.set()
+
+        self._idle.clear()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stats(self) -> dict[SendPriority, QueueStats]:
+        return {name: self._lanes[name].stats() for name in PRIORITIES}
+
+    @property
+    def depth(self) -> int:
+        return sum(len(lane.lines) for lane in self._lanes.values())
+
+    async def flush(self, timeout: float | None = None) -> bool:
+        """Wait for the queue to empty, returning False on timeout"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            if not self.depth:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            self._wakeup.clear()
+            delay = self._send_next()
+            if not delay:
+                await asyncio.sleep(0)
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _send_next(self) -> float:
+        """Send one line if allowed, otherwise return the time to wait"""
+        delay = float("inf")
+        for name in PRIORITIES:
+            lane = self._lanes[name]
+            if not lane.lines:
+                continue
+
+            wait = lane.bucket.take()
+            if wait:
+                delay = min(delay, wait)
+                continue
+
+            queued_at, line, written = lane.lines.popleft()
+            waited = time.monotonic() - queued_at
+            lane.sent += 1
+            lane.total_wait += waited
+            lane.max_wait = max(lane.max_wait, waited)
+            try:
+                self.write(line)
+            except Exception:
+                logger.exception("Error sending line: %r", line)
+
+            # Resolved even if the write failed, so a query for the line
+            # times out normally
+            if written is not None and not written.done():
+                written.set_result(None)
+
+            return 0
+
+        return delay
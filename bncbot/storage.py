@@ -0,0 +1,488 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Persistence for BNC state data
+"""
+
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
+from itertools import chain
+from pathlib import Path
+from typing import Literal, NamedTuple
+
+from typing_extensions import override
+
+from bncbot import jsonstream
+from bncbot.config import BNCData, BotConfig
+from bncbot.util import atomic_write_text
+
+logger = logging.getLogger("bncbot")
+
+StorageKind = Literal["json", "journal"]
+Table = Literal["queue", "users"]
+TABLES: tuple[Table, ...] = ("queue", "users")
+
+
+class Mutation(NamedTuple):
+    """A single change to the BNC queue or user list"""
+
+    table: Table
+    key: str
+    value: str | None = None
+    delete: bool = False
+
+    def apply(self, data: BNCData) -> None:
+        if self.table == "queue":
+            if self.delete:
+                data.queue.pop(self.key, None)
+            elif self.value is not None:
+                data.queue[self.key] = self.value
+        elif self.delete:
+            data.users.pop(self.key, None)
+        else:
+            data.users[self.key] = self.value
+
+    def to_json(self) -> str:
+        if self.delete:
+            return json.dumps(
+                {"op": "del", "table": self.table, "key": self.key}
+            )
+
+        return json.dumps(
+            {
+                "op": "set",
+                "table": self.table,
+                "key": self.key,
+                "value": self.value,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> "Mutation":
+        entry = json.loads(text)
+        if entry.get("table") not in TABLES:
+            msg = f"Unknown journal table: {entry.get('table')!r}"
+            raise ValueError(msg)
+
+        if entry.get("op") == "del":
+            return cls(entry["table"], entry["key"], delete=True)
+
+        if entry.get("op") == "set":
+            return cls(entry["table"], entry["key"], entry["value"])
+
+        msg = f"Unknown journal operation: {entry.get('op')!r}"
+        raise ValueError(msg)
+
+
+def _journal_header(line: str) -> int | None:
+    """Return the generation if `line` is a journal's header line"""
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+
+    generation = entry.get("generation") if isinstance(entry, dict) else None
+    return generation if isinstance(generation, int) else None
+
+
+def _header_line(generation: int) -> str:
+    return json.dumps({"generation": generation}) + "\n"
+
+
+def _iter_document(path: Path) -> Iterator[Mutation]:
+    """Yield the queue and user entries of the state document at `path`"""
+    for table, key, value in jsonstream.iter_document(path, tables=TABLES):
+        # Always true, but narrows `table` to a `Table`
+        if table in TABLES:
+            yield Mutation(table, key, value)
+
+
+class Storage(ABC):
+    """
+    Base class for BNC data storage backends
+
+    Changes are applied to `data` by the caller and then passed to `record`.
+    Writes are debounced by `delay` seconds so a burst of changes turns into
+    a single write, which runs in a worker thread.
+    """
+
+    def __init__(self, data_dir: Path, *, delay: float = 1.0) -> None:
+        self.data_dir = data_dir
+        self.delay = delay
+        self.data = BNCData()
+        self.dirty = False
+        self.writes = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @abstractmethod
+    def load(self) -> BNCData:
+        """Read the stored data into `data` and return it"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_entries(self) -> Iterator[Mutation]:
+        """
+        Stream the stored entries without loading them into `data`
+
+        Every entry is yielded as a set. If a name is yielded twice for a
+        table, the later value is current.
+
+        Raises:
+            ValueError: If the stored data is corrupt
+        """
+        raise NotImplementedError
+
+    def iter_table(self, table: Table) -> Iterator[tuple[str, str | None]]:
+        for mutation in self.iter_entries():
+            if mutation.table == table:
+                yield mutation.key, mutation.value
+
+    @abstractmethod
+    def rewrite(
+        self,
+        queue: Iterable[tuple[str, str | None]],
+        users: Iterable[tuple[str, str | None]],
+    ) -> None:
+        """
+        Replace the stored data, streaming it from `queue` and `users`
+
+        Each iterable is consumed before the stored data is replaced, so
+        they may read from this storage.
+        """
+        raise NotImplementedError
+
+    def record(self, mutation: Mutation) -> None:
+        """Persist a change which has already been applied to `data`"""
+        self._schedule()
+
+    def schedule_save(self) -> None:
+        """Persist the full contents of `data`"""
+        self._mark_full()
+        self._schedule()
+
+    def save_now(self, full: bool = False) -> None:
+        """Synchronously write out any pending changes, or all data if `full`"""
+        if full:
+            self._mark_full()
+
+        self._cancel_timer()
+        self.dirty = False
+        self._prepare()()
+        self.writes += 1
+
+    async def flush(self) -> None:
+        """Write out any pending changes and wait for the write to finish"""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+        self._cancel_timer()
+        if self.dirty:
+            self._task = asyncio.create_task(self._write())
+            await asyncio.shield(self._task)
+
+    @abstractmethod
+    def _prepare(self) -> Callable[[], None]:
+        """Snapshot the pending changes, returning a function to write them
+
+        This runs on the event loop, the returned function does not.
+        """
+        raise NotImplementedError
+
+    def _mark_full(self) -> None:
+        """Make the next write include all of `data`"""
+
+    def _schedule(self) -> None:
+        self.dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save_now()
+            return
+
+        if self._timer is None and self._task is None:
+            self._timer = loop.call_later(self.delay, self._start_flush)
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _start_flush(self) -> None:
+        self._timer = None
+        self._task = asyncio.create_task(self._write())
+
+    async def _write(self) -> None:
+        try:
+            self.dirty = False
+            await asyncio.to_thread(self._prepare())
+            self.writes += 1
+        except Exception:
+            # The failed batch may be lost, so fall back to a full write
+            self.dirty = True
+            self._mark_full()
+            logger.exception("Failed to save BNC data in %s", self.data_dir)
+        finally:
+            self._task = None
+
+        if self.dirty:
+            self._schedule()
+
+
+class JsonStorage(Storage):
+    """Stores the data as a single JSON document, rewritten on every save"""
+
+    @property
+    def path(self) -> Path:
+        return self.data_dir / "bnc.json"
+
+    @override
+    def load(self) -> BNCData:
+        self.data = BNCData.load_config(self.path)
+        return self.data
+
+    @override
+    def iter_entries(self) -> Iterator[Mutation]:
+        if not self.path.exists():
+            return
+
+        yield from _iter_document(self.path)
+
+    @override
+    def rewrite(
+        self,
+        queue: Iterable[tuple[str, str | None]],
+        users: Iterable[tuple[str, str | None]],
+    ) -> None:
+        jsonstream.write_document(
+            self.path, [("queue", queue), ("users", users)]
+        )
+
+    @override
+    def _prepare(self) -> Callable[[], None]:
+        return partial(atomic_write_text, self.path, self.data.dump_config())
+
+
+class JournalStorage(Storage):
+    """
+    Stores the data as a snapshot plus an append-only journal of changes
+
+    Each change costs one appended line. Once the journal holds
+    `compact_threshold` entries, the snapshot is rewritten and the journal
+    emptied.
+
+    Replaying a journal over a snapshot it was already folded into can
+    revert newer values, so every snapshot carries a generation number,
+    which the journal's first line repeats. Each rewrite of the snapshot
+    bumps it, and a journal from an older generation is ignored, such as
+    when the bot stops between replacing the snapshot and the journal.
+    Journals and snapshots from before generations were added count as
+    generation 0.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path,
+        *,
+        delay: float = 1.0,
+        compact_threshold: int = 10_000,
+    ) -> None:
+        super().__init__(data_dir, delay=delay)
+        self.compact_threshold = compact_threshold
+        self.journal_entries = 0
+        self.generation = 0
+        self._pending: list[str] = []
+        self._compact = False
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.data_dir / "bnc.snapshot.json"
+
+    @property
+    def journal_path(self) -> Path:
+        return self.data_dir / "bnc.journal"
+
+    @override
+    def load(self) -> BNCData:
+        self.data = BNCData.load_config(self.snapshot_path)
+        self.generation = self.snapshot_generation()
+        self.journal_entries = self.replay()
+        return self.data
+
+    def snapshot_generation(self) -> int:
+        """
+        Read the generation of the stored snapshot
+
+        Raises:
+            ValueError: If the snapshot is corrupt
+        """
+        if not self.snapshot_path.exists():
+            return 0
+
+        generation = jsonstream.read_header(self.snapshot_path).get(
+            "generation", 0
+        )
+        if isinstance(generation, int):
+            return generation
+
+        msg = f"{self.snapshot_path}: invalid generation {generation!r}"
+        raise ValueError(msg)
+
+    def replay(self) -> int:
+        """Apply the journal to `data`, returning the number of entries"""
+        count = 0
+        for mutation in self.iter_journal():
+            mutation.apply(self.data)
+            count += 1
+
+        return count
+
+    def iter_journal(self) -> Iterator[Mutation]:
+        """
+        Yield the journal's entries, skipping any corrupt ones
+
+        Nothing is yielded if the journal is older than the snapshot.
+        """
+        if not self.journal_path.exists():
+            return
+
+        snapshot_generation = self.snapshot_generation()
+        with self.journal_path.open(encoding="utf-8") as f:
+            first = f.readline()
+            generation = _journal_header(first)
+            if (generation or 0) < snapshot_generation:
+                logger.warning(
+                    "Ignoring %s, which is older than %s",
+                    self.journal_path,
+                    self.snapshot_path,
+                )
+                return
+
+            lines: Iterator[tuple[int, str]] = enumerate(f, 2)
+            if generation is None:
+                lines = chain([(1, first)], lines)
+
+            for lineno, line in lines:
+                if not line.strip():
+                    continue
+
+                try:
+                    yield Mutation.from_json(line)
+                except (ValueError, KeyError):
+                    logger.warning(
+                        "Skipping corrupt journal entry at %s:%d",
+                        self.journal_path,
+                        lineno,
+                    )
+
+    @override
+    def iter_entries(self) -> Iterator[Mutation]:
+        # The journal is bounded by the compaction threshold, so its net
+        # effect is held in memory while the snapshot is streamed past it
+        overlay: dict[tuple[Table, str], Mutation] = {}
+        for mutation in self.iter_journal():
+            overlay[mutation.table, mutation.key] = mutation
+
+        if self.snapshot_path.exists():
+            for mutation in _iter_document(self.snapshot_path):
+                if (mutation.table, mutation.key) not in overlay:
+                    yield mutation
+
+        for mutation in overlay.values():
+            if not mutation.delete:
+                yield mutation
+
+    @override
+    def rewrite(
+        self,
+        queue: Iterable[tuple[str, str | None]],
+        users: Iterable[tuple[str, str | None]],
+    ) -> None:
+        generation = max(self.generation, self.snapshot_generation()) + 1
+        self._write_snapshot(queue, users, generation)
+
+    @override
+    def record(self, mutation: Mutation) -> None:
+        self._pending.append(mutation.to_json())
+        self.journal_entries += 1
+        if self.journal_entries >= self.compact_threshold:
+            self._compact = True
+
+        super().record(mutation)
+
+    @override
+    def _prepare(self) -> Callable[[], None]:
+        if self._compact:
+            self._compact = False
+            # The snapshot holds these changes, and the generation keeps
+            # the journal they would have gone in from being replayed
+            self._pending.clear()
+            self.journal_entries = 0
+            return partial(
+                self._write_snapshot,
+                list(self.data.queue.items()),
+                list(self.data.users.items()),
+                self.generation + 1,
+            )
+
+        lines, self._pending = self._pending, []
+        return partial(self._append, lines, self.generation)
+
+    @override
+    def _mark_full(self) -> None:
+        self._compact = True
+
+    def _write_snapshot(
+        self,
+        queue: Iterable[tuple[str, str | None]],
+        users: Iterable[tuple[str, str | None]],
+        generation: int,
+    ) -> None:
+        jsonstream.write_document(
+            self.snapshot_path,
+            [("queue", queue), ("users", users)],
+            header={"generation": generation},
+        )
+        # Until this is replaced, the old journal is ignored
+        atomic_write_text(self.journal_path, _header_line(generation))
+        self.generation = generation
+
+    def _append(self, lines: list[str], generation: int) -> None:
+        if not lines:
+            return
+
+        with self.journal_path.open("a", encoding="utf-8") as f:
+            if not f.tell():
+                f.write(_header_line(generation))
+
+            f.write("".join(f"{line}\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def create_storage(
+    kind: StorageKind, config: BotConfig, data_dir: Path
+) -> Storage:
+    if kind == "journal":
+        return JournalStorage(
+            data_dir,
+            delay=config.save_delay,
+            compact_threshold=config.journal_compact_threshold,
+        )
+
+    return JsonStorage(data_dir, delay=config.save_delay)
+
+
+def migrate_storage(source: Storage, dest: Storage) -> BNCData:
+    """Copy all data from `source` into `dest`, replacing its contents"""
+    dest.data = source.load()
+    dest.save_now(full=True)
+    return dest.data
@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Incremental parsing of ZNC's box-drawn tables
+
+ZNC renders the output of commands like `ListUsers`, `ListNetworks` and
+`ListClients` as::
+
+    +----------+----------+
+    | Username | Networks |
+    +==========+==========+
+    | foo      | 1        |
+    +----------+----------+
+"""
+
+import re
+
+BORDER_RE = re.compile(r"^\+(?:[-=]+\+)+$")
+ROW_RE = re.compile(r"^\|(.*)\|$")
+TABLE_LINE_RE = re.compile(r"^(?:\+(?:[-=]+\+)+|\|.*\|)$")
+
+TableRow = dict[str, str]
+
+
+class TableParser:
+    """
+    Parses one table a line at a time
+
+    The first row is taken as the column headers, and every row after the
+    header separator is returned by `feed` as it arrives. The table ends at
+    the next border.
+
+    >>> parser = TableParser()
+    >>> for line in ("+---+", "| A |", "+===+", "| 1 |"):
+    ...     parser.feed(line)
+    {'A': '1'}
+    >>> parser.headers, parser.done
+    (('A',), False)
+    >>> parser.feed("+---+")
+    >>> parser.done, parser.rows
+    (True, 1)
+    """
+
+    def __init__(self) -> None:
+        self.headers: tuple[str, ...] | None = None
+        self.rows = 0
+        self.done = False
+        self._in_body = False
+
+    def feed(self, line: str) -> TableRow | None:
+        """Parse a line, returning its row if it was a data row"""
+        if self.done:
+            msg = "Table already ended"
+            raise ValueError(msg)
+
+        if BORDER_RE.match(line):
+            if self._in_body:
+                self.done = True
+            elif self.headers is not None:
+                self._in_body = True
+
+            return None
+
+        match = ROW_RE.match(line)
+        if match is None:
+            msg = f"Not a table line: {line!r}"
+            raise ValueError(msg)
+
+        cells = tuple(cell.strip() for cell in match.group(1).split("|"))
+        if self.headers is None:
+            self.headers = cells
+            return None
+
+        self.rows += 1
+        return dict(zip(self.headers, cells, strict=False))
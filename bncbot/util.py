@@ -3,13 +3,20 @@
 #
 # SPDX-License-Identifier: MIT
 
+import fnmatch
 import hashlib
-import random
+import os
+import re
 import secrets
 import string
-from collections.abc import Iterable
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Collection, Iterable, Iterator
+from contextlib import contextmanager
+from functools import lru_cache
 from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
-from typing import TypeAlias
+from pathlib import Path
+from typing import Generic, TextIO, TypeAlias, TypeVar
 
 VALID_USER_CHARS = f"{string.ascii_letters + string.digits}-_"
 VALID_USER_START_CHARS = string.ascii_letters
@@ -17,6 +24,13 @@ VALID_USER_START_CHARS = string.ascii_letters
 IPNetwork: TypeAlias = IPv4Network | IPv6Network
 IPAddress: TypeAlias = IPv4Address | IPv6Address
 
+RFC1459_LOWER = str.maketrans(
+    string.ascii_uppercase + "[]\\~", string.ascii_lowercase + "{}|^"
+)
+
+_K = TypeVar("_K")
+_V = TypeVar("_V")
+
 
 def gen_pass(
     chars: str = (string.ascii_letters + string.digits), length: int = 16
@@ -29,6 +43,33 @@ def gen_pass(
     return "".join(secrets.choice(chars) for _ in range(length))
 
 
+@contextmanager
+def atomic_write(path: Path) -> Iterator[TextIO]:
+    """
+    Open `path` for writing so that readers only ever see the old or new file
+
+    The data is written to a temporary file next to `path`, flushed to disk
+    and then renamed over the original when the block exits normally.
+    """
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        with tmp_path.open("w", encoding="utf-8") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    tmp_path.replace(path)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Write `text` to `path` atomically, see `atomic_write`"""
+    with atomic_write(path) as f:
+        f.write(text)
+
+
 def chunk_str(text: str, length: int = 256) -> Iterable[str]:
     chunks = (text[i : i + length] for i in range(0, len(text), length))
     yield from chunks
@@ -79,5 +120,204 @@ def sanitize_username(user: str) -> str:
     return new_user
 
 
-def get_random_address(net: IPNetwork) -> IPAddress:
-    return net[random.randrange(net.num_addresses)]
+def select_names(
+    text: str, names: Collection[str]
+) -> tuple[list[str], list[str]]:
+    """Pick entries of `names` by exact name, glob pattern or `--all`
+
+    Returns:
+        The selected names and the arguments which matched nothing
+
+    >>> select_names("foo b* nobody", ["foo", "bar", "baz", "qux"])
+    (['foo', 'bar', 'baz'], ['nobody'])
+    >>> select_names("--all", ["foo", "bar"])
+    (['foo', 'bar'], [])
+    """
+    args = text.split()
+    if "--all" in args:
+        return list(names), []
+
+    selected: dict[str, None] = {}
+    missing: list[str] = []
+    for arg in args:
+        if any(c in arg for c in "*?["):
+            matcher = MaskMatcher([arg])
+            found = [name for name in names if matcher.matches(name)]
+        else:
+            found = [arg] if arg in names else []
+
+        if not found:
+            missing.append(arg)
+
+        selected.update(dict.fromkeys(found))
+
+    return list(selected), missing
+
+
+def irc_lower(text: str) -> str:
+    """
+    Fold `text` using the RFC1459 casemapping
+
+    >>> irc_lower("Nick[Away]")
+    'nick{away}'
+    """
+    return text.translate(RFC1459_LOWER)
+
+
+class IrcIdentity:
+    """
+    The bot's own names, kept alongside their RFC1459-folded forms
+
+    Comparisons take the exact-match path first, and only fold the other
+    string when it could still match, so most lines compare without
+    allocating.
+
+    >>> identity = IrcIdentity(nick="BNCBot", log_chan="#Logs", cmd_prefix=".")
+    >>> identity.is_self("bncbot"), identity.is_self("other!")
+    (True, False)
+    >>> identity.is_log_chan("#logs"), identity.is_command(".help")
+    (True, True)
+    """
+
+    __slots__ = (
+        "cmd_prefixes",
+        "folded_log_chan",
+        "folded_nick",
+        "log_chan",
+        "nick",
+    )
+
+    def __init__(
+        self,
+        *,
+        nick: str = "",
+        log_chan: str | None = None,
+        cmd_prefix: str = "",
+    ) -> None:
+        self.nick = ""
+        self.folded_nick = ""
+        self.log_chan: str | None = None
+        self.folded_log_chan = ""
+        self.cmd_prefixes: frozenset[str] = frozenset()
+        self.set_nick(nick)
+        self.update(log_chan=log_chan, cmd_prefix=cmd_prefix)
+
+    def set_nick(self, nick: str) -> None:
+        self.nick = nick
+        self.folded_nick = irc_lower(nick)
+
+    def update(self, *, log_chan: str | None, cmd_prefix: str) -> None:
+        """Apply the names which come from the bot's configuration"""
+        self.log_chan = log_chan
+        self.folded_log_chan = irc_lower(log_chan) if log_chan else ""
+        self.cmd_prefixes = frozenset(cmd_prefix)
+
+    @staticmethod
+    def _same(name: str, original: str, folded: str) -> bool:
+        if name == original:
+            return True
+
+        return len(name) == len(folded) and irc_lower(name) == folded
+
+    def is_self(self, nick: str) -> bool:
+        return bool(self.nick) and self._same(nick, self.nick, self.folded_nick)
+
+    def is_log_chan(self, chan: str) -> bool:
+        return self.log_chan is not None and self._same(
+            chan, self.log_chan, self.folded_log_chan
+        )
+
+    def is_command(self, message: str) -> bool:
+        return message[:1] in self.cmd_prefixes
+
+
+class MaskMatcher:
+    """
+    Matches hostmasks against a set of case-insensitive glob patterns
+
+    The patterns are compiled into a single regex up front and results are
+    cached per mask, so a new matcher should be created whenever the pattern
+    list changes.
+
+    >>> matcher = MaskMatcher(["*!*@snoonet/staff/*"])
+    >>> matcher.matches("Nick!user@Snoonet/Staff/nick")
+    True
+    >>> matcher.matches("nick!user@example.com")
+    False
+    """
+
+    def __init__(self, patterns: Iterable[str], cache_size: int = 1024) -> None:
+        self.patterns = tuple(patterns)
+        self._regex: re.Pattern[str] | None = None
+        if self.patterns:
+            self._regex = re.compile(
+                "|".join(
+                    f"(?:{fnmatch.translate(pat.lower())})"
+                    for pat in self.patterns
+                )
+            )
+
+        self.matches = lru_cache(maxsize=cache_size)(self._matches)
+
+    def _matches(self, mask: str) -> bool:
+        if self._regex is None:
+            return False
+
+        return self._regex.match(mask.lower()) is not None
+
+
+class TTLCache(Generic[_K, _V]):
+    """
+    A size-bounded mapping whose entries expire after a per-entry TTL
+
+    >>> cache = TTLCache[str, int](max_size=2)
+    >>> cache.set("a", 1, ttl=60)
+    >>> cache.get("a")
+    (True, 1)
+    >>> cache.get("b")
+    (False, None)
+    """
+
+    def __init__(
+        self, max_size: int = 4096, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.max_size = max_size
+        self.clock = clock
+        self._entries: OrderedDict[_K, tuple[float, _V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: _K) -> tuple[bool, _V | None]:
+        """Look up `key`, returning whether it was found and its value"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        expires, value = entry
+        if expires <= self.clock():
+            del self._entries[key]
+            return False, None
+
+        return True, value
+
+    def set(self, key: _K, value: _V, ttl: float) -> None:
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+
+        now = self.clock()
+        self._entries[key] = (now + ttl, value)
+        self._entries.move_to_end(key)
+        while self._entries:
+            oldest_expires, _ = next(iter(self._entries.values()))
+            if oldest_expires > now and len(self._entries) <= self.max_size:
+                break
+
+            self._entries.popitem(last=False)
+
+    def pop(self, key: _K) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Services account lookups via WHOIS
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+
+from bncbot.util import TTLCache
+
+
+class WhoisLookup:
+    """
+    Looks up the services account for a nick with WHOIS
+
+    Pending lookups are indexed by casefolded nick, so concurrent lookups
+    for the same nick share one WHOIS, and every lookup gives up `timeout`
+    seconds after the WHOIS is written. Answers are cached for `cache_ttl` seconds, or
+    `negative_ttl` seconds for nicks which aren't logged in.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        *,
+        timeout: float,
+        cache_ttl: float,
+        negative_ttl: float,
+        casefold: Callable[[str], str] = str.casefold,
+    ) -> None:
+        self.send = send
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self.casefold = casefold
+        self.pending: dict[str, asyncio.Future[str | None]] = {}
+        self.cache = TTLCache[str, str | None]()
+
+    async def get_account(self, nick: str) -> str | None:
+        """
+        Return the account `nick` is logged in to, or None
+
+        Raises:
+            TimeoutError: If the server didn't answer the WHOIS in time, or
+                the caller which sent it was cancelled
+        """
+        key = self.casefold(nick)
+        found, account = self.cache.get(key)
+        if found:
+            return account
+
+        fut = self.pending.get(key)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            self.pending[key] = fut
+            written = self.send(f"WHOIS {nick}")
+            try:
+                await written
+                account = await asyncio.wait_for(
+                    asyncio.shield(fut), self.timeout
+                )
+            finally:
+                # Other callers are waiting on this lookup even if it timed
+                # out or its owner was cancelled
+                if not fut.done():
+                    fut.set_exception(asyncio.TimeoutError())
+                    # Retrieved here, as there may be no other callers
+                    fut.exception()
+
+                if self.pending.get(key) is fut:
+                    del self.pending[key]
+
+            ttl = self.cache_ttl if account else self.negative_ttl
+            self.cache.set(key, account, ttl)
+            return account
+
+        return await asyncio.shield(fut)
+
+    def on_account(self, nick: str, account: str) -> None:
+        """Handle a WHOIS account reply (330)"""
+        fut = self.pending.get(self.casefold(nick))
+        if fut is not None and not fut.done():
+            fut.set_result(account)
+
+    def on_end(self, nick: str) -> None:
+        """Handle the end of a WHOIS reply (318)"""
+        fut = self.pending.get(self.casefold(nick))
+        if fut is not None and not fut.done():
+            fut.set_result(None)
@@ -0,0 +1,82 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import threading
+
+import pytest
+
+from bncbot.async_util import BlockingExecutor, Coalescer, call_func
+
+
+async def test_call_func_runs_sync_inline() -> None:
+    assert await call_func(threading.current_thread) is threading.main_thread()
+
+
+async def test_blocking_executor_bounds_pending() -> None:
+    executor = BlockingExecutor(1, 2, name="test-blocking")
+    release = threading.Event()
+
+    def _job() -> str:
+        release.wait(5)
+        return threading.current_thread().name
+
+    try:
+        tasks = [asyncio.create_task(executor.run(_job)) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        stats = executor.stats()
+        assert (stats.pending, stats.busy, stats.queued) == (2, 1, 1)
+        assert stats.full_waits == 2
+
+        release.set()
+        names = await asyncio.gather(*tasks)
+    finally:
+        executor.shutdown()
+
+    assert all(name.startswith("test-blocking") for name in names)
+    stats = executor.stats()
+    assert stats.completed == 4
+    assert stats.failed == 0
+    assert stats.peak_pending == 2
+    assert stats.pending == 0
+
+
+async def test_blocking_executor_counts_failures() -> None:
+    executor = BlockingExecutor(1, 1)
+
+    def _fail() -> None:
+        raise RuntimeError
+
+    try:
+        with pytest.raises(RuntimeError):
+            await executor.run(_fail)
+
+        assert await executor.run(len, "ab") == 2
+    finally:
+        executor.shutdown()
+
+    stats = executor.stats()
+    assert (stats.completed, stats.failed, stats.pending) == (1, 1, 0)
+
+
+async def test_coalescer_limits_call_rate() -> None:
+    calls: list[int] = []
+    coalescer = Coalescer(lambda: calls.append(1), 0.05)
+    coalescer.trigger()
+    assert len(calls) == 1
+
+    for _ in range(10):
+        coalescer.trigger()
+
+    assert len(calls) == 1
+    assert coalescer.pending
+    await asyncio.sleep(0.1)
+    assert len(calls) == 2
+    assert coalescer.coalesced == 9
+
+    coalescer.trigger()
+    coalescer.flush()
+    assert len(calls) == 3
+    assert not coalescer.pending
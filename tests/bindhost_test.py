@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import ipaddress
+
+import pytest
+
+from bncbot.bindhost import AddressRanges, BindHostPool
+
+
+def test_pick_until_exhausted() -> None:
+    pool = BindHostPool(ipaddress.ip_network("10.0.0.0/28"))
+    pool.claim("10.0.0.3")
+    picked = set()
+    while pool.free:
+        host = pool.pick()
+        assert host not in picked
+        picked.add(host)
+        pool.claim(host)
+
+    assert len(picked) == 15
+    assert "10.0.0.3" not in picked
+    with pytest.raises(ValueError, match="No free addresses"):
+        pool.pick()
+
+    pool.release("10.0.0.7")
+    assert pool.pick() == "10.0.0.7"
+
+
+def test_duplicate_claims() -> None:
+    pool = BindHostPool(ipaddress.ip_network("10.0.0.0/30"))
+    pool.claim("10.0.0.1")
+    pool.claim("10.0.0.1")
+    assert pool.used == 1
+
+    pool.release("10.0.0.1")
+    assert pool.is_claimed("10.0.0.1")
+
+    pool.release("10.0.0.1")
+    assert not pool.is_claimed("10.0.0.1")
+    assert pool.free == 4
+
+
+def test_foreign_hosts() -> None:
+    pool = BindHostPool(ipaddress.ip_network("10.0.0.0/30"))
+    pool.claim("192.168.0.1")
+    pool.claim("bnc.example.com")
+    assert pool.free == 4
+    assert pool.foreign == {"192.168.0.1": 1, "bnc.example.com": 1}
+
+    pool.release("192.168.0.1")
+    assert "192.168.0.1" not in pool.foreign
+
+
+def test_ipv6_network() -> None:
+    net = ipaddress.ip_network("2001:db8::/64")
+    pool = BindHostPool(net)
+    pool.claim("2001:db8::1")
+    host = pool.pick()
+    assert ipaddress.ip_address(host) in net
+    pool.claim(host)
+    assert pool.used == 2
+
+
+def test_multiple_networks_with_exclusions() -> None:
+    ranges = AddressRanges.parse(
+        ["10.0.0.0/30", "10.0.2.0/31", "10.0.0.2/31"],
+        exclude=["10.0.0.0", "10.0.2.0/31"],
+    )
+    assert ranges.size == 3
+    pool = BindHostPool(ranges)
+    picked = set()
+    while pool.free:
+        host = pool.pick()
+        picked.add(host)
+        pool.claim(host)
+
+    assert picked == {"10.0.0.1", "10.0.0.2", "10.0.0.3"}
+    pool.claim("10.0.2.1")
+    assert pool.foreign == {"10.0.2.1": 1}
+
+
+def test_address_ranges_reject_mixed_versions() -> None:
+    with pytest.raises(ValueError, match="mix"):
+        AddressRanges.parse(["10.0.0.0/24", "2001:db8::/64"])
+
+
+def test_occupancy_report() -> None:
+    now = [0.0]
+    pool = BindHostPool(
+        AddressRanges.parse(["10.0.0.0/30", "10.0.1.0/30"]),
+        clock=lambda: now[0],
+    )
+    pool.claim("10.0.0.1", "a")
+    pool.claim("10.0.0.1", "b")
+    pool.claim("10.0.1.2", "c")
+    pool.claim("192.168.0.1", "d")
+    for t in (0, 3600, 7200):
+        now[0] = t
+        pool.record_allocation()
+
+    now[0] = 10800
+    report = pool.report()
+    assert [(n.network, n.used, n.free) for n in report.networks] == [
+        ("10.0.0.0/30", 1, 3),
+        ("10.0.1.0/30", 1, 3),
+    ]
+    assert report.duplicates == {"10.0.0.1": ["a", "b"]}
+    assert report.out_of_range == {"192.168.0.1": 1}
+    assert report.allocation_rate == 2 / 7200
+    assert report.exhausted_in is not None
+    assert report.exhausted_in.total_seconds() == 6 * 3600
+    assert "Duplicates: 10.0.0.1 (a, b)" in report.lines()
+
+    pool.release("10.0.0.1", "a")
+    assert pool.duplicates() == {}
+    pool.release("10.0.0.1", "b")
+    assert pool.report().networks[0].used == 0
+
+
+def test_occupancy_report_without_allocations() -> None:
+    report = BindHostPool(ipaddress.ip_network("10.0.0.0/30")).report()
+    assert report.exhausted_in is None
+    assert (
+        "Exhaustion: unknown, too few allocations since the bot started"
+        in report.lines()
+    )
+
+
+def test_allocation_rate_spans_recorded_allocations() -> None:
+    now = [0.0]
+    pool = BindHostPool(
+        ipaddress.ip_network("10.0.0.0/30"), clock=lambda: now[0]
+    )
+    pool.record_allocation()
+    assert pool.allocation_rate() is None
+
+    now[0] = 100
+    pool.record_allocation()
+    now[0] = 100_000
+    # Two allocations a hundred seconds apart is one per hundred seconds,
+    # however long ago they were
+    assert pool.allocation_rate() == 1 / 100
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+from collections.abc import Callable
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from bncbot import bot
+
+
+def _no_params() -> None:
+    pass
+
+
+def _one_param(nick: str) -> None:
+    pass
+
+
+def _two_params(nick: str, chan: str) -> None:
+    pass
+
+
+@pytest.mark.parametrize(
+    ["func", "args"],
+    [(_no_params, ()), (_one_param, ("foo",)), (_two_params, ("foo", "#bar"))],
+)
+def test_hook_args(func: Callable[..., None], args: tuple[str, ...]) -> None:
+    hook = bot.Hook.from_func(func)
+    event = MagicMock(nick="foo", chan="#bar")
+    assert hook.get_args(event) == args
+
+
+def test_registered_commands_are_bound() -> None:
+    cmd = bot.HANDLERS["command"]["help"]
+    assert cmd.func is bot.cmd_help
+    assert cmd.hook.params == ("event", "text", "is_admin")
+
+
+def test_dispatch_table() -> None:
+    specific = bot.Hook.from_func(_one_param)
+    wildcard = bot.Hook.from_func(_no_params)
+    handlers = bot.Handlers(
+        {"command": {}, "raw": {"PRIVMSG": [specific], "": [wildcard]}}
+    )
+    table = bot.DispatchTable.build(handlers)
+    assert table.get("PRIVMSG") == (specific, wildcard)
+    assert table.get("PING") == (wildcard,)
+
+
+def test_dispatch_table_without_wildcards() -> None:
+    table = bot.DispatchTable.build(bot.HANDLERS)
+    assert table.get("PING") == ()
+    assert [hook.func for hook in table.get("NICK")] == [bot.on_nick]
+
+
+async def test_bulk_acceptbnc() -> None:
+    conn = MagicMock()
+    conn.add_user.side_effect = lambda name, *, save_config: name != "bad"
+    event = MagicMock()
+    queue = {"foo": "t", "foobar": "t", "bad": "t", "other": "t"}
+    await bot.cmd_acceptbnc("foo* bad nobody", conn, queue, event, "admin")
+
+    assert [call.args[0] for call in conn.rem_queue.call_args_list] == [
+        "foo",
+        "foobar",
+        "bad",
+    ]
+    conn.save_znc_config.assert_called_once_with()
+    conn.chan_log.assert_called_once_with(
+        "admin accepted 2 BNC requests, 1 failed: bad"
+    )
+    event.message.assert_called_once_with("nobody is not in the BNC queue.")
+
+
+async def test_bulk_delbnc_all() -> None:
+    conn = MagicMock(log_chan="#log")
+    users: dict[str, str | None] = {"a": None, "b": "127.0.0.1"}
+    event = MagicMock()
+    await bot.cmd_delbnc("--all", conn, users, "#log", event, "admin")
+
+    assert conn.rem_user.call_count == 2
+    conn.save_znc_config.assert_called_once_with()
+    conn.chan_log.assert_called_once_with("admin removed 2 BNCs")
+
+
+async def test_requestbnc_whois_timeout() -> None:
+    conn = MagicMock()
+    conn.whois.get_account = AsyncMock(side_effect=asyncio.TimeoutError)
+    event = MagicMock()
+    await bot.cmd_requestbnc("foo", conn, event, {}, {})
+
+    event.message.assert_called_once_with(
+        "Unable to verify your services account right now, please try again "
+        "later",
+        "foo",
+    )
+    conn.add_queue.assert_not_called()
+
+
+async def test_requestbnc_nickserv_timeout() -> None:
+    conn = MagicMock()
+    conn.whois.get_account = AsyncMock(return_value="FooAcct")
+    conn.nickserv.get_registered = AsyncMock(side_effect=asyncio.TimeoutError)
+    event = MagicMock()
+    await bot.cmd_requestbnc("foo", conn, event, {}, {})
+
+    event.message.assert_called_once_with(
+        "Unable to look up your services account right now, please try again "
+        "later",
+        "foo",
+    )
+    conn.add_queue.assert_not_called()
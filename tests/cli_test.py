@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import json
+import socket
+from pathlib import Path
+from unittest import mock
+
+from typer.testing import CliRunner
+
+from bncbot import cli
+
+
+def test_no_command_runs_bot(tmp_path: Path) -> None:
+    config = tmp_path / "config.json"
+    config.write_text("{}", encoding="utf-8")
+    with mock.patch.object(cli, "run") as run:
+        result = CliRunner().invoke(
+            cli.app, [f"--data-dir={tmp_path}", f"--config={config}"]
+        )
+
+    assert result.exit_code == 0, result.output
+    run.assert_called_once_with(tmp_path, config)
+
+
+def test_options_before_command_rejected(tmp_path: Path) -> None:
+    with mock.patch.object(cli, "async_main") as async_main:
+        result = CliRunner().invoke(cli.app, [f"--data-dir={tmp_path}", "run"])
+
+    assert result.exit_code == 2
+    assert "go after 'run'" in result.output
+    async_main.assert_not_called()
+
+
+def test_metrics_bot_unreachable(tmp_path: Path) -> None:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"metrics_port": port}), encoding="utf-8")
+    result = CliRunner().invoke(
+        cli.app, ["metrics", f"--data-dir={tmp_path}", f"--config={config}"]
+    )
+
+    assert result.exit_code == 1
+    assert result.output.startswith(
+        f"could not reach the bot at http://127.0.0.1:{port}/metrics: "
+    )
+    assert "Traceback" not in result.output
@@ -5,7 +5,9 @@
 
 from pathlib import Path
 
-from bncbot.config import BNCData
+import pytest
+
+from bncbot.config import BNCData, BotConfig
 
 
 def test_load_empty_data(tmp_path: Path) -> None:
@@ -42,3 +44,57 @@ def test_save_data(tmp_path: Path) -> None:
 
     data1 = BNCData.load_config(data_file)
     assert data == data1
+
+
+def test_load_matches_pydantic(tmp_path: Path) -> None:
+    data_file = tmp_path / "data.json"
+    text = (
+        '{"queue": {"acct": "Jan 01 2020"}, "users": {"foo": "127.0.0.1", '
+        '"b\\u00e4r": null, "foo": "::1"}, "other": {}}'
+    )
+    data_file.write_text(text, encoding="utf-8")
+    data = BNCData.load_config(data_file)
+    assert data == BNCData.model_validate_json(text)
+    assert data.users == {"foo": "::1", "bär": None}
+    assert data.dump_config() == BNCData.model_validate_json(text).dump_config()
+
+
+def test_load_ignores_other_keys(tmp_path: Path) -> None:
+    data_file = tmp_path / "data.json"
+    text = (
+        '{"version": 1, "users": {"foo": "127.0.0.1"}, "meta": {"tags": [1]}, '
+        '"queue": {}, "enabled": true}'
+    )
+    data_file.write_text(text, encoding="utf-8")
+    data = BNCData.load_config(data_file)
+    assert data == BNCData.model_validate_json(text)
+    assert data.users == {"foo": "127.0.0.1"}
+
+
+@pytest.mark.parametrize(
+    "text",
+    ['{"queue": {"acct": null}}', '{"users": {"foo": 1}}', '{"users": []}'],
+)
+def test_load_invalid_data(tmp_path: Path, text: str) -> None:
+    data_file = tmp_path / "data.json"
+    data_file.write_text(text, encoding="utf-8")
+    with pytest.raises(ValueError, match=str(data_file)):
+        BNCData.load_config(data_file)
+
+
+def test_bind_networks_parsed_once() -> None:
+    config = BotConfig(
+        bind_host_net=["10.0.0.0/24", "10.0.1.0/24"],
+        bind_host_exclude=["10.0.0.1"],
+    )
+    assert config.bind_networks is config.bind_networks
+    assert config.bind_networks.size == 511
+    assert "bind_networks" not in config.dump_config()
+
+
+@pytest.mark.parametrize(
+    ("net", "exclude"), [("bogus", []), ("10.0.0.0/31", ["10.0.0.0/31"])]
+)
+def test_bind_networks_invalid(net: str, exclude: list[str]) -> None:
+    with pytest.raises(ValueError, match="bind_host"):
+        BotConfig(bind_host_net=net, bind_host_exclude=exclude)
@@ -3,21 +3,63 @@
 #
 # SPDX-License-Identifier: MIT
 
+import asyncio
+import json
+import logging
+from collections.abc import Callable
 from pathlib import Path
 from unittest import mock
 
-from bncbot.config import BNCData, BotConfig
-from bncbot.conn import Conn
+import pytest
+from irclib.parser import Message
+
+from bncbot.async_util import Coalescer
+from bncbot.bot import HANDLERS, DispatchTable
+from bncbot.config import BotConfig
+from bncbot.conn import ZNC_ROUTES, Conn
+from bncbot.correlate import Correlator
+from bncbot.metrics import BotMetrics
+from bncbot.storage import JsonStorage
+from bncbot.util import IrcIdentity
 
 
 def _make_conn(config: BotConfig, run_dir: Path = Path()) -> Conn:
     conn = Conn.__new__(Conn)
+    conn.identity = IrcIdentity()
+    conn.logger = logging.getLogger("bncbot")
     conn.config = config
     conn.run_dir = run_dir
-    conn.bnc_data = BNCData()
+    conn.storage = JsonStorage(run_dir, delay=config.save_delay)
+    conn.queries = Correlator(ZNC_ROUTES)
+    conn._controlpanel_gets = {}
+    conn._user_list = None
+    conn._sync_removals = []
+    conn.metrics = BotMetrics()
+    conn.znc_saveconfig = Coalescer(
+        conn._send_saveconfig, config.saveconfig_interval
+    )
+    conn.index_bind_hosts()
     return conn
 
 
+def _record(sent: list[str]) -> Callable[..., None]:
+    """Stand in for `Conn._queue_line`, writing each line to `sent`"""
+
+    def _queue_line(
+        line: str, written: "asyncio.Future[None] | None" = None
+    ) -> None:
+        sent.append(line)
+        if written is not None:
+            written.set_result(None)
+
+    return _queue_line
+
+
+async def _settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
 def test_client_connect_info_defaults() -> None:
     conn = _make_conn(BotConfig())
     assert conn.client_connect_info() == (
@@ -40,10 +82,12 @@ def test_client_connect_info_custom_config() -> None:
     )
 
 
-def test_add_user_reconnects_to_configured_network(tmp_path: Path) -> None:
+async def test_add_user_reconnects_to_configured_network(
+    tmp_path: Path,
+) -> None:
     conn = _make_conn(BotConfig(bnc_network="MyNetwork"), run_dir=tmp_path)
 
-    with mock.patch.object(conn, "send") as mock_send:
+    with mock.patch.object(conn, "_queue_line") as mock_send:
         assert conn.add_user("somenick") is True
 
     reconnect_cmds = [
@@ -55,3 +99,361 @@ def test_add_user_reconnects_to_configured_network(tmp_path: Path) -> None:
         "PRIVMSG *controlpanel :reconnect somenick MyNetwork"
     ]
     assert conn.bnc_users["somenick"] is not None
+
+
+async def test_fetch_bind_hosts_pipelined() -> None:
+    conn = _make_conn(BotConfig(bindhost_fetch_window=2))
+    sent: list[str] = []
+    with mock.patch.object(conn, "_queue_line", _record(sent)):
+        task = asyncio.create_task(conn.fetch_bind_hosts(["a", "b", "c"]))
+        await _settle()
+        assert sent == [
+            "PRIVMSG *controlpanel :Get BindHost a",
+            "PRIVMSG *controlpanel :Get BindHost b",
+        ]
+
+        assert conn.queries.feed("controlpanel", "BindHost = 127.0.0.1")
+        await _settle()
+        assert sent[-1] == "PRIVMSG *controlpanel :Get BindHost c"
+
+        # Replies naming their user can arrive out of order
+        assert conn.queries.feed(
+            "controlpanel", "Error: User [c] does not exist!"
+        )
+        assert conn.queries.feed("controlpanel", "BindHost = 127.0.0.2")
+        assert await task == {"a": "127.0.0.1", "b": "127.0.0.2", "c": None}
+
+    assert not conn.queries.pending
+    assert not conn._controlpanel_gets
+
+
+async def _wait_for_sync(sent: list[str]) -> str:
+    """Wait for a *controlpanel sync to be sent, returning its user"""
+    prefix = "PRIVMSG *controlpanel :Get BindHost -sync"
+    while not sent or not sent[-1].startswith(prefix):
+        await asyncio.sleep(0.001)
+
+    return sent[-1].removeprefix("PRIVMSG *controlpanel :Get BindHost ")
+
+
+async def test_fetch_bind_hosts_drops_late_replies() -> None:
+    conn = _make_conn(
+        BotConfig(bindhost_fetch_window=2, znc_query_timeout=0.05)
+    )
+    sent: list[str] = []
+    with mock.patch.object(conn, "_queue_line", _record(sent)):
+        task = asyncio.create_task(conn.fetch_bind_hosts(["a", "b", "c"]))
+        sync_user = await _wait_for_sync(sent)
+        assert sent[:2] == [
+            "PRIVMSG *controlpanel :Get BindHost a",
+            "PRIVMSG *controlpanel :Get BindHost b",
+        ]
+
+        # The answers to the abandoned Gets turn up after all
+        assert not conn.queries.feed("controlpanel", "BindHost = 127.0.0.1")
+        assert not conn.queries.feed("controlpanel", "BindHost = 127.0.0.2")
+        assert conn.queries.feed(
+            "controlpanel", f"Error: User [{sync_user}] does not exist!"
+        )
+        await _settle()
+        assert sent[-2:] == [
+            "PRIVMSG *controlpanel :Get BindHost a",
+            "PRIVMSG *controlpanel :Get BindHost b",
+        ]
+        for host in ("127.0.0.1", "127.0.0.2"):
+            assert conn.queries.feed("controlpanel", f"BindHost = {host}")
+            await _settle()
+
+        assert conn.queries.feed("controlpanel", "BindHost = 127.0.0.3")
+        assert await task == {
+            "a": "127.0.0.1",
+            "b": "127.0.0.2",
+            "c": "127.0.0.3",
+        }
+
+
+async def test_fetch_bind_hosts_timeout_mid_window() -> None:
+    conn = _make_conn(
+        BotConfig(bindhost_fetch_window=2, znc_query_timeout=0.05)
+    )
+    sent: list[str] = []
+    with mock.patch.object(conn, "_queue_line", _record(sent)):
+        task = asyncio.create_task(conn.fetch_bind_hosts(["a", "b", "c"]))
+        await _settle()
+        assert conn.queries.feed("controlpanel", "BindHost = 127.0.0.1")
+        await _settle()
+        assert sent[-1] == "PRIVMSG *controlpanel :Get BindHost c"
+
+        # b never answers; c's answer must not be taken as b's
+        sync_user = await _wait_for_sync(sent)
+        assert not conn.queries.feed("controlpanel", "BindHost = 127.0.0.3")
+        assert conn.queries.feed(
+            "controlpanel", f"Error: User [{sync_user}] does not exist!"
+        )
+        await _settle()
+        assert sent[-2:] == [
+            "PRIVMSG *controlpanel :Get BindHost b",
+            "PRIVMSG *controlpanel :Get BindHost c",
+        ]
+        assert conn.queries.feed("controlpanel", "BindHost = 127.0.0.2")
+        assert conn.queries.feed("controlpanel", "BindHost = 127.0.0.3")
+        assert await task == {
+            "a": "127.0.0.1",
+            "b": "127.0.0.2",
+            "c": "127.0.0.3",
+        }
+
+    assert not conn.queries.pending
+    assert not conn._controlpanel_gets
+
+
+async def test_fetch_bind_hosts_gives_up() -> None:
+    conn = _make_conn(
+        BotConfig(bindhost_fetch_window=2, znc_query_timeout=0.01)
+    )
+    with mock.patch.object(conn, "_queue_line", _record([])):
+        assert await conn.fetch_bind_hosts(["a", "b"]) == {"a": None, "b": None}
+
+
+async def test_set_reply_not_taken_by_pending_get(tmp_path: Path) -> None:
+    conn = _make_conn(BotConfig(bindhost_fetch_window=1), run_dir=tmp_path)
+    sent: list[str] = []
+    with mock.patch.object(conn, "_queue_line", _record(sent)):
+        task = asyncio.create_task(conn.fetch_bind_hosts(["a", "b"]))
+        await _settle()
+        assert conn.add_user("newuser")
+        host = conn.bnc_users["newuser"]
+        assert f"PRIVMSG *controlpanel :Set BindHost newuser {host}" in sent
+
+        # ZNC answers in the order the lines were sent
+        assert conn.queries.feed("controlpanel", "BindHost = 127.0.0.1")
+        await _settle()
+        assert conn.queries.feed("controlpanel", f"BindHost = {host}")
+        assert conn.queries.feed("controlpanel", "BindHost = 127.0.0.2")
+        assert await task == {"a": "127.0.0.1", "b": "127.0.0.2"}
+
+
+async def test_list_users_and_admin_run_concurrently() -> None:
+    conn = _make_conn(BotConfig())
+    with mock.patch.object(conn, "_queue_line", _record([])):
+        users = asyncio.create_task(conn.list_users())
+        admin = asyncio.create_task(conn.is_bnc_admin("a"))
+        await _settle()
+
+        lines = [
+            "+------+----------+---------+",
+            "| Username | Networks | Clients |",
+            "+======+==========+=========+",
+            "| a    | 1        | 0       |",
+        ]
+        for line in lines:
+            assert conn.queries.feed("status", line)
+
+        assert conn.queries.feed("controlpanel", "Admin = true")
+        assert await admin is True
+        assert not users.done()
+
+        assert conn.queries.feed("status", "+------+----------+---------+")
+        assert await users == ["a"]
+
+
+async def test_get_user_hosts_applies_diff(tmp_path: Path) -> None:
+    conn = _make_conn(BotConfig(), run_dir=tmp_path)
+    conn.bnc_users.update({"a": "127.0.0.1", "b": None, "c": "127.0.0.3"})
+    conn.index_bind_hosts()
+    fetch = mock.AsyncMock(return_value={"d": "127.0.0.4", "b": "127.0.0.2"})
+    with (
+        mock.patch.object(conn, "_queue_line", _record([])),
+        mock.patch.object(conn, "list_users", return_value=["a", "b", "d"]),
+        mock.patch.object(conn, "fetch_bind_hosts", fetch),
+    ):
+        stats = await conn.get_user_hosts()
+
+    fetch.assert_awaited_once_with(["d", "b"])
+    assert stats == (1, 1, 2)
+    assert "bncbot_user_refresh_duration_seconds_count 1" in (
+        conn.metrics.render()
+    )
+    assert conn.bnc_users == {
+        "a": "127.0.0.1",
+        "b": "127.0.0.2",
+        "d": "127.0.0.4",
+    }
+    assert not conn.bind_hosts.is_claimed("127.0.0.3")
+    assert conn.bind_hosts.is_claimed("127.0.0.4")
+
+
+async def test_get_user_hosts_skips_deleted_users(tmp_path: Path) -> None:
+    conn = _make_conn(BotConfig(), run_dir=tmp_path)
+    conn.bnc_users.update({"a": None, "b": None})
+    conn.index_bind_hosts()
+    fetched = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def _fetch(users: list[str]) -> dict[str, str | None]:
+        fetched.set()
+        await finish.wait()
+        return {user: f"127.0.0.{i}" for i, user in enumerate(users, 1)}
+
+    with (
+        mock.patch.object(conn, "_queue_line", _record([])),
+        mock.patch.object(conn, "list_users", return_value=["a", "b", "c"]),
+        mock.patch.object(conn, "fetch_bind_hosts", _fetch),
+    ):
+        sync = asyncio.ensure_future(conn.get_user_hosts())
+        await fetched.wait()
+        conn.rem_user("a")
+        conn.rem_user("c")
+        finish.set()
+        await sync
+
+    assert conn.bnc_users == {"b": "127.0.0.3"}
+    assert not conn.bind_hosts.is_claimed("127.0.0.1")
+    assert not conn._sync_removals
+
+
+async def test_znc_table_streams_rows() -> None:
+    conn = _make_conn(BotConfig())
+    sent: list[str] = []
+    with mock.patch.object(conn, "_queue_line", _record(sent)):
+        rows = conn.znc_table("ListClients foo")
+        first = asyncio.ensure_future(anext(rows))
+        await _settle()
+        assert sent == ["znc ListClients foo"]
+
+        for line in ("+----+", "| Host |", "+====+", "| 1.2.3.4 |"):
+            conn.queries.feed("status", line)
+
+        assert await first == {"Host": "1.2.3.4"}
+        rest = asyncio.ensure_future(anext(rows, None))
+        await _settle()
+        assert not rest.done()
+
+        conn.queries.feed("status", "+----+")
+        assert await rest is None
+
+
+def test_is_admin_follows_config() -> None:
+    conn = _make_conn(BotConfig(admins=["*!*@staff/*"]))
+    assert conn.is_admin("nick!user@Staff/nick")
+    assert not conn.is_admin("nick!user@example.com")
+
+    conn.config = BotConfig(admins=["*!*@example.com"])
+    assert not conn.is_admin("nick!user@Staff/nick")
+    assert conn.is_admin("nick!user@example.com")
+
+
+def test_send_priority() -> None:
+    conn = _make_conn(BotConfig())
+    assert conn.send_priority("znc saveconfig") == "control"
+    assert (
+        conn.send_priority("PRIVMSG *controlpanel :Get Nick foo") == "control"
+    )
+    assert conn.send_priority("PRIVMSG MemoServ :SEND foo bar") == "user"
+    assert conn.send_priority("WHOIS foo") == "query"
+    assert conn.send_priority("PRIVMSG NickServ :INFO foo") == "query"
+    assert conn.send_priority("PRIVMSG #chan :nickserv is down") == "user"
+
+
+async def test_handle_line_skips_unhandled_lines() -> None:
+    conn = _make_conn(BotConfig())
+    conn.logger = mock.MagicMock()
+    conn.dispatch = DispatchTable({}, ())
+    with mock.patch("bncbot.irc.make_event") as make_event:
+        await conn.handle_line(mock.MagicMock(), Message.parse("PING :foo"))
+
+    make_event.assert_not_called()
+    assert conn.metrics.lines_received.values == {"PING": 1}
+
+
+def test_config_updates_identity() -> None:
+    conn = _make_conn(BotConfig(log_channel="#Logs", command_prefix="."))
+    assert conn.identity.is_log_chan("#logs")
+
+    conn.config = BotConfig(log_channel="#Other", command_prefix="!")
+    assert conn.identity.is_log_chan("#other")
+    assert not conn.identity.is_log_chan("#logs")
+    assert conn.identity.is_command("!help")
+
+
+async def test_blocking_executor_metrics(tmp_path: Path) -> None:
+    conn = Conn(HANDLERS, data_path=tmp_path, config=tmp_path / "config.json")
+    try:
+        await conn.blocking_executor.run(int)
+        with pytest.raises(ValueError, match="invalid literal"):
+            await conn.blocking_executor.run(int, "x")
+    finally:
+        conn.blocking_executor.shutdown()
+
+    text = conn.metrics.render()
+    assert 'bncbot_blocking_jobs{state="running"} 0' in text
+    assert 'bncbot_blocking_jobs{state="queued"} 0' in text
+    assert "bncbot_blocking_jobs_peak 1" in text
+    assert "bncbot_blocking_jobs_completed_total 1" in text
+    assert "bncbot_blocking_jobs_failed_total 1" in text
+    assert "bncbot_blocking_full_waits_total 0" in text
+
+
+def _write_config(path: Path, **values: object) -> None:
+    path.write_text(json.dumps(values), encoding="utf-8")
+
+
+async def test_reload_config_applies_without_reconnecting(
+    tmp_path: Path,
+) -> None:
+    config_file = tmp_path / "config.json"
+    _write_config(config_file, admins=["*!*@old.example"])
+    conn = Conn(HANDLERS, data_path=tmp_path, config=config_file)
+    _write_config(
+        config_file,
+        admins=["*!*@new.example"],
+        bind_host_net="10.1.0.0/24",
+        nickserv_timeout=5,
+        log_channel="#NewLog",
+    )
+    with mock.patch.object(conn, "reconnect") as reconnect:
+        result = await conn.reload_config()
+
+    reconnect.assert_not_called()
+    assert result.changed == {
+        "admins",
+        "bind_host_net",
+        "nickserv_timeout",
+        "log_channel",
+    }
+    assert not result.reconnect
+    assert conn.is_admin("nick!user@new.example")
+    assert not conn.is_admin("nick!user@old.example")
+    assert str(conn.bind_hosts.net) == "10.1.0.0/24"
+    assert conn.nickserv.timeout == 5
+    assert conn.identity.is_log_chan("#newlog")
+
+
+async def test_reload_config_reconnects_on_server_change(
+    tmp_path: Path,
+) -> None:
+    config_file = tmp_path / "config.json"
+    conn = Conn(HANDLERS, data_path=tmp_path, config=config_file)
+    _write_config(config_file, server="irc.example.org", storage="journal")
+    with mock.patch.object(conn, "reconnect") as reconnect:
+        result = await conn.reload_config()
+
+    reconnect.assert_awaited_once()
+    assert result.reconnect
+    assert result.needs_restart == {"storage"}
+    assert conn.config.server == "irc.example.org"
+
+
+async def test_reload_config_keeps_config_when_invalid(tmp_path: Path) -> None:
+    config_file = tmp_path / "config.json"
+    _write_config(config_file, log_channel="#old")
+    conn = Conn(HANDLERS, data_path=tmp_path, config=config_file)
+    _write_config(config_file, log_channel="#new", bind_host_net="bogus")
+    with mock.patch.object(conn, "chan_log") as chan_log:
+        assert await conn.reload_and_report("test") is None
+        # Unchanged since the failed attempt, so the watcher leaves it alone
+        await conn.check_config_file()
+
+    chan_log.assert_called_once()
+    assert "Config reload (test) failed" in chan_log.call_args.args[0]
+    assert conn.config.log_channel == "#old"
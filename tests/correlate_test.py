@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import re
+from functools import partial
+
+import pytest
+
+from bncbot.correlate import MORE, Correlator, More, Reply, Route
+
+ROUTES = {
+    "svc": (
+        Route(
+            "error",
+            "get",
+            re.compile(r"^No such item (?P<item>\S+)$"),
+            key_group="item",
+        ),
+        Route("value", "get", re.compile(r"^(?P<value>\d+)$")),
+    )
+}
+
+
+def _parse(reply: Reply) -> str | None:
+    return reply.group("value") if reply.route == "value" else None
+
+
+async def test_fifo_and_keyed_replies() -> None:
+    queries = Correlator(ROUTES)
+    sent: list[str] = []
+    tasks = [
+        asyncio.create_task(
+            queries.request(
+                "svc", "get", partial(sent.append, item), _parse, key=item
+            )
+        )
+        for item in ("a", "B", "c")
+    ]
+    await asyncio.sleep(0)
+    assert sent == ["a", "B", "c"]
+    assert queries.pending == 3
+
+    assert queries.feed("svc", "No such item b")
+    assert queries.feed("svc", "1")
+    assert queries.feed("svc", "3")
+    assert not queries.feed("svc", "4")
+    assert not queries.feed("svc", "unrelated")
+    assert await asyncio.gather(*tasks) == ["1", None, "3"]
+    assert queries.pending == 0
+
+
+async def test_multi_line_reply() -> None:
+    queries = Correlator(ROUTES)
+    values: list[str] = []
+
+    def _collect(reply: Reply) -> list[str] | More:
+        values.append(reply.group("value"))
+        return values if len(values) == 2 else MORE
+
+    task = asyncio.create_task(
+        queries.request("svc", "get", lambda: None, _collect)
+    )
+    await asyncio.sleep(0)
+    queries.feed("svc", "1")
+    assert not task.done()
+    queries.feed("svc", "2")
+    assert await task == ["1", "2"]
+
+
+async def test_timeout() -> None:
+    queries = Correlator(ROUTES)
+    with pytest.raises(asyncio.TimeoutError):
+        await queries.request("svc", "get", lambda: None, _parse, timeout=0.01)
+
+    assert queries.pending == 0
+    assert not queries.feed("svc", "1")
+
+
+async def test_expect_keeps_send_order() -> None:
+    queries = Correlator(ROUTES)
+    first = queries.expect("svc", "get", _parse)
+    second = asyncio.create_task(
+        queries.request("svc", "get", lambda: None, _parse)
+    )
+    await asyncio.sleep(0)
+    assert queries.feed("svc", "1")
+    assert queries.feed("svc", "2")
+    assert await first == "1"
+    assert await second == "2"
+
+    late = queries.expect("svc", "get", _parse, timeout=0.01)
+    with pytest.raises(asyncio.TimeoutError):
+        await late
+
+    await asyncio.sleep(0)
+    assert queries.pending == 0
+    assert not queries.feed("svc", "3")
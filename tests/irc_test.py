@@ -9,12 +9,15 @@ from irclib.parser import Message
 
 from bncbot import irc
 from bncbot.conn import Conn
+from bncbot.event import CommandEvent
+from bncbot.util import IrcIdentity
 
 
 def make_mock_conn() -> Conn:
     mock = MagicMock()
     mock.configure_mock(nick="mybot")
-    mock.mock_add_spec(spec=Conn, spec_set=True)
+    mock.mock_add_spec(spec=[*dir(Conn), "identity"], spec_set=True)
+    mock.identity = IrcIdentity(nick="mybot")
     return mock
 
 
@@ -40,3 +43,32 @@ async def test_make_event() -> None:
         conn, Message.parse(":server.tld PRIVMSG #foo :this is a test")
     )
     assert event.chan == "#foo"
+
+
+async def test_make_event_fields_come_from_prefix() -> None:
+    conn = make_mock_conn()
+    event = irc.make_event(
+        conn, Message.parse(":nick!user@host.tld JOIN #chan")
+    )
+    assert not hasattr(event, "__dict__")
+    assert (event.nick, event.user, event.host) == ("nick", "user", "host.tld")
+    assert event.mask == "nick!user@host.tld"
+    assert event.chan == "#chan"
+
+
+async def test_derived_event_reads_base_event() -> None:
+    conn = make_mock_conn()
+    base = irc.make_event(
+        conn, Message.parse(":nick!user@host.tld PRIVMSG #chan :.help")
+    )
+    event = CommandEvent(
+        base_event=base, command="help", cmd_handler=MagicMock()
+    )
+    assert not hasattr(event, "__dict__")
+    assert event.base_event is base
+    assert event.conn is conn
+    assert (event.nick, event.mask, event.chan) == (
+        "nick",
+        "nick!user@host.tld",
+        "#chan",
+    )
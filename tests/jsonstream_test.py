@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+from bncbot.config import BNCData
+from bncbot.jsonstream import (
+    iter_document,
+    read_header,
+    read_tables,
+    write_document,
+)
+
+
+def _data() -> BNCData:
+    return BNCData(
+        queue={"acct": "Jan 01 2020", "été": 'quo"te'},
+        users={"foo": "127.0.0.1", "bar": None, "b\\az": "::1"},
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 16])
+def test_iter_document(tmp_path: Path, chunk_size: int) -> None:
+    path = tmp_path / "bnc.json"
+    data = _data()
+    data.save_config(path)
+    assert list(iter_document(path, chunk_size=chunk_size)) == [
+        ("queue", "acct", "Jan 01 2020"),
+        ("queue", "été", 'quo"te'),
+        ("users", "foo", "127.0.0.1"),
+        ("users", "bar", None),
+        ("users", "b\\az", "::1"),
+    ]
+
+
+def test_write_document_matches_dump(tmp_path: Path) -> None:
+    path = tmp_path / "bnc.json"
+    data = _data()
+    write_document(
+        path, [("queue", data.queue.items()), ("users", data.users.items())]
+    )
+    assert path.read_text(encoding="utf-8") == data.dump_config()
+
+    write_document(path, [("queue", []), ("users", [])])
+    assert path.read_text(encoding="utf-8") == BNCData().dump_config()
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("", "'{' at offset 0"),
+        ('{"users": {"foo": 1}}', "a string or null at offset 18"),
+        ('{"users": {1: null}}', "a string at offset 11"),
+        ('{"users": {"foo": nul}}', "a string or null at offset 18"),
+        ('{"users": {"foo": "bar}}', "a complete string at offset 18"),
+        ('{"users": {"foo": null "bar": null}}', "',' or '}' at offset 23"),
+        ('{"users": {}} {}', "the end of the file at offset 14"),
+    ],
+)
+def test_iter_document_errors(tmp_path: Path, text: str, expected: str) -> None:
+    path = tmp_path / "bnc.json"
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(
+        ValueError, match=re.escape(f"expected {expected}") + "$"
+    ):
+        list(iter_document(path, chunk_size=4))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 16, 1 << 16])
+def test_read_tables_tricky_strings(tmp_path: Path, chunk_size: int) -> None:
+    path = tmp_path / "bnc.json"
+    users: dict[str, str | None] = {
+        "a": "x,y",
+        "b}": '"}',
+        "c": None,
+        'q"uote': "\\",
+        "d": "{,}",
+        "e": "",
+        "é": "☃",
+    }
+    users.update((f"user{i}", f"10.0.0.{i}") for i in range(50))
+    queue = {"acct": "Jan 01 2020"}
+    for separators in ((", ", ": "), (",", ":")):
+        text = json.dumps(
+            {"queue": queue, "users": users}, separators=separators
+        )
+        path.write_text(text, encoding="utf-8")
+        assert read_tables(path, chunk_size=chunk_size) == {
+            "queue": queue,
+            "users": users,
+        }
+        assert [
+            (name, value)
+            for _, name, value in iter_document(path, chunk_size=chunk_size)
+        ] == [*queue.items(), *users.items()]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"users": {"a": "b", "c": 1, "d": "e"}}',
+        '{"users": {"a": "b", "c": {"x": "y"}, "d": "e"}}',
+        '{"users": {"a": "b", "c": ["y"], "d": "e"}}',
+        '{"users": {"a": "b", "c": "\x01", "d": "e"}}',
+    ],
+)
+def test_read_tables_rejects_other_values(tmp_path: Path, text: str) -> None:
+    path = tmp_path / "bnc.json"
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(ValueError, match="offset 26$"):
+        read_tables(path)
+
+
+def test_iter_document_keeps_repeated_names(tmp_path: Path) -> None:
+    path = tmp_path / "bnc.json"
+    path.write_text(
+        '{"users": {"a": "1", "b": "2", "a": "3", "c": null}}', encoding="utf-8"
+    )
+    assert [entry[1:] for entry in iter_document(path)] == [
+        ("a", "1"),
+        ("b", "2"),
+        ("a", "3"),
+        ("c", None),
+    ]
+    assert read_tables(path) == {"users": {"a": "3", "b": "2", "c": None}}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 16])
+def test_skips_other_tables(tmp_path: Path, chunk_size: int) -> None:
+    path = tmp_path / "bnc.json"
+    path.write_text(
+        '{"version": 12345, "users": {"a": "1"}, "meta": {"n": [1, {"x": '
+        '"}"}]}, "flag": true, "queue": {"b": "2"}, "note": "a\\"b"}',
+        encoding="utf-8",
+    )
+    tables = ("queue", "users")
+    assert read_tables(path, tables=tables, chunk_size=chunk_size) == {
+        "users": {"a": "1"},
+        "queue": {"b": "2"},
+    }
+    assert list(iter_document(path, tables=tables, chunk_size=chunk_size)) == [
+        ("users", "a", "1"),
+        ("queue", "b", "2"),
+    ]
+    with pytest.raises(ValueError, match="offset 12$"):
+        read_tables(path, chunk_size=chunk_size)
+
+
+@pytest.mark.parametrize(
+    "text", ['{"meta": [1, 2}', '{"meta": tru}', '{"meta": "x}']
+)
+def test_skip_rejects_invalid_values(tmp_path: Path, text: str) -> None:
+    path = tmp_path / "bnc.json"
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(ValueError, match="expected a JSON value at offset 9$"):
+        read_tables(path, tables=("users",), chunk_size=4)
+
+
+def test_header_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "bnc.json"
+    write_document(
+        path, [("users", [("a", "1")])], header={"generation": 3, "v": "x"}
+    )
+    assert read_header(path, chunk_size=2) == {"generation": 3, "v": "x"}
+    assert read_tables(path, tables=("users",)) == {"users": {"a": "1"}}
+    assert BNCData.load_config(path) == BNCData(users={"a": "1"})
+
+    write_document(path, [("users", [])])
+    assert read_header(path) == {}
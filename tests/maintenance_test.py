@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import io
+from pathlib import Path
+
+import pytest
+
+from bncbot import maintenance
+from bncbot.config import BNCData, BotConfig
+from bncbot.storage import JournalStorage, JsonStorage, Mutation, Storage
+
+CONFIG = BotConfig(bind_host_net="10.0.0.0/24")
+
+
+@pytest.fixture(params=["json", "journal"])
+def storage(request: pytest.FixtureRequest, tmp_path: Path) -> Storage:
+    store: Storage
+    if request.param == "journal":
+        store = JournalStorage(tmp_path, delay=60)
+    else:
+        store = JsonStorage(tmp_path, delay=60)
+
+    store.rewrite(
+        [("acct", "Jan 01 2020")],
+        [("foo", "10.0.0.1"), ("bar", "10.0.0.1"), ("baz", None)],
+    )
+    return store
+
+
+def test_journal_entries_override_snapshot(tmp_path: Path) -> None:
+    store = JournalStorage(tmp_path, delay=60)
+    store.rewrite([("acct", "Jan 01 2020")], [("foo", "10.0.0.1")])
+    store.journal_path.write_text(
+        store.journal_path.read_text(encoding="utf-8")
+        + Mutation("users", "foo", "10.0.0.2").to_json()
+        + "\n"
+        + Mutation("queue", "acct", delete=True).to_json()
+        + "\n",
+        encoding="utf-8",
+    )
+    assert list(store.iter_entries()) == [Mutation("users", "foo", "10.0.0.2")]
+    assert store.load() == BNCData(users={"foo": "10.0.0.2"})
+
+
+def test_export_import_roundtrip(storage: Storage, tmp_path: Path) -> None:
+    out = io.StringIO()
+    assert maintenance.export_state(storage, out) == 4
+    expected = storage.load()
+
+    dest = JsonStorage(tmp_path / "dest")
+    dest.data_dir.mkdir()
+    lines = out.getvalue().splitlines()
+    assert maintenance.import_state(dest, lines) == 4
+    assert dest.load() == expected
+
+    extra = [Mutation("users", "foo", delete=True).to_json(), ""]
+    assert maintenance.import_state(dest, extra) == 1
+    assert set(dest.load().users) == {"bar", "baz"}
+
+    assert maintenance.import_state(dest, lines[:1], replace=True) == 1
+    assert dest.load() == BNCData(queue={"acct": "Jan 01 2020"})
+
+    with pytest.raises(ValueError, match="line 2"):
+        maintenance.import_state(dest, [lines[0], "{}"])
+
+
+def test_validate(storage: Storage) -> None:
+    report = maintenance.validate_state(storage, CONFIG)
+    assert report == (3, 1, [])
+
+    storage.rewrite(
+        [("acct", None), ("acct", "Jan 01 2020")],
+        [("-bad", None), ("foo", "nope"), ("bar", "10.0.1.1")],
+    )
+    assert maintenance.validate_state(storage, CONFIG).problems == [
+        "queue: 'acct' has no registration date",
+        "queue: 'acct' is listed more than once",
+        "users: '-bad' is not a valid username",
+        "users: 'foo' has invalid host 'nope'",
+        "users: 'bar' has host 10.0.1.1 outside 10.0.0.0/24",
+    ]
+
+
+def test_validate_corrupt_file(tmp_path: Path) -> None:
+    store = JsonStorage(tmp_path)
+    store.path.write_text('{"users": {"foo": }}', encoding="utf-8")
+    report = maintenance.validate_state(store, CONFIG)
+    assert report.problems == [
+        f"{store.path}: expected a string or null at offset 18"
+    ]
+
+
+def test_compact(storage: Storage) -> None:
+    storage.rewrite([], [("foo", "10.0.0.1"), ("foo", "10.0.0.2")])
+    assert maintenance.compact_state(storage) == (0, 1)
+    assert list(storage.iter_entries()) == [
+        Mutation("users", "foo", "10.0.0.2")
+    ]
+
+
+def test_compact_keeps_order_like_load(tmp_path: Path) -> None:
+    store = JournalStorage(tmp_path, delay=60)
+    store.rewrite(
+        [("a", "Jan 01 2020"), ("b", "Jan 02 2020")],
+        [("foo", "10.0.0.1"), ("bar", None), ("foo", "10.0.0.3")],
+    )
+    store.journal_path.write_text(
+        store.journal_path.read_text(encoding="utf-8")
+        + "".join(
+            mutation.to_json() + "\n"
+            for mutation in (
+                Mutation("queue", "a", delete=True),
+                Mutation("queue", "a", "Jan 03 2020"),
+                Mutation("users", "bar", "10.0.0.2"),
+            )
+        ),
+        encoding="utf-8",
+    )
+    expected = store.load()
+
+    assert maintenance.compact_state(store) == (2, 2)
+    assert list(store.load().queue.items()) == list(expected.queue.items())
+    assert list(store.load().users.items()) == list(expected.users.items())
+
+
+def test_reallocate(storage: Storage) -> None:
+    pool = maintenance.find_duplicates(storage, CONFIG)
+    assert pool.duplicates() == {"10.0.0.1": ["bar", "foo"]}
+
+    assert maintenance.reallocate(storage, CONFIG, dry_run=True)
+    assert maintenance.find_duplicates(storage, CONFIG).duplicates()
+
+    (change,) = maintenance.reallocate(storage, CONFIG)
+    assert change[:2] == ("foo", "10.0.0.1")
+    data = storage.load()
+    assert data.users["foo"] == change.new_host != "10.0.0.1"
+    assert data.queue == {"acct": "Jan 01 2020"}
+    assert not maintenance.find_duplicates(storage, CONFIG).duplicates()
+
+
+def test_reallocate_out_of_range(storage: Storage) -> None:
+    storage.rewrite([], [("foo", "192.0.2.1"), ("bar", "10.0.0.1")])
+    assert not maintenance.reallocate(storage, CONFIG)
+
+    (change,) = maintenance.reallocate(storage, CONFIG, out_of_range=True)
+    assert change.user == "foo"
+    assert CONFIG.bind_networks.index(change.new_host) is not None
+
+
+def test_reallocate_without_free_addresses(storage: Storage) -> None:
+    config = BotConfig(bind_host_net="10.0.0.0/31")
+    storage.rewrite(
+        [], [("a", "10.0.0.0"), ("b", "10.0.0.0"), ("c", "10.0.0.0")]
+    )
+    with pytest.raises(ValueError, match="so 1 users could not be moved"):
+        maintenance.reallocate(storage, config)
+
+    assert storage.load().users == dict.fromkeys("abc", "10.0.0.0")
@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+
+from bncbot.metrics import BotMetrics, MetricsServer
+
+
+def test_render() -> None:
+    metrics = BotMetrics()
+    metrics.lines_received.inc("PRIVMSG")
+    metrics.lines_received.inc("PRIVMSG")
+    metrics.hook_duration.observe(0.002, "on_privmsg")
+    metrics.add_callback("bncbot_bnc_users", "BNC users", lambda: 3)
+    text = metrics.render()
+    assert 'bncbot_lines_received_total{command="PRIVMSG"} 2' in text
+    assert (
+        'bncbot_hook_duration_seconds_bucket{handler="on_privmsg",le="0.001"} 0'
+        in text
+    )
+    assert (
+        'bncbot_hook_duration_seconds_bucket{handler="on_privmsg",le="0.005"} 1'
+        in text
+    )
+    assert 'bncbot_hook_duration_seconds_count{handler="on_privmsg"} 1' in text
+    assert "# TYPE bncbot_bnc_users gauge\nbncbot_bnc_users 3\n" in text
+
+
+async def test_server() -> None:
+    server = MetricsServer(lambda: "metric 1\n")
+    await server.start("127.0.0.1", 0)
+    try:
+        assert server.port is not None
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+    finally:
+        server.close()
+
+    assert response.startswith(b"HTTP/1.0 200 OK\r\n")
+    assert response.endswith(b"\r\n\r\nmetric 1\n")
+
+
+async def test_server_pages() -> None:
+    server = MetricsServer(lambda: "metric 1\n", {"/page": lambda: "page\n"})
+    await server.start("127.0.0.1", 0)
+    try:
+        assert server.port is not None
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"GET /page HTTP/1.0\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+    finally:
+        server.close()
+
+    assert response.endswith(b"\r\n\r\npage\n")
@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+from collections.abc import Awaitable, Callable
+
+import pytest
+
+from bncbot.correlate import Correlator
+from bncbot.nickserv import NICKSERV_ROUTES, NickServInfo
+
+
+def _writer(sent: list[str]) -> Callable[[str], Awaitable[None]]:
+    async def _send(line: str) -> None:
+        sent.append(line)
+
+    return _send
+
+
+def _make_info(
+    sent: list[str], *, concurrency: int = 4, timeout: float = 5
+) -> NickServInfo:
+    return NickServInfo(
+        Correlator({"nickserv": NICKSERV_ROUTES}),
+        _writer(sent),
+        timeout=timeout,
+        concurrency=concurrency,
+        cache_ttl=60,
+    )
+
+
+async def test_replies_matched_by_header() -> None:
+    sent: list[str] = []
+    info = _make_info(sent)
+    foo = asyncio.create_task(info.get_registered("Foo"))
+    bar = asyncio.create_task(info.get_registered("bar"))
+    await asyncio.sleep(0)
+    assert sent == ["INFO Foo", "INFO bar"]
+
+    # Replies arrive out of order
+    info.on_notice("Information on \x02bar\x02 (account bar):")
+    info.on_notice("Registered : Jan 01 00:00:00 2020 (5 years ago)")
+    info.on_notice("Information on \x02Foo\x02 (account Foo):")
+    info.on_notice("Registered : May 30 00:53:54 2017 (8 years ago)")
+    assert await foo == "May 30 00:53:54 2017 (8 years ago)"
+    assert await bar == "Jan 01 00:00:00 2020 (5 years ago)"
+
+    assert (
+        await info.get_registered("foo") == "May 30 00:53:54 2017 (8 years ago)"
+    )
+    assert len(sent) == 2
+
+
+async def test_fifo_fallback_and_concurrency_limit() -> None:
+    sent: list[str] = []
+    info = _make_info(sent, concurrency=1)
+    foo = asyncio.create_task(info.get_registered("foo"))
+    bar = asyncio.create_task(info.get_registered("bar"))
+    await asyncio.sleep(0)
+    assert sent == ["INFO foo"]
+
+    info.on_notice("Account registered: Jan 01 2020")
+    assert await foo == "Jan 01 2020"
+    await asyncio.sleep(0)
+    assert sent == ["INFO foo", "INFO bar"]
+
+    info.on_notice("bar isn't registered.")
+    assert await bar is None
+
+
+async def test_timeout() -> None:
+    sent: list[str] = []
+    info = _make_info(sent, timeout=0.01)
+    owner = asyncio.create_task(info.get_registered("foo"))
+    waiter = asyncio.create_task(info.get_registered("foo"))
+    for task in (owner, waiter):
+        with pytest.raises(asyncio.TimeoutError):
+            await task
+
+    assert sent == ["INFO foo"]
+    assert not info.pending
+    assert not info.queries.pending
+    assert not info.cache.get(info.queries.casefold("foo"))[0]
+
+
+async def test_timeout_starts_once_written() -> None:
+    release = asyncio.Event()
+
+    async def _send(line: str) -> None:
+        await release.wait()
+
+    info = NickServInfo(
+        Correlator({"nickserv": NICKSERV_ROUTES}),
+        _send,
+        timeout=0.05,
+        concurrency=1,
+        cache_ttl=60,
+    )
+    task = asyncio.create_task(info.get_registered("foo"))
+    await asyncio.sleep(0.1)
+    assert not task.done()
+
+    release.set()
+    await asyncio.sleep(0)
+    info.on_notice("Information on foo (account foo):")
+    info.on_notice("Registered : Jan 01 2020")
+    assert await task == "Jan 01 2020"
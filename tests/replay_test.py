@@ -0,0 +1,25 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import sys
+
+import pytest
+
+from benchmarks import replay
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32",
+    reason="Conn.run needs loop signal handlers, which Windows lacks",
+)
+@pytest.mark.filterwarnings(
+    "ignore:Server\\(\\) is deprecated:DeprecationWarning"
+)
+@pytest.mark.parametrize("name", list(replay.ScenarioName))
+async def test_scenario_runs_end_to_end(name: replay.ScenarioName) -> None:
+    scenario = replay.SCENARIOS[name](20)
+    result = await replay.run_scenario(scenario, rate=0, timeout=30)
+    assert result.lines_in > 0
+    assert result.p99 >= result.p50 > 0
@@ -0,0 +1,129 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+
+from bncbot.sendqueue import SendQueue, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(2, 3, clock=clock)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == 0.5
+
+    clock.now = 0.5
+    assert bucket.take() == 0
+    assert bucket.take() == 0.5
+
+    clock.now = 100
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == 0.5
+
+
+def test_unlimited_bucket() -> None:
+    bucket = TokenBucket(0, 1)
+    assert all(bucket.take() == 0 for _ in range(100))
+
+
+async def test_control_lines_go_first() -> None:
+    sent: list[str] = []
+    queue = SendQueue(
+        sent.append,
+        control=TokenBucket(0, 1),
+        query=TokenBucket(0, 1),
+        user=TokenBucket(0, 1),
+    )
+    queue.put("PRIVMSG #chan :one")
+    queue.put("PRIVMSG *controlpanel :two", "control")
+    queue.put("PRIVMSG #chan :three")
+    assert await queue.flush(timeout=1)
+    assert sent == [
+        "PRIVMSG *controlpanel :two",
+        "PRIVMSG #chan :one",
+        "PRIVMSG #chan :three",
+    ]
+    queue.close()
+
+
+async def test_rate_limited_lines_wait() -> None:
+    sent: list[str] = []
+    queue = SendQueue(
+        sent.append,
+        control=TokenBucket(0, 1),
+        query=TokenBucket(0, 1),
+        user=TokenBucket(10, 2),
+    )
+    for i in range(4):
+        queue.put(f"PRIVMSG #chan :{i}")
+
+    assert not await queue.flush(timeout=0.001)
+    assert queue.depth == 2
+    assert await queue.flush(timeout=1)
+
+    stats = queue.stats()["user"]
+    assert stats.sent == 4
+    assert stats.depth == 0
+    assert stats.max_wait > 0
+    queue.close()
+
+
+async def test_control_line_skips_user_wait() -> None:
+    sent: list[str] = []
+    queue = SendQueue(
+        sent.append,
+        control=TokenBucket(0, 1),
+        query=TokenBucket(0, 1),
+        user=TokenBucket(0.5, 1),
+    )
+    queue.put("PRIVMSG #chan :one")
+    queue.put("PRIVMSG #chan :two")
+    await asyncio.sleep(0.01)
+    assert sent == ["PRIVMSG #chan :one"]
+
+    queue.put("PRIVMSG *controlpanel :three", "control")
+    # Well before the user lane's next token, 2s away
+    for _ in range(50):
+        if len(sent) == 2:
+            break
+
+        await asyncio.sleep(0.01)
+
+    assert sent == ["PRIVMSG #chan :one", "PRIVMSG *controlpanel :three"]
+    assert queue.depth == 1
+    queue.close()
+
+
+async def test_written_future_set_on_write() -> None:
+    sent: list[str] = []
+    queue = SendQueue(
+        sent.append,
+        control=TokenBucket(0, 1),
+        query=TokenBucket(0, 1),
+        user=TokenBucket(0.5, 1),
+    )
+    loop = asyncio.get_running_loop()
+    first, second = loop.create_future(), loop.create_future()
+    queue.put("PRIVMSG #chan :one", written=first)
+    queue.put("PRIVMSG #chan :two", written=second)
+    await asyncio.wait_for(first, 1)
+    assert sent == ["PRIVMSG #chan :one"]
+    assert not second.done()
+
+    # The query lane has its own bucket
+    query = loop.create_future()
+    queue.put("WHOIS foo", "query", written=query)
+    await asyncio.wait_for(query, 1)
+    assert sent == ["PRIVMSG #chan :one", "WHOIS foo"]
+    assert not second.done()
+    queue.close()
@@ -0,0 +1,152 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+from pathlib import Path
+
+from bncbot.config import BNCData
+from bncbot.storage import (
+    JournalStorage,
+    JsonStorage,
+    Mutation,
+    migrate_storage,
+)
+
+
+async def test_saves_are_coalesced(tmp_path: Path) -> None:
+    storage = JsonStorage(tmp_path, delay=0.01)
+    data = storage.load()
+    for i in range(100):
+        data.users[f"user{i}"] = None
+        storage.record(Mutation("users", f"user{i}"))
+
+    await asyncio.sleep(0.1)
+    assert storage.writes == 1
+    assert BNCData.load_config(storage.path) == data
+    assert list(tmp_path.iterdir()) == [storage.path]
+
+
+async def test_flush_writes_pending_changes(tmp_path: Path) -> None:
+    storage = JsonStorage(tmp_path, delay=60)
+    storage.load().queue["foo"] = "today"
+    storage.record(Mutation("queue", "foo", "today"))
+    assert not storage.path.exists()
+
+    await storage.flush()
+    assert storage.writes == 1
+    assert not storage.dirty
+    assert BNCData.load_config(storage.path).queue == {"foo": "today"}
+
+    await storage.flush()
+    assert storage.writes == 1
+
+
+def test_save_without_loop(tmp_path: Path) -> None:
+    storage = JsonStorage(tmp_path)
+    storage.load().users["foo"] = "bar"
+    storage.schedule_save()
+    assert BNCData.load_config(storage.path).users == {"foo": "bar"}
+
+
+def _apply(storage: JournalStorage, mutation: Mutation) -> None:
+    mutation.apply(storage.data)
+    storage.record(mutation)
+
+
+async def test_journal_replay(tmp_path: Path) -> None:
+    storage = JournalStorage(tmp_path, delay=60)
+    storage.load()
+    _apply(storage, Mutation("users", "foo", "127.0.0.1"))
+    _apply(storage, Mutation("users", "bar", None))
+    _apply(storage, Mutation("queue", "baz", "today"))
+    _apply(storage, Mutation("users", "foo", delete=True))
+    await storage.flush()
+
+    assert not storage.snapshot_path.exists()
+    assert storage.journal_path.read_text().splitlines()[0] == (
+        '{"generation": 0}'
+    )
+    assert len(storage.journal_path.read_text().splitlines()) == 5
+
+    storage.journal_path.write_text(
+        storage.journal_path.read_text() + '{"op": "set", "tab'
+    )
+    reloaded = JournalStorage(tmp_path)
+    assert reloaded.load() == BNCData(
+        users={"bar": None}, queue={"baz": "today"}
+    )
+    assert reloaded.journal_entries == 4
+
+
+async def test_journal_compaction(tmp_path: Path) -> None:
+    storage = JournalStorage(tmp_path, delay=60, compact_threshold=3)
+    storage.load()
+    for i in range(3):
+        _apply(storage, Mutation("users", f"user{i}", f"127.0.0.{i}"))
+
+    await storage.flush()
+    assert storage.journal_path.read_text() == '{"generation": 1}\n'
+    assert BNCData.load_config(storage.snapshot_path) == storage.data
+    assert storage.snapshot_generation() == 1
+
+    _apply(storage, Mutation("users", "user0", delete=True))
+    await storage.flush()
+    reloaded = JournalStorage(tmp_path)
+    assert reloaded.load() == storage.data
+    assert reloaded.journal_entries == 1
+
+
+async def test_stale_journal_not_replayed(tmp_path: Path) -> None:
+    storage = JournalStorage(tmp_path, delay=60, compact_threshold=2)
+    storage.load()
+    _apply(storage, Mutation("users", "foo", "127.0.0.1"))
+    await storage.flush()
+    journal = storage.journal_path.read_text()
+
+    # Compacting, which folds in an unwritten change
+    _apply(storage, Mutation("users", "foo", "127.0.0.2"))
+    await storage.flush()
+    assert storage.snapshot_generation() == 1
+
+    # As if the bot stopped before the journal was replaced
+    storage.journal_path.write_text(journal)
+    reloaded = JournalStorage(tmp_path)
+    assert reloaded.load() == BNCData(users={"foo": "127.0.0.2"})
+    assert reloaded.journal_entries == 0
+    assert list(reloaded.iter_entries()) == [
+        Mutation("users", "foo", "127.0.0.2")
+    ]
+
+
+def test_rewrite_ignores_old_journal(tmp_path: Path) -> None:
+    storage = JournalStorage(tmp_path)
+    storage.journal_path.write_text(
+        Mutation("users", "foo", "127.0.0.1").to_json() + "\n"
+    )
+    journal = storage.journal_path.read_text()
+    storage.rewrite([], [("bar", None)])
+
+    # Legacy journals, without a header, are generation 0
+    storage.journal_path.write_text(journal)
+    assert JournalStorage(tmp_path).load() == BNCData(users={"bar": None})
+
+
+def test_legacy_journal_replayed(tmp_path: Path) -> None:
+    BNCData(users={"foo": None}).save_config(tmp_path / "bnc.snapshot.json")
+    storage = JournalStorage(tmp_path)
+    storage.journal_path.write_text(
+        Mutation("users", "bar", "127.0.0.1").to_json() + "\n"
+    )
+    assert storage.load() == BNCData(users={"foo": None, "bar": "127.0.0.1"})
+    assert storage.generation == 0
+
+
+def test_migrate_json_to_journal(tmp_path: Path) -> None:
+    data = BNCData(users={"foo": "127.0.0.1"}, queue={"bar": "today"})
+    data.save_config(tmp_path / "bnc.json")
+
+    journal = JournalStorage(tmp_path)
+    migrate_storage(JsonStorage(tmp_path), journal)
+    assert JournalStorage(tmp_path).load() == data
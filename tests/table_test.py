@@ -0,0 +1,50 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from bncbot.table import TableParser
+
+LIST_NETWORKS = """\
++---------+-------+------------------+----------+----------+
+| Network | OnIRC | IRC Server       | IRC User | Channels |
++---------+-------+------------------+----------+----------+
+| Snoonet | Yes   | irc.snoonet.org  | foo      | 3        |
+| Other   | No    |                  |          | 0        |
++---------+-------+------------------+----------+----------+"""
+
+
+def test_parse_list_networks() -> None:
+    parser = TableParser()
+    rows = [
+        row
+        for line in LIST_NETWORKS.splitlines()
+        if (row := parser.feed(line)) is not None
+    ]
+    assert parser.done
+    assert parser.headers == (
+        "Network",
+        "OnIRC",
+        "IRC Server",
+        "IRC User",
+        "Channels",
+    )
+    assert [row["Network"] for row in rows] == ["Snoonet", "Other"]
+    assert rows[1]["IRC Server"] == ""
+
+
+def test_empty_table() -> None:
+    parser = TableParser()
+    for line in ("+------+", "| Host |", "+======+", "+------+"):
+        assert parser.feed(line) is None
+
+    assert parser.done
+    assert parser.rows == 0
+
+
+def test_rejects_other_lines() -> None:
+    parser = TableParser()
+    with pytest.raises(ValueError, match="Not a table line"):
+        parser.feed("No such user")
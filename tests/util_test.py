@@ -11,3 +11,54 @@ from bncbot import util
 @pytest.mark.parametrize(["text", "result"], [("foo", "foo")])
 def test_sanitize_username(text: str, result: str) -> None:
     assert util.sanitize_username(text) == result
+
+
+@pytest.mark.parametrize(
+    ["mask", "result"],
+    [
+        ("nick!user@snoonet/staff/nick", True),
+        ("Nick!User@Snoonet/Manager/Nick", True),
+        ("nick!user@snoonet/user/nick", False),
+        ("nick!user@example.com", False),
+    ],
+)
+def test_mask_matcher(mask: str, result: bool) -> None:
+    matcher = util.MaskMatcher(["*!*@snoonet/staff/*", "*!*@SNOONET/manager/*"])
+    assert matcher.matches(mask) is result
+
+
+def test_mask_matcher_empty() -> None:
+    assert not util.MaskMatcher([]).matches("nick!user@host")
+
+
+def test_ttl_cache() -> None:
+    now = [0.0]
+    cache = util.TTLCache[str, int](max_size=2, clock=lambda: now[0])
+    cache.set("a", 1, ttl=10)
+    cache.set("b", 2, ttl=20)
+    assert cache.get("a") == (True, 1)
+
+    now[0] = 15
+    assert cache.get("a") == (False, None)
+    assert cache.get("b") == (True, 2)
+
+    cache.set("c", 3, ttl=20)
+    cache.set("d", 4, ttl=20)
+    assert len(cache) == 2
+    assert cache.get("b") == (False, None)
+
+
+def test_irc_identity_uses_rfc1459_casemapping() -> None:
+    identity = util.IrcIdentity(nick="Bot[1]", log_chan="#Log\\s")
+    assert identity.is_self("bot{1}")
+    assert not identity.is_self("bot{2}")
+    assert identity.is_log_chan("#log|s")
+
+    identity.set_nick("Other~")
+    identity.update(log_chan=None, cmd_prefix="!")
+    assert identity.is_self("other^")
+    assert not identity.is_self("bot{1}")
+    assert not identity.is_log_chan("#log|s")
+    assert identity.is_command("!help")
+    assert not identity.is_command(".help")
+    assert not identity.is_command("")
@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: 2019 Snoonet
+# SPDX-FileCopyrightText: 2020-present linuxdaemon <linuxdaemon.irc@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+from collections.abc import Awaitable, Callable
+
+import pytest
+
+from bncbot.whois import WhoisLookup
+
+
+def _writer(sent: list[str]) -> Callable[[str], Awaitable[None]]:
+    async def _send(line: str) -> None:
+        sent.append(line)
+
+    return _send
+
+
+def _make_lookup(sent: list[str], timeout: float = 5) -> WhoisLookup:
+    return WhoisLookup(
+        _writer(sent), timeout=timeout, cache_ttl=60, negative_ttl=60
+    )
+
+
+async def test_concurrent_lookups_share_whois() -> None:
+    sent: list[str] = []
+    whois = _make_lookup(sent)
+    first = asyncio.create_task(whois.get_account("Foo"))
+    second = asyncio.create_task(whois.get_account("FOO"))
+    await asyncio.sleep(0)
+    assert sent == ["WHOIS Foo"]
+
+    whois.on_account("foo", "FooAcct")
+    whois.on_end("foo")
+    assert await first == "FooAcct"
+    assert await second == "FooAcct"
+    assert not whois.pending
+
+    assert await whois.get_account("foo") == "FooAcct"
+    assert sent == ["WHOIS Foo"]
+
+
+async def test_not_logged_in() -> None:
+    sent: list[str] = []
+    whois = _make_lookup(sent)
+    task = asyncio.create_task(whois.get_account("bar"))
+    await asyncio.sleep(0)
+    whois.on_end("bar")
+    assert await task is None
+
+
+async def test_timeout() -> None:
+    sent: list[str] = []
+    whois = _make_lookup(sent, timeout=0.01)
+    with pytest.raises(asyncio.TimeoutError):
+        await whois.get_account("baz")
+
+    assert not whois.pending
+
+    # Timeouts aren't cached
+    with pytest.raises(asyncio.TimeoutError):
+        await whois.get_account("baz")
+
+    assert sent == ["WHOIS baz", "WHOIS baz"]
+
+
+async def test_cancelled_owner_releases_waiters() -> None:
+    sent: list[str] = []
+    whois = _make_lookup(sent)
+    owner = asyncio.create_task(whois.get_account("baz"))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(whois.get_account("baz"))
+    await asyncio.sleep(0)
+
+    owner.cancel()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(waiter, 1)
+
+    assert owner.cancelled()
+    assert not whois.pending
+    assert sent == ["WHOIS baz"]
+
+
+async def test_timeout_starts_once_written() -> None:
+    release = asyncio.Event()
+    sent: list[str] = []
+
+    async def _send(line: str) -> None:
+        await release.wait()
+        sent.append(line)
+
+    whois = WhoisLookup(_send, timeout=0.05, cache_ttl=60, negative_ttl=60)
+    task = asyncio.create_task(whois.get_account("foo"))
+    await asyncio.sleep(0.1)
+    assert not task.done()
+
+    release.set()
+    await asyncio.sleep(0)
+    assert sent == ["WHOIS foo"]
+    whois.on_account("foo", "FooAcct")
+    assert await task == "FooAcct"